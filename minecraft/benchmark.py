@@ -0,0 +1,547 @@
+#!/usr/bin/env python
+
+"""
+Script Name: benchmark.py
+Author: Brayden Chan
+Date Created: 2026-10-18
+Date Modified: 2026-10-18
+Description: A script to benchmark the backup types of server.py on generated Minecraft worlds.
+
+Dependencies:
+    - Python 3.6+
+    - Linux or macOS
+    - server.py in the same directory, along with whatever it needs for the backup types being benchmarked
+
+Version: 1.1
+
+License: This file is licensed under the MIT License. See LICENSE for more information.
+
+Contact Information:
+    - GitHub: https://github.com/megabyte6
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import server  # noqa: E402
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+
+# NBT tag types.
+TAG_END = 0
+TAG_BYTE = 1
+TAG_INT = 3
+TAG_LONG = 4
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_LONG_ARRAY = 12
+
+BLOCKS = [
+    "minecraft:stone",
+    "minecraft:deepslate",
+    "minecraft:dirt",
+    "minecraft:grass_block",
+    "minecraft:water",
+    "minecraft:gravel",
+    "minecraft:coal_ore",
+    "minecraft:iron_ore",
+    "minecraft:andesite",
+    "minecraft:granite",
+    "minecraft:diorite",
+    "minecraft:copper_ore",
+]
+
+
+def nbt_name(tag_type, name):
+    return bytes([tag_type]) + nbt_string(name)
+
+
+def nbt_string(value):
+    encoded = value.encode()
+    return struct.pack(">H", len(encoded)) + encoded
+
+
+def nbt_compound(name, children):
+    """
+    Encode a named compound tag.
+
+    Args:
+        name (str): The name of the tag.
+        children (list): The encoded named tags inside the compound.
+
+    Returns:
+        The encoded tag.
+    """
+
+    return nbt_name(TAG_COMPOUND, name) + b"".join(children) + bytes([TAG_END])
+
+
+def nbt_compound_list(name, compounds):
+    """
+    Encode a named list of compounds.
+
+    Args:
+        name (str): The name of the tag.
+        compounds (list): The encoded named tags of each compound in the list.
+
+    Returns:
+        The encoded tag.
+    """
+
+    return (
+        nbt_name(TAG_LIST, name)
+        + bytes([TAG_COMPOUND])
+        + struct.pack(">i", len(compounds))
+        + b"".join(b"".join(children) + bytes([TAG_END]) for children in compounds)
+    )
+
+
+def nbt_long_array(name, data):
+    return nbt_name(TAG_LONG_ARRAY, name) + struct.pack(">i", len(data) // 8) + data
+
+
+def packed_blocks(rng, palette_size):
+    """
+    Generate the packed block state indices of a chunk section, with long runs like real terrain has.
+
+    Args:
+        rng (Random): The random number generator to use.
+        palette_size (int): The number of block states in the section's palette.
+
+    Returns:
+        The packed indices as big-endian longs.
+    """
+
+    bits = max(4, (palette_size - 1).bit_length())
+    longs = -(-4096 // (64 // bits))
+    patterns = [rng.getrandbits(64).to_bytes(8, "big") for _ in range(palette_size)]
+    data = bytearray()
+    while len(data) < longs * 8:
+        data += rng.choice(patterns) * rng.randint(1, 24)
+    del data[longs * 8 :]
+    # Sprinkle in ores and caves.
+    for _ in range(rng.randint(4, 40)):
+        position = rng.randrange(longs) * 8
+        data[position : position + 8] = rng.getrandbits(64).to_bytes(8, "big")
+    return bytes(data)
+
+
+def chunk_nbt(rng, x, z):
+    """
+    Generate the NBT of a chunk in the current Anvil format.
+
+    Args:
+        rng (Random): The random number generator to use.
+        x (int): The chunk's X coordinate.
+        z (int): The chunk's Z coordinate.
+
+    Returns:
+        The uncompressed NBT.
+    """
+
+    sections = []
+    for y in range(-4, 20):
+        if y > rng.randint(3, 7):
+            palette = [[nbt_name(TAG_STRING, "Name") + nbt_string("minecraft:air")]]
+            block_states = [nbt_compound_list("palette", palette)]
+        else:
+            palette_size = rng.randint(2, len(BLOCKS))
+            palette = [[nbt_name(TAG_STRING, "Name") + nbt_string(block)] for block in rng.sample(BLOCKS, palette_size)]
+            block_states = [
+                nbt_compound_list("palette", palette),
+                nbt_long_array("data", packed_blocks(rng, palette_size)),
+            ]
+        sections.append(
+            [
+                nbt_name(TAG_BYTE, "Y") + struct.pack(">b", y),
+                nbt_compound("block_states", block_states),
+                nbt_compound(
+                    "biomes", [nbt_compound_list("palette", [[nbt_name(TAG_STRING, "") + nbt_string("plains")]])]
+                ),
+            ]
+        )
+
+    heightmap = b"".join(struct.pack(">q", rng.getrandbits(62)) for _ in range(37))
+    return nbt_compound(
+        "",
+        [
+            nbt_name(TAG_INT, "DataVersion") + struct.pack(">i", 3953),
+            nbt_name(TAG_INT, "xPos") + struct.pack(">i", x),
+            nbt_name(TAG_INT, "zPos") + struct.pack(">i", z),
+            nbt_name(TAG_INT, "yPos") + struct.pack(">i", -4),
+            nbt_name(TAG_STRING, "Status") + nbt_string("minecraft:full"),
+            nbt_name(TAG_LONG, "LastUpdate") + struct.pack(">q", rng.randrange(1 << 24)),
+            nbt_name(TAG_LONG, "InhabitedTime") + struct.pack(">q", rng.choice([0, 0, 0, 40, 1200, 72000])),
+            nbt_compound_list("sections", sections),
+            nbt_compound(
+                "Heightmaps",
+                [nbt_long_array("MOTION_BLOCKING", heightmap), nbt_long_array("WORLD_SURFACE", heightmap)],
+            ),
+        ],
+    )
+
+
+def generate_region(path, rng, region_x, region_z, chunks):
+    """
+    Generate a region file with zlib compressed chunks.
+
+    Args:
+        path (str): The region file to write.
+        rng (Random): The random number generator to use.
+        region_x (int): The region's X coordinate.
+        region_z (int): The region's Z coordinate.
+        chunks (int): How many of the region's 1024 chunks to generate.
+    """
+
+    timestamp = int(time.time())
+    records = {}
+    for index in rng.sample(range(1024), chunks):
+        data = zlib.compress(chunk_nbt(rng, region_x * 32 + index % 32, region_z * 32 + index // 32))
+        records[index] = (timestamp - rng.randrange(86400), struct.pack(">IB", len(data) + 1, 2) + data)
+    server.write_region(path, records)
+
+
+def generate_world(server_path, scale, seed):
+    """
+    Generate the world saves of a server with region files, 'level.dat' and player data.
+
+    Args:
+        server_path (str): The server directory to generate the worlds in.
+        scale (int): How many regions wide the overworld is. The nether and end are half as wide.
+        seed (int): The seed for the random number generator.
+    """
+
+    rng = random.Random(seed)
+    dimensions = [("world", "", scale), ("world_nether", "DIM-1", max(1, scale // 2)), ("world_the_end", "DIM1", 1)]
+    for world_save, dimension, width in dimensions:
+        region_directory = os.path.join(server_path, world_save, dimension, "region")
+        os.makedirs(region_directory)
+        for region_x in range(-(width // 2), width - width // 2):
+            for region_z in range(-(width // 2), width - width // 2):
+                path = os.path.join(region_directory, f"r.{region_x}.{region_z}.mca")
+                generate_region(path, rng, region_x, region_z, rng.randint(256, 1024))
+
+        with gzip.open(os.path.join(server_path, world_save, "level.dat"), "wb") as f:
+            f.write(nbt_compound("", [nbt_compound("Data", [nbt_name(TAG_LONG, "Time") + struct.pack(">q", 1)])]))
+        os.makedirs(os.path.join(server_path, world_save, "playerdata"))
+        for _ in range(8):
+            player = "%032x" % rng.getrandbits(128)
+            with gzip.open(os.path.join(server_path, world_save, "playerdata", f"{player}.dat"), "wb") as f:
+                f.write(nbt_compound("", [nbt_long_array("Inventory", bytes(rng.getrandbits(8) for _ in range(4096)))]))
+    with open(os.path.join(server_path, "start.py"), "w"):
+        pass
+
+
+def touch_chunks(server_path, chunks, seed):
+    """
+    Rewrite a few chunks of the overworld the way a server saving them would.
+
+    Args:
+        server_path (str): The server directory.
+        chunks (int): How many chunks to rewrite.
+        seed (int): The seed for the random number generator.
+
+    Returns:
+        The size in bytes of the rewritten chunks as stored in the region file.
+    """
+
+    rng = random.Random(seed)
+    region_directory = os.path.join(server_path, "world", "region")
+    for region_file in rng.sample(sorted(os.listdir(region_directory)), 1):
+        path = os.path.join(region_directory, region_file)
+        with open(path, "rb") as f:
+            header = server.read_region_header(f)
+            records = {
+                index: (timestamp, server.read_region_chunk(f, offset, sector_count))
+                for index, (offset, sector_count, timestamp) in enumerate(header)
+                if offset
+            }
+        changed_bytes = 0
+        for index in rng.sample(sorted(records), min(chunks, len(records))):
+            data = zlib.compress(chunk_nbt(rng, index % 32, index // 32))
+            records[index] = (int(time.time()) + 1, struct.pack(">IB", len(data) + 1, 2) + data)
+            changed_bytes += len(records[index][1])
+        server.write_region(path, records)
+    return changed_bytes
+
+
+def tree_size(path):
+    """
+    Get the total size and number of files in a directory tree.
+
+    Args:
+        path (str): The directory.
+
+    Returns:
+        A tuple of the total size in bytes and the number of files.
+    """
+
+    size = 0
+    files = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            size += os.path.getsize(os.path.join(root, name))
+            files += 1
+    return size, files
+
+
+def region_chunks(path):
+    """
+    Read the chunks of a region file.
+
+    Args:
+        path (str): The region file.
+
+    Returns:
+        A list of (index, timestamp, data) tuples with the chunks decompressed where possible, or None if the file
+        isn't a valid region file.
+    """
+
+    chunks = []
+    with open(path, "rb") as f:
+        try:
+            header = server.read_region_header(f)
+            for index, (offset, sector_count, timestamp) in enumerate(header):
+                if offset == 0:
+                    continue
+                record = server.read_region_chunk(f, offset, sector_count)
+                try:
+                    data = server.decompress_chunk(record)
+                except (zlib.error, OSError, EOFError):
+                    data = None
+                chunks.append((index, timestamp, record if data is None else data))
+        except ValueError:
+            return None
+    return chunks
+
+
+def worlds_digest(server_path):
+    """
+    Hash the contents of a server's world saves, ignoring file times.
+
+    Region files are hashed by their decompressed chunks rather than their bytes, because restoring an incremental
+    backup packs the chunks back to back, which real servers don't do.
+
+    Args:
+        server_path (str): The server directory.
+
+    Returns:
+        The SHA-256 of every world file's path and contents.
+    """
+
+    digest = hashlib.sha256()
+    for world_save in ["world", "world_nether", "world_the_end"]:
+        for root, directories, names in os.walk(os.path.join(server_path, world_save)):
+            directories.sort()
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, server_path).encode())
+                chunks = region_chunks(path) if name.endswith(".mca") else None
+                if chunks is not None:
+                    for index, timestamp, data in chunks:
+                        digest.update(struct.pack(">HIQ", index, timestamp, len(data)))
+                        digest.update(data)
+                    continue
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(block)
+    return digest.hexdigest()
+
+
+def run(arguments, cwd):
+    """
+    Run server.py and measure it.
+
+    Args:
+        arguments (list): The arguments to pass to server.py.
+        cwd (str): The directory to run it in.
+
+    Returns:
+        A tuple of whether it succeeded, the wall time in seconds and the peak RSS in KiB.
+    """
+
+    with tempfile.TemporaryFile() as errors:
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, SERVER_SCRIPT, *arguments], cwd=cwd, stdout=subprocess.DEVNULL, stderr=errors
+        )
+        # wait4() reports the resource usage of this one process tree instead of every child so far.
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - started
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+
+        if process.returncode != 0:
+            errors.seek(0)
+            print(f"'server.py {' '.join(arguments)}' failed:\n{errors.read().decode()}", file=sys.stderr)
+
+    # macOS reports bytes, Linux reports KiB.
+    peak_rss = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return process.returncode == 0, elapsed, peak_rss
+
+
+def backend_available(backend):
+    """
+    Check if the tools a backup type needs are installed.
+
+    Args:
+        backend (str): A '--compression' choice of server.py, or 'incremental'.
+
+    Returns:
+        True if the backup type can be benchmarked.
+    """
+
+    if backend in ["incremental", "seekable"]:
+        return True
+    if backend == "7z":
+        return shutil.which("7z") is not None
+    return any(command is None or shutil.which(command[0]) for command in server.tar_compressors[backend])
+
+
+def benchmark_backend(backend, server_path, jobs, world_bytes, expected_digest):
+    """
+    Back up and restore a server with one backup type.
+
+    Args:
+        backend (str): A '--compression' choice of server.py, or 'incremental'.
+        server_path (str): The server directory.
+        jobs (int): The number of jobs to pass to server.py.
+        world_bytes (int): The size of the world saves in bytes.
+        expected_digest (str): The digest of the world saves before the backup.
+
+    Returns:
+        A list of result dictionaries. Incremental backups also get results for a second backup with nothing changed
+        and a third after a few chunks were changed. Their 'ratio' compares what was stored with the changed chunks
+        rather than with the whole world.
+    """
+
+    backup_directory = os.path.join(server_path, "backup")
+    if os.path.exists(backup_directory):
+        shutil.rmtree(backup_directory)
+    name = os.path.basename(server_path)
+    cwd = os.path.dirname(server_path)
+
+    runs = [backend] if backend != "incremental" else ["incremental", "incremental-unchanged", "incremental-changed"]
+    results = []
+    for run_name in runs:
+        changed_bytes = 0
+        if run_name == "incremental-changed":
+            # Make sure the changed region gets a new modification time.
+            time.sleep(1)
+            changed_bytes = touch_chunks(server_path, 16, 1)
+            expected_digest = worlds_digest(server_path)
+        size_before = tree_size(backup_directory)[0] if run_name != backend else 0
+
+        arguments = ["-b", "-i"] if backend == "incremental" else ["-b", "--compression", backend]
+        ok, backup_seconds, peak_rss = run([name, *arguments, "--jobs", str(jobs)], cwd)
+        # Backups are named after the time they were made, so wait for a new name.
+        time.sleep(1)
+        result = {
+            "backend": run_name,
+            "ok": ok,
+            "backup_seconds": round(backup_seconds, 3),
+            "throughput_mib_s": round(world_bytes / 1024**2 / backup_seconds, 2),
+            "peak_rss_kib": peak_rss,
+        }
+        results.append(result)
+        if not ok:
+            continue
+
+        result["backup_bytes"] = tree_size(backup_directory)[0] - size_before
+        if run_name == backend:
+            result["ratio"] = round(world_bytes / max(result["backup_bytes"], 1), 3)
+        else:
+            # Only the changes are stored, so comparing them with the whole world would overstate the savings.
+            result["changed_bytes"] = changed_bytes
+            result["ratio"] = round(changed_bytes / max(result["backup_bytes"], 1), 3) if changed_bytes else None
+
+        if backend == "incremental":
+            backup = server.list_snapshots(os.path.join(backup_directory, "repository"))[-1]
+        else:
+            backup = next(file for file in os.listdir(backup_directory) if not file.startswith("."))
+        ok, restore_seconds, restore_rss = run([name, "-y", "-r", backup], cwd)
+        result["restore_seconds"] = round(restore_seconds, 3)
+        result["restore_peak_rss_kib"] = restore_rss
+        result["restore_verified"] = ok and worlds_digest(server_path) == expected_digest
+    return results
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the backup types of server.py on generated Minecraft worlds.")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=[*server.compression_file_extensions, "incremental"],
+        help="Specify which backup types to benchmark. Defaults to every one whose tools are installed.",
+    )
+    parser.add_argument(
+        "--scale",
+        type=int,
+        default=2,
+        help="Specify how many regions wide the generated overworld is. Each region is 1-5 MiB. Default is 2.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Specify the seed for generating the worlds")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Specify the '--jobs' passed to server.py. Defaults to the number of CPUs.",
+    )
+    parser.add_argument("--output", help="Write the results to this file instead of printing them")
+    parser.add_argument("--keep", metavar="DIRECTORY", help="Generate the worlds in this directory and keep them")
+
+    args = parser.parse_args()
+
+    backends = args.backends or [
+        backend for backend in [*server.compression_file_extensions, "incremental"] if backend_available(backend)
+    ]
+
+    work_directory = args.keep or tempfile.mkdtemp(prefix="mc-benchmark-")
+    server_path = os.path.join(work_directory, "benchmark")
+    try:
+        print(f"Generating worlds in '{server_path}'...", file=sys.stderr)
+        generate_world(server_path, args.scale, args.seed)
+        world_bytes, world_files = tree_size(server_path)
+        digest = worlds_digest(server_path)
+
+        results = []
+        for backend in backends:
+            print(f"Benchmarking {backend}...", file=sys.stderr)
+            results.extend(benchmark_backend(backend, server_path, args.jobs, world_bytes, digest))
+            digest = worlds_digest(server_path)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_directory)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "jobs": args.jobs,
+        "world": {"bytes": world_bytes, "files": world_files, "scale": args.scale, "seed": args.seed},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
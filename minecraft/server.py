@@ -4,15 +4,16 @@
 Script Name: server.py
 Author: Brayden Chan
 Date Created: 2023-08-24
-Date Modified: 2024-06-23
+Date Modified: 2026-10-18
 Description: A script to set up and manage Minecraft servers.
 
 Dependencies:
     - Python 3.6+
     - tmux
     - 7z (or tar if compressing to any .tar.* file)
+    - ssh (only to replicate backups to another host)
 
-Version: 2.3
+Version: 2.45
 
 License: This file is licensed under the MIT License. See LICENSE for more information.
 
@@ -20,355 +21,6416 @@ Contact Information:
     - GitHub: https://github.com/megabyte6
 """
 
+import asyncio
+import atexit
+import bz2
+import gzip
+import hashlib
+import json
+import lzma
+import math
 import os
+import re
+import select
+import shlex
 import shutil
+import signal
+import socket
 import stat
+import struct
 import subprocess
 import sys
+import tarfile
+import threading
+import time
+import types
+import zlib
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from itertools import chain, zip_longest
+from socketserver import ThreadingMixIn
+
+# The generated 'update.py' without its first line. 'server.py' runs the same code in this process as 'updater'.
+UPDATE_SCRIPT = """
+import glob
+import hashlib
+import http.client
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
 from argparse import ArgumentParser
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
 
-def add_scripts(server_name):
-    """
-    Add custom scripts to the server directory.
+API_URL = os.environ.get("PAPERMC_API_URL", "https://api.papermc.io/v2/projects/paper")
 
-    Args:
-        server_name (str): The name of the server to add the scripts to.
-    """
+# Read downloads in 1 MiB blocks so the JAR never has to fit in memory.
+CHUNK_SIZE = 1024 * 1024
 
-    if sys.executable.endswith("python3"):
-        python_executable = "python3"
-    else:
-        python_executable = "python"
+# Seconds to trust cached version and build lists before asking the API again.
+CACHE_TTL = 3600
 
-    update_script = (
-        f"#!/usr/bin/env {python_executable}\n\n"
-        """
-import json
-import os
-import sys
-import urllib.request
-from argparse import ArgumentParser
+# Plugins to keep up to date, as {"plugins": [{"url": "...", "sha256": "...", "file": "..."}]}. Only 'url' is
+# required. Without 'sha256', a plugin is downloaded again only when its host reports that it changed.
+PLUGINS_PATH = "plugins.json"
+PLUGINS_DIR = "plugins"
+# Paper replaces plugins with the JARs of the same name from here when it starts, so running servers can be updated.
+PLUGINS_UPDATE_DIR = os.path.join(PLUGINS_DIR, "update")
+
+# How many downloads run at once.
+DOWNLOAD_JOBS = 8
+
+# API responses are cached on disk so a restart doesn't need to wait on the network.
+CACHE_PATH = ".papermc-cache.json"
+
+# Background updates download here and 'start.py' swaps the JAR in on the next restart.
+STAGING_DIR = ".staging"
+
+# JARs are shared between servers through a store keyed by SHA-256. 'refs/<sha256>/' holds one file per server
+# JAR linked to the object, and an object is deleted once none of its references are left.
+STORE_DIR = os.environ.get(
+    "PAPERMC_JAR_STORE",
+    os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser(os.path.join("~", ".cache"))), "papermc", "jars"),
+)
+# Seconds a store object or partial download without any reference is kept, so installs still running can finish.
+STORE_GRACE_PERIOD = 3600
+
+
+# '--timings' and '--trace-json' append every run to this file as a line of JSON, so runs can be compared over time.
+TIMINGS_HISTORY_PATH = ".timings.jsonl"
+
+
+def resource_usage():
+    \"""
+    Measure the resources used so far by this process and the child processes it has waited for.
+
+    Returns:
+        A dictionary of the 'cpu' and 'children_cpu' time in seconds, the bytes 'disk_read' and 'disk_written',
+        the bytes 'io_read' and 'io_written' by this process through system calls, which also counts the network
+        and the page cache, and the 'peak_rss' of this process or any of the children in bytes.
+    \"""
+
+    usage = {"cpu": time.process_time(), "children_cpu": 0.0, "disk_read": 0, "disk_written": 0}
+    usage.update(io_read=0, io_written=0, peak_rss=0)
+    if resource:
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        usage["children_cpu"] = children.ru_utime + children.ru_stime
+        # Block I/O is counted in 512-byte units.
+        usage["disk_read"] = (own.ru_inblock + children.ru_inblock) * 512
+        usage["disk_written"] = (own.ru_oublock + children.ru_oublock) * 512
+        # 'ru_maxrss' is in bytes on macOS and in KiB elsewhere.
+        usage["peak_rss"] = max(own.ru_maxrss, children.ru_maxrss) * (1 if sys.platform == "darwin" else 1024)
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        usage["io_read"] = int(counters["rchar"])
+        usage["io_written"] = int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        pass
+    return usage
+
+
+class Tracer:
+    \"""
+    Records spans of work with the time, CPU, I/O and memory they took, for '--timings' and '--trace-json'.
+
+    Spans nest within a thread. CPU and I/O are measured for the whole process, so spans that run at the same time
+    in different threads each include what the others used.
+    \"""
+
+    def __init__(self):
+        self.enabled = False
+        self.started = time.time()
+        self.usage = resource_usage()
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        \"""
+        Record a phase of work. Details like the bytes it transferred can be added to the yielded dictionary.
+
+        Args:
+            name (str): The name of the phase.
+            **attributes: Details about the phase.
+        \"""
+
+        if not self.enabled:
+            yield attributes
+            return
+        stack = self.local.__dict__.setdefault("stack", [])
+        before = resource_usage()
+        started = time.time()
+        start = time.monotonic()
+        stack.append(name)
+        try:
+            yield attributes
+        finally:
+            stack.pop()
+            span = {
+                "name": name,
+                "parent": stack[-1] if stack else None,
+                "depth": len(stack),
+                "thread": threading.current_thread().name,
+                "start": started - self.started,
+                "duration": time.monotonic() - start,
+            }
+            after = resource_usage()
+            span.update((key, after[key] - before[key]) for key in after if key != "peak_rss")
+            span.update(peak_rss=after["peak_rss"], attributes=attributes)
+            with self.lock:
+                self.spans.append(span)
+
+    def finish(self, command, print_timings, trace_path, history_path=TIMINGS_HISTORY_PATH):
+        \"""
+        Append the run to the history and print or save its spans.
+
+        Args:
+            command (list): The command line of the run.
+            print_timings (bool): Print a table of the spans to stderr.
+            trace_path (str): Save the spans in the Trace Event Format here, which chrome://tracing and
+                https://ui.perfetto.dev can show. None doesn't save them.
+            history_path (str): The JSON lines file to append the run to.
+        \"""
+
+        usage = resource_usage()
+        run = {"command": command, "started": self.started, "duration": time.time() - self.started}
+        run.update((key, usage[key] - self.usage[key]) for key in usage if key != "peak_rss")
+        run.update(peak_rss=usage["peak_rss"], spans=sorted(self.spans, key=lambda span: span["start"]))
+        with open(history_path, "a") as f:
+            f.write(json.dumps(run) + "\\n")
+
+        if trace_path:
+            threads = {}
+            events = []
+            for span in run["spans"]:
+                thread = threads.setdefault(span["thread"], len(threads) + 1)
+                details = {key: value for key, value in span.items() if key not in ["name", "thread", "attributes"]}
+                events.append(
+                    {
+                        "name": span["name"],
+                        "ph": "X",
+                        "ts": round(span["start"] * 1e6),
+                        "dur": round(span["duration"] * 1e6),
+                        "pid": os.getpid(),
+                        "tid": thread,
+                        "args": dict(details, **span["attributes"]),
+                    }
+                )
+            for name, thread in threads.items():
+                events.append(
+                    {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread, "args": {"name": name}}
+                )
+            with open(trace_path, "w") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+        if print_timings:
+            rows = [["PHASE", "TIME", "CPU", "CHILD CPU", "DISK READ", "DISK WRITTEN", "PEAK RSS", "DETAILS"]]
+            for span in [dict(run, name="total", depth=0, attributes={})] + run["spans"]:
+                rows.append(
+                    [
+                        "  " * span["depth"] + span["name"],
+                        f"{span['duration']:.2f}s",
+                        f"{span['cpu']:.2f}s",
+                        f"{span['children_cpu']:.2f}s",
+                        f"{span['disk_read'] / 1024**2:.1f} MiB",
+                        f"{span['disk_written'] / 1024**2:.1f} MiB",
+                        f"{span['peak_rss'] / 1024**2:.0f} MiB",
+                        " ".join(f"{key}={value}" for key, value in span["attributes"].items()),
+                    ]
+                )
+            widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+            for row in rows:
+                print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip(), file=sys.stderr)
+
+
+tracer = Tracer()
+
+
+def load_cache():
+    \"""
+    Add the API responses cached in the current directory to the cache in memory. Entries already in memory are at
+    least as new, so they are kept.
+    \"""
+
+    try:
+        with open(CACHE_PATH) as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return
+    with cache_lock:
+        for url, entry in entries.items():
+            cache.setdefault(url, entry)
+
+
+def save_cache():
+    \"""
+    Write the cached API responses to disk atomically.
+    \"""
+
+    with cache_lock:
+        temp_path = f"{CACHE_PATH}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(temp_path, CACHE_PATH)
 
 
-def fetch_json(url: str):
+class ConnectionPool:
     \"""
-    Fetch and parse JSON from a given URL.
+    Keeps an HTTP connection per host and thread open, so later requests skip the TCP and TLS handshakes.
+    \"""
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self, scheme: str, host: str):
+        connections = self.local.__dict__.setdefault("connections", {})
+        if (scheme, host) not in connections:
+            connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            connections[(scheme, host)] = connection_class(host, timeout=self.timeout)
+        return connections[(scheme, host)]
+
+    def request(self, url: str, headers=None, redirects=5):
+        \"""
+        Send a GET request, following redirects.
+
+        Args:
+            url (str): The URL to request.
+            headers (dict): Extra request headers.
+            redirects (int): How many redirects to follow.
+
+        Returns:
+            The response. It has to be read to the end before this thread makes another request.
+
+        Raises:
+            urllib.error.HTTPError: If the server answers with an error status.
+            OSError: If the server can't be reached.
+        \"""
+
+        for _ in range(redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+            for attempt in range(2):
+                connection = self.connection(parts.scheme, parts.netloc)
+                try:
+                    connection.request("GET", path, headers=headers or {})
+                    response = connection.getresponse()
+                    break
+                except (http.client.HTTPException, OSError) as e:
+                    connection.close()
+                    # The server may have closed a kept-alive connection, so retry once on a new one.
+                    if attempt:
+                        raise ConnectionError(f"{url}: {e}") from e
+
+            if response.status in [301, 302, 303, 307, 308] and response.getheader("Location"):
+                response.read()
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                continue
+            if response.status >= 400:
+                response.read()
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+            return response
+        raise ConnectionError(f"Too many redirects for {url}")
+
+
+def fetch_json(url: str, max_age=None):
+    \"""
+    Fetch and parse JSON from a given URL, using the on-disk cache where possible.
+
+    Cached entries younger than 'max_age' are returned without a request. Older entries are revalidated
+    with 'If-None-Match' and 'If-Modified-Since', and are used as-is if the API can't be reached.
 
     Args:
         url (str): The URL to fetch JSON from.
+        max_age (float): How many seconds a cached entry stays fresh. None means it never expires.
 
     Returns:
         The parsed JSON.
     \"""
 
-    with urllib.request.urlopen(url) as response:
-        return json.load(response)
+    entry = cache.get(url)
+    if entry and (args.offline or max_age is None or time.time() - entry["fetched"] < max_age):
+        return entry["data"]
+    if args.offline:
+        raise urllib.error.URLError(f"{url} is not cached and '--offline' was given")
 
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
 
-parser = ArgumentParser(description="Update a PaperMC Minecraft server JAR.")
-parser.add_argument(
-    "--mc-version",
-    default=None,
-    help="Specify the Minecraft version. Default is the latest available version.",
-)
-parser.add_argument(
-    "--papermc-build",
-    type=int,
-    default=None,
-    help="Specify the PaperMC build version. Default is the latest available build.",
-)
-parser.add_argument(
-    "--check-latest",
-    choices=["all", "mc-version", "papermc-build"],
-    help="Check the latest Minecraft version or the latest PaperMC build",
-)
-parser.add_argument(
-    "--quiet",
-    action="store_true",
-    help="Suppress output",
-)
+    try:
+        with tracer.span("fetch", url=url) as span:
+            response = pool.request(url, headers)
+            body = response.read()
+            span.update(status=response.status, bytes=len(body))
+        if response.status != 304:
+            entry = {
+                "data": json.loads(body),
+                "etag": response.getheader("ETag"),
+                "last_modified": response.getheader("Last-Modified"),
+            }
+    except urllib.error.HTTPError:
+        raise
+    except OSError:
+        # Fall back to the last known response while offline.
+        if entry:
+            return entry["data"]
+        raise
 
-args = parser.parse_args()
+    entry["fetched"] = time.time()
+    with cache_lock:
+        cache[url] = entry
+    save_cache()
+    return entry["data"]
 
-# Find the latest Minecraft version if it is not specified.
-if not args.mc_version:
-    mc_versions_url = "https://api.papermc.io/v2/projects/paper"
-    args.mc_version = fetch_json(mc_versions_url)["versions"][-1]
 
-# Find the latest PaperMC build if it is not specified.
-if not args.papermc_build:
-    papermc_builds_url = f"https://api.papermc.io/v2/projects/paper/versions/{args.mc_version}/builds"
-    args.papermc_build = fetch_json(papermc_builds_url)["builds"][-1]["build"]
+def use_current_jar(error):
+    \"""
+    Keep the current JAR if the API is unreachable and a JAR is already downloaded.
 
+    Args:
+        error (Exception): The error raised while contacting the API.
 
-# Check if the user wants to know both or just the latest Minecraft version or the latest PaperMC build.
-if args.check_latest:
-    if args.check_latest == "mc-version":
-        print(args.mc_version)
-    elif args.check_latest == "papermc-build":
-        print(args.papermc_build)
-    else:
-        print(f"Latest build for Minecraft {args.mc_version} is version {args.papermc_build}")
-    sys.exit()
+    Raises:
+        Exception: The error, if there is no JAR to keep.
+    \"""
 
+    if not any(file.startswith("paper") and file.endswith(".jar") for file in os.listdir()):
+        raise error
+    if not args.quiet:
+        print(f"Could not reach the PaperMC API ({error}). Using the current JAR.")
 
-# Find JAR name for download link.
-jar_url = f"https://api.papermc.io/v2/projects/paper/versions/{args.mc_version}/builds/{args.papermc_build}"
-jar_name = fetch_json(jar_url)["downloads"]["application"]["name"]
 
-download_url = f"https://api.papermc.io/v2/projects/paper/versions/{args.mc_version}/builds/{args.papermc_build}/downloads/{jar_name}"
+def download(url: str, path: str, sha256: str):
+    \"""
+    Stream a file to disk, resuming a previous partial download and verifying the result.
 
-# Check if the latest build is already downloaded.
-if os.path.isfile(jar_name):
-    if not args.quiet:
-        print(f"You are already on the latest build for Minecraft {args.mc_version}")
-    sys.exit()
+    The file is written to '<path>.part' and only renamed to 'path' once its SHA-256 matches, so an
+    interrupted or corrupt transfer never leaves a truncated file behind under the real name.
 
-# Delete old JAR.
-for file in os.listdir():
-    if file.startswith("paper") and file.endswith(".jar"):
-        if not args.quiet:
-            print(f"Deleting old JAR: {file}")
-        os.remove(file)
-
-# Download the latest build of PaperMC.
-if not args.quiet:
-    print(f"Downloading PaperMC {args.mc_version} build {args.papermc_build}...")
-with urllib.request.urlopen(download_url) as response, open(jar_name, "wb") as f:
-    f.write(response.read())
-""".lstrip(
-            "\n"
-        )
-    )
+    Args:
+        url (str): The URL to download from.
+        path (str): Where to save the downloaded file.
+        sha256 (str): The expected SHA-256 hex digest of the file.
 
-    update_script_path = os.path.join(server_name, "update.py")
-    with open(update_script_path, "w") as f:
-        f.write(update_script)
-    if not is_windows():
-        # Make the script executable.
-        os.chmod(update_script_path, os.stat(update_script_path).st_mode | stat.S_IEXEC)
+    Returns:
+        True if the file was downloaded and verified, False otherwise.
+    \"""
 
-    if is_windows():
-        mc_version = (
-            subprocess.run(
-                ["py", os.path.join(".", server_name, "update.py"), "--check-latest", "mc-version"],
-                stdout=subprocess.PIPE,
-            )
-            .stdout.decode()
-            .strip()
-        )
-    else:
-        mc_version = (
-            subprocess.run(
-                [os.path.join(".", server_name, "update.py"), "--check-latest", "mc-version"], stdout=subprocess.PIPE
-            )
-            .stdout.decode()
-            .strip()
-        )
-    start_script = f"""
-#!/usr/bin/env {python_executable}
+    part_path = f"{path}.part"
+    for attempt in range(2):
+        digest = hashlib.sha256()
+        offset = 0
+        # Hash what was already downloaded so the checksum covers the whole file when resuming.
+        if attempt == 0 and os.path.isfile(part_path):
+            with open(part_path, "rb") as f:
+                for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    digest.update(block)
+                    offset += len(block)
 
-import glob
-import os.path
-import subprocess
-import sys
+        try:
+            with tracer.span("download", url=url, bytes=0) as span:
+                response = pool.request(url, {"Range": f"bytes={offset}-"} if offset else None)
+                if offset and response.status != 206:
+                    # The server ignored the range request and is sending the whole file again.
+                    digest = hashlib.sha256()
+                    offset = 0
+                with open(part_path, "ab" if offset else "wb") as f:
+                    for block in iter(lambda: response.read(CHUNK_SIZE), b""):
+                        f.write(block)
+                        digest.update(block)
+                        span["bytes"] += len(block)
+        except urllib.error.HTTPError as e:
+            # 416 means the partial file is already complete.
+            if e.code != 416:
+                raise
 
-# Check if there is an update and if so, update the server JAR.
-update_args = [os.path.join(".", "update.py"), "--mc-version", "{mc_version}"]
-if "win" in sys.platform:
-    update_args.insert(0, "py")
-subprocess.run(update_args)
+        if digest.hexdigest() == sha256:
+            os.replace(part_path, path)
+            return True
 
-# Start PaperMC.
-papermc_jar = glob.glob("paper*.jar")[0]
-subprocess.run(["java", "-Xms512M", "-Xmx4G", "-jar", papermc_jar, "nogui"])
-""".lstrip(
-        "\n"
-    )
+        # A stale or corrupt partial file can't be trusted, so retry once from scratch.
+        os.remove(part_path)
+        if not offset:
+            break
 
-    start_script_path = os.path.join(server_name, "start.py")
-    with open(start_script_path, "w") as f:
-        f.write(start_script)
-    if not is_windows():
-        # Make the script executable.
-        os.chmod(start_script_path, os.stat(start_script_path).st_mode | stat.S_IEXEC)
+    return False
 
 
-def is_windows():
-    return "win" in sys.platform
+def delete_old_jars(jar_name: str):
+    \"""
+    Delete every PaperMC JAR in the server directory except the given one.
 
+    Args:
+        jar_name (str): The JAR to keep.
+    \"""
 
-def is_macos():
-    return sys.platform == "darwin"
+    for file in os.listdir():
+        if file.startswith("paper") and file.endswith(".jar") and file != jar_name:
+            if not args.quiet:
+                print(f"Deleting old JAR: {file}")
+            os.remove(file)
 
 
-def is_linux():
-    return sys.platform == "linux"
+def apply_staged():
+    \"""
+    Move a JAR downloaded by a background update into the server directory.
+    \"""
 
+    staged = glob.glob(os.path.join(STAGING_DIR, "paper*.jar"))
+    if not staged:
+        return
+    jar_name = os.path.basename(staged[0])
+    if not args.quiet:
+        print(f"Applying staged update: {jar_name}")
+    sha256 = find_ref(staged[0])
+    os.replace(staged[0], jar_name)
+    if sha256:
+        add_ref(sha256, jar_name)
+    delete_old_jars(jar_name)
+    collect_garbage()
 
-if not is_windows() and not is_macos() and not is_linux():
-    print("Unsupported operating system.")
-    exit(1)
 
-compression_file_extensions = {
-    "7z": "7z",
-    "gzip": "tar.gz",
-    "bzip2": "tar.bz2",
-    "xz": "tar.xz",
-    "lzip": "tar.lz",
-    "lzma": "tar.lzma",
-    "lzop": "tar.lzo",
-    "zstd": "tar.zst",
-    "compress": "tar.Z",
-}
+def lock(path: str, blocking=True):
+    \"""
+    Take an exclusive lock on a file that is held until the process exits.
 
-parser = ArgumentParser(description="Setup or backup a Minecraft server.")
+    Args:
+        path (str): The lock file.
+        blocking (bool): Wait for the lock instead of giving up if another process holds it.
 
-parser.add_argument(
-    "server_name", nargs="?", help="The name of the Minecraft server to create or perform the action on"
-)
+    Returns:
+        True if the lock was acquired, False if another process holds it.
+    \"""
 
-parser.add_argument("-y", action="store_true", help="Answer yes to all prompts")
-if is_linux():
-    parser.add_argument(
-        "-s", "--session", action="store_true", help="Continue or start a Minecraft server's console session"
-    )
+    try:
+        import fcntl
+    except ImportError:
+        # File locking isn't available on Windows.
+        return True
 
-server_options = parser.add_mutually_exclusive_group()
-server_options.add_argument("-n", "--new", action="store_true", help="Create a new server")
-server_options.add_argument("-b", "--backup", action="store_true", help="Backup an existing server")
-server_options.add_argument("-d", "--delete", action="store_true", help="Delete an existing server")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock_file = open(path, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    locks.append(lock_file)
+    return True
 
-if is_linux():
-    parser.add_argument("--list-sessions", action="store_true", help="List all running Minecraft server sessions")
-parser.add_argument(
-    "--compression",
-    choices=compression_file_extensions.keys(),
-    default="7z",
-    help="Specify the compression type. Uses '7z' by default. Requires '-b' or '--backup' to be used.",
-)
-parser.add_argument(
-    "--world-name",
-    default="world",
-    help="Specify the world name as is in server.properties. Only needs to be set if the world save name is not the default.",
-)
 
-args = parser.parse_args()
-
-# Print usage example if no arguments are passed.
-if len(sys.argv) == 1:
-    parser.print_usage()
-    print("run with '-h' to get help")
-    sys.exit()
-
-if is_linux() and args.list_sessions:
-    sessions = subprocess.run(
-        [
-            "tmux",
-            "ls",
-            "-F",
-            "#{session_name}: #{session_windows} windows (created #{t:session_created}) (#{?session_attached,attached,not attached})",
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    # No sessions found would result in an error.
-    if sessions.stderr.decode():
-        print("No sessions found.")
-    else:
-        print(sessions.stdout.decode())
+@contextmanager
+def try_lock(path: str):
+    \"""
+    Take an exclusive lock on a file for a 'with' block, without waiting for it.
 
-    sys.exit()
+    Args:
+        path (str): The lock file.
 
-if args.new:
-    # Check if the server given exists.
-    if os.path.exists(args.server_name):
-        print(f"A server with the name '{args.server_name}' already exists.")
-        sys.exit(1)
+    Yields:
+        True if the lock was acquired, False if another process holds it.
+    \"""
 
-    # Create the server directory and add the custom scripts.
-    os.makedirs(args.server_name, exist_ok=True)
-    add_scripts(args.server_name)
+    try:
+        import fcntl
+    except ImportError:
+        yield True
+        return
 
-elif args.backup:
-    # Check if the server given exists.
-    if not os.path.exists(args.server_name):
-        print(f"A server with the name '{args.server_name}' does not exist.")
-        print("Please check the spelling and try again.")
-        sys.exit(1)
+    with open(path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        yield True
 
-    # Define the backup location.
-    if args.server_name[-1] in ["/", "\\"]:
-        args.server_name = args.server_name[:-1]
 
-    os.chdir(args.server_name)
+def ref_path(sha256: str, path: str):
+    \"""
+    Get the reference file that records 'path' as a user of a store object.
 
-    world_saves = [
-        args.world_name,
-        f"{args.world_name}_nether",
-        f"{args.world_name}_the_end",
-    ]
-    # Make sure the world save directories exist.
-    for directory in world_saves:
-        if not os.path.exists(directory):
-            print(f"Could not find a world save at '{directory}' in '{args.server_name}'.")
-            sys.exit(1)
+    Args:
+        sha256 (str): The SHA-256 of the store object.
+        path (str): The JAR in a server directory.
 
-    current_date = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    backup_directory = "backup"
-    os.makedirs(backup_directory, exist_ok=True)
-    backup_path = os.path.join(backup_directory, f"{current_date}.{compression_file_extensions[args.compression]}")
+    Returns:
+        The path of the reference file.
+    \"""
 
-    if args.compression == "7z":
-        subprocess.run(["7z", "a", backup_path, *world_saves])
-    else:
-        subprocess.run(["tar", "--create", "--verbose", "--auto-compress", "--file", backup_path, *world_saves])
+    ref_id = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(STORE_DIR, "refs", sha256, ref_id)
 
-    os.chdir("..")
 
-elif args.delete:
-    # Check if the server given exists.
-    if not os.path.exists(args.server_name):
-        print(f"A server with the name '{args.server_name}' does not exist.")
-        print("Please check the spelling and try again.")
-        sys.exit(1)
+def add_ref(sha256: str, path: str):
+    \"""
+    Record that a server JAR is linked to a store object.
+
+    Args:
+        sha256 (str): The SHA-256 of the store object.
+        path (str): The JAR in a server directory.
+    \"""
+
+    reference = ref_path(sha256, path)
+    os.makedirs(os.path.dirname(reference), exist_ok=True)
+    with open(reference, "w") as f:
+        f.write(os.path.abspath(path))
+
+
+def find_ref(path: str):
+    \"""
+    Find the store object a server JAR is linked to.
+
+    Args:
+        path (str): The JAR in a server directory.
+
+    Returns:
+        The SHA-256 of the store object, or None if the JAR isn't from the store.
+    \"""
+
+    references = glob.glob(ref_path("*", path))
+    if not references:
+        return None
+    return os.path.basename(os.path.dirname(references[0]))
+
+
+def link_from_store(sha256: str, path: str):
+    \"""
+    Link a store object into a server directory, preferring hardlinks, then symlinks, then a plain copy.
+
+    Args:
+        sha256 (str): The SHA-256 of the store object.
+        path (str): Where to place the JAR.
+    \"""
 
+    store_path = os.path.join(STORE_DIR, f"{sha256}.jar")
+    temp_path = f"{path}.tmp"
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
     try:
-        delete_confirmation = input(
-            f"Are you sure you want to delete '{args.server_name}'? This will delete the server backups as well. (y/N): "
-        )
-    except KeyboardInterrupt:
-        sys.exit()
-    if not args.y and delete_confirmation.lower() not in ["y", "yes"]:
-        sys.exit()
+        os.link(store_path, temp_path)
+    except OSError:
+        try:
+            # Hardlinks don't work across filesystems.
+            os.symlink(os.path.abspath(store_path), temp_path)
+        except OSError:
+            shutil.copyfile(store_path, temp_path)
+    os.replace(temp_path, path)
+    add_ref(sha256, path)
 
-    # Delete the server directory.
-    shutil.rmtree(args.server_name)
 
-    sys.exit()
+def collect_garbage():
+    \"""
+    Delete store objects that no server JAR references anymore.
 
-if is_linux() and args.session:
-    # The tmux id should not contain any slashes.
-    if args.server_name[-1] in ["/", "\\"]:
-        args.server_name = args.server_name[:-1]
-    tmux_id = f"mc-{args.server_name}"
+    A reference is stale once the JAR it names is deleted or no longer has the object's content, which also covers
+    servers removed with 'server.py --delete'. Objects and partial downloads that never got a reference because their
+    install was interrupted are deleted once they are older than 'STORE_GRACE_PERIOD'. Objects an install has locked
+    are skipped, and lock files are left in place, since other processes may be waiting on them.
+    \"""
 
-    # Check if the server name given exists.
-    if not os.path.exists(args.server_name):
-        print(f"A server with the name '{args.server_name}' does not exist.")
-        if args.server_name.startswith("mc-"):
-            print(f"Did you mean './server.py -s {args.server_name[3:]}'?")
-        sys.exit(1)
+    released = set()
+    for ref_dir in glob.glob(os.path.join(STORE_DIR, "refs", "*")):
+        sha256 = os.path.basename(ref_dir)
+        store_path = os.path.join(STORE_DIR, f"{sha256}.jar")
+        for reference in os.listdir(ref_dir):
+            reference = os.path.join(ref_dir, reference)
+            try:
+                with open(reference) as f:
+                    path = f.read()
+                # Hardlinks and symlinks are the object itself, and a copy still has the object's content.
+                if os.path.samefile(path, store_path) or file_sha256(path) == sha256:
+                    continue
+            except OSError:
+                pass
+            os.remove(reference)
+
+        if not os.listdir(ref_dir):
+            os.rmdir(ref_dir)
+            released.add(sha256)
+
+    for path in glob.glob(os.path.join(STORE_DIR, "*.jar")) + glob.glob(os.path.join(STORE_DIR, "*.jar.part")):
+        sha256 = os.path.basename(path).split(".")[0]
+        ref_dir = os.path.join(STORE_DIR, "refs", sha256)
+        if os.path.isdir(ref_dir):
+            continue
+        try:
+            if sha256 not in released and time.time() - os.path.getmtime(path) < STORE_GRACE_PERIOD:
+                continue
+            # An install holds the lock from finding the object in the store until it has added its reference.
+            with try_lock(os.path.join(STORE_DIR, f"{sha256}.jar.lock")) as locked:
+                if not locked or os.path.isdir(ref_dir):
+                    continue
+                if path.endswith(".jar") and not args.quiet:
+                    print(f"Removing unused JAR from the shared store: {sha256}")
+                os.remove(path)
+        except FileNotFoundError:
+            # Another server removed it first.
+            pass
+
+
+def latest_mc_version(max_age=None):
+    \"""
+    Get the latest Minecraft version PaperMC has builds for.
+
+    Args:
+        max_age (float): How many seconds a cached version list stays fresh. None means it never expires.
+
+    Returns:
+        The Minecraft version.
+    \"""
+
+    return fetch_json(API_URL, max_age)["versions"][-1]
+
+
+def latest_build(mc_version: str, max_age=None):
+    \"""
+    Get the latest PaperMC build for a Minecraft version.
+
+    Args:
+        mc_version (str): The Minecraft version.
+        max_age (float): How many seconds a cached build list stays fresh. None means it never expires.
+
+    Returns:
+        The build number.
+    \"""
+
+    return fetch_json(f"{API_URL}/versions/{mc_version}/builds", max_age)["builds"][-1]["build"]
+
+
+def install(mc_version: str, papermc_build: int, stage=False, no_store=False):
+    \"""
+    Download a PaperMC build into the server directory, or into the staging directory to be applied on the next start.
+
+    Args:
+        mc_version (str): The Minecraft version.
+        papermc_build (int): The PaperMC build.
+        stage (bool): Download into the staging directory without touching the current JAR.
+        no_store (bool): Keep a private copy of the JAR instead of linking it from the shared store.
+
+    Returns:
+        The name of the JAR.
+
+    Raises:
+        OSError: If the API or the download can't be reached.
+        ValueError: If the download doesn't match its checksum.
+    \"""
+
+    # Find JAR name and checksum for download link. Build details never change, so the cached copy is always used.
+    jar_url = f"{API_URL}/versions/{mc_version}/builds/{papermc_build}"
+    jar_download = fetch_json(jar_url)["downloads"]["application"]
+    jar_name = jar_download["name"]
+
+    download_url = f"{API_URL}/versions/{mc_version}/builds/{papermc_build}/downloads/{jar_name}"
+
+    # Check if the latest build is already downloaded.
+    if os.path.isfile(jar_name) or (stage and os.path.isfile(os.path.join(STAGING_DIR, jar_name))):
+        if not args.quiet:
+            print(f"You are already on the latest build for Minecraft {mc_version}")
+        return jar_name
+
+    # Download the latest build of PaperMC, unless another server already put it in the store.
+    jar_path = os.path.join(STAGING_DIR, jar_name) if stage else jar_name
+    sha256 = jar_download["sha256"]
+    store_path = os.path.join(STORE_DIR, f"{sha256}.jar")
+    if not no_store:
+        # Another server may be downloading the same build into the store.
+        lock(f"{store_path}.lock")
+    if no_store or not os.path.isfile(store_path):
+        if not args.quiet:
+            print(f"Downloading PaperMC {mc_version} build {papermc_build}...")
+        if not download(download_url, jar_path if no_store else store_path, sha256):
+            raise ValueError(f"Checksum mismatch while downloading {jar_name}.")
+    elif not args.quiet:
+        print(f"Using PaperMC {mc_version} build {papermc_build} from the shared store.")
+    if not no_store:
+        link_from_store(sha256, jar_path)
+
+    if stage:
+        # Drop builds that were staged earlier but never applied.
+        for file in glob.glob(os.path.join(STAGING_DIR, "paper*.jar")):
+            if os.path.basename(file) != jar_name:
+                os.remove(file)
+        if not args.quiet:
+            print(f"Staged {jar_name}. It will be used the next time the server starts.")
+    else:
+        # Delete old JAR only once the new one is in place.
+        delete_old_jars(jar_name)
+        collect_garbage()
+    return jar_name
+
+
+def file_sha256(path: str):
+    \"""
+    Hash a file.
+
+    Args:
+        path (str): The file.
+
+    Returns:
+        The SHA-256 hex digest, or None if the file doesn't exist.
+    \"""
+
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def load_plugins():
+    \"""
+    Load the plugins listed in 'plugins.json'.
+
+    Returns:
+        A list of plugins, each a dictionary with a 'url' and optionally a 'sha256' and a 'file' name. Empty if
+        there is no 'plugins.json'.
+
+    Raises:
+        ValueError: If 'plugins.json' is invalid.
+    \"""
+
+    try:
+        with open(PLUGINS_PATH) as f:
+            plugins = json.load(f).get("plugins", [])
+    except FileNotFoundError:
+        return []
+    for plugin in plugins:
+        if not isinstance(plugin, dict) or "url" not in plugin:
+            raise ValueError(f"Every plugin in {PLUGINS_PATH} needs a 'url'.")
+    return plugins
+
+
+def update_plugin(plugin: dict, stage=False):
+    \"""
+    Download a plugin unless the installed copy is already up to date.
+
+    A plugin with a 'sha256' is skipped when the installed JAR matches it. Otherwise the host is asked with
+    'If-None-Match' and 'If-Modified-Since' whether the JAR changed since it was last downloaded.
+
+    Args:
+        plugin (dict): The plugin from 'plugins.json'.
+        stage (bool): Put updates of installed plugins in Paper's update directory, to be swapped in when the server
+            next starts.
+
+    Returns:
+        True if the plugin was downloaded, False if it was up to date.
+
+    Raises:
+        OSError: If the plugin can't be downloaded.
+        ValueError: If the download doesn't match the plugin's 'sha256'.
+    \"""
+
+    url = plugin["url"]
+    name = plugin.get("file") or os.path.basename(urllib.parse.urlsplit(url).path)
+    installed_path = os.path.join(PLUGINS_DIR, name)
+    staged_path = os.path.join(PLUGINS_UPDATE_DIR, name)
+    if not stage and os.path.isfile(staged_path):
+        # Swap in an update staged while the server was running, as Paper would when it starts.
+        os.replace(staged_path, installed_path)
+    installed_sha256 = file_sha256(installed_path)
+    # Paper only swaps in updates for plugins it already has, so new plugins go straight into the plugins directory.
+    path = staged_path if stage and installed_sha256 else installed_path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    sha256 = plugin.get("sha256")
+    if sha256:
+        if sha256 in [installed_sha256, file_sha256(path)]:
+            return False
+        if not download(url, path, sha256):
+            raise ValueError(f"Checksum mismatch while downloading {name}.")
+        if not args.quiet:
+            sys.stdout.write(f"Updated plugin {name}\\n")
+        return True
+
+    headers = {}
+    with cache_lock:
+        entry = cache.get(url)
+    # Only trust the host's answer if the JAR on disk is the one that was downloaded.
+    if entry and entry.get("sha256") in [installed_sha256, file_sha256(path)]:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    with tracer.span("plugin", plugin=name, bytes=0) as span:
+        response = pool.request(url, headers)
+        span["status"] = response.status
+        if response.status == 304:
+            response.read()
+            return False
+
+        part_path = f"{path}.part"
+        digest = hashlib.sha256()
+        with open(part_path, "wb") as f:
+            for block in iter(lambda: response.read(CHUNK_SIZE), b""):
+                f.write(block)
+                digest.update(block)
+                span["bytes"] += len(block)
+    os.replace(part_path, path)
+    with cache_lock:
+        cache[url] = {
+            "sha256": digest.hexdigest(),
+            "etag": response.getheader("ETag"),
+            "last_modified": response.getheader("Last-Modified"),
+            "fetched": time.time(),
+        }
+    save_cache()
+    if not args.quiet:
+        # One write, so lines from parallel downloads don't run into each other.
+        sys.stdout.write(f"Updated plugin {name}\\n")
+    return True
+
+
+def release_locks():
+    \"""
+    Release the locks taken by 'lock()', for when the process keeps running after an update.
+    \"""
+
+    while locks:
+        locks.pop().close()
+
+
+parser = ArgumentParser(description="Update a PaperMC Minecraft server JAR.")
+parser.add_argument(
+    "--mc-version",
+    default=None,
+    help="Specify the Minecraft version. Default is the latest available version.",
+)
+parser.add_argument(
+    "--papermc-build",
+    type=int,
+    default=None,
+    help="Specify the PaperMC build version. Default is the latest available build.",
+)
+parser.add_argument(
+    "--check-latest",
+    choices=["all", "mc-version", "papermc-build"],
+    help="Check the latest Minecraft version or the latest PaperMC build",
+)
+parser.add_argument(
+    "--quiet",
+    action="store_true",
+    help="Suppress output",
+)
+parser.add_argument(
+    "--cache-ttl",
+    type=float,
+    default=CACHE_TTL,
+    help=f"Seconds to trust cached version and build lists before asking the API again. Default is {CACHE_TTL}.",
+)
+parser.add_argument(
+    "--offline",
+    action="store_true",
+    help="Only use cached API responses",
+)
+parser.add_argument(
+    "--stage",
+    action="store_true",
+    help=f"Download the update into '{STAGING_DIR}' without touching the current JAR",
+)
+parser.add_argument(
+    "--apply-staged",
+    action="store_true",
+    help="Replace the current JAR with a previously staged update and exit",
+)
+
+parser.add_argument(
+    "--no-store",
+    action="store_true",
+    help=f"Keep a private copy of the JAR instead of linking it from the shared store in '{STORE_DIR}'",
+)
+parser.add_argument(
+    "--jobs",
+    type=int,
+    default=DOWNLOAD_JOBS,
+    help=f"How many downloads of the JAR and the plugins in '{PLUGINS_PATH}' run at once. Default is {DOWNLOAD_JOBS}.",
+)
+parser.add_argument(
+    "--timings",
+    action="store_true",
+    help="Print how long each phase took and the CPU, disk and memory it used, and add the run to "
+    f"'{TIMINGS_HISTORY_PATH}'",
+)
+parser.add_argument(
+    "--trace-json",
+    metavar="PATH",
+    help="Save the phases as a trace for chrome://tracing or https://ui.perfetto.dev, and add the run to "
+    f"'{TIMINGS_HISTORY_PATH}'",
+)
+
+# The defaults, for when this is imported by 'start.py' or 'server.py' instead of run.
+args = parser.parse_args([])
+locks = []
+# Filled by 'load_cache()' once the server directory is the current directory, which it may not be on import.
+cache = {}
+cache_lock = threading.Lock()
+pool = ConnectionPool()
+
+
+def main(argv=None):
+    \"""
+    Update the server JAR in the current directory.
+
+    Args:
+        argv (list): The command line arguments. Defaults to the arguments the script was run with.
+
+    Returns:
+        The exit code.
+    \"""
+
+    global args
+    args = parser.parse_args(argv)
+    load_cache()
+    # 'start.py' records its own run, including this update.
+    record_run = (args.timings or args.trace_json) and not tracer.enabled
+    tracer.enabled = tracer.enabled or record_run
+    try:
+        if args.apply_staged:
+            with tracer.span("apply staged"):
+                apply_staged()
+            return 0
+
+        if args.stage and not lock(os.path.join(STAGING_DIR, "lock"), blocking=False):
+            if not args.quiet:
+                print("Another update is already downloading.")
+            return 0
+
+        try:
+            # Find the latest Minecraft version and PaperMC build if they are not specified.
+            with tracer.span("resolve version"):
+                if not args.mc_version:
+                    args.mc_version = latest_mc_version(args.cache_ttl)
+                if not args.papermc_build:
+                    args.papermc_build = latest_build(args.mc_version, args.cache_ttl)
+        except OSError as e:
+            if args.check_latest:
+                raise
+            use_current_jar(e)
+            # Plugins come from other hosts, so they can still be updated.
+            args.papermc_build = None
+
+        # Check if the user wants to know both or just the latest Minecraft version or the latest PaperMC build.
+        if args.check_latest:
+            if args.check_latest == "mc-version":
+                print(args.mc_version)
+            elif args.check_latest == "papermc-build":
+                print(args.papermc_build)
+            else:
+                print(f"Latest build for Minecraft {args.mc_version} is version {args.papermc_build}")
+            return 0
+
+        try:
+            plugins = load_plugins()
+        except ValueError as e:
+            print(f"Could not read {PLUGINS_PATH}: {e}", file=sys.stderr)
+            return 1
+
+        # The JAR and the plugins download side by side, each thread reusing its connections.
+        with tracer.span("downloads", plugins=len(plugins)), ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            jar_update = None
+            if args.papermc_build:
+                jar_update = executor.submit(install, args.mc_version, args.papermc_build, args.stage, args.no_store)
+            plugin_updates = [(plugin, executor.submit(update_plugin, plugin, args.stage)) for plugin in plugins]
+
+        exit_code = 0
+        if jar_update:
+            try:
+                jar_update.result()
+            except OSError as e:
+                use_current_jar(e)
+            except ValueError as e:
+                # Keep the old JAR so the server can still start.
+                print(f"{e} Keeping the current JAR.", file=sys.stderr)
+                exit_code = 1
+        for plugin, plugin_update in plugin_updates:
+            try:
+                plugin_update.result()
+            except (OSError, ValueError) as e:
+                print(f"Could not update the plugin from {plugin['url']}: {e}", file=sys.stderr)
+                exit_code = 1
+        return exit_code
+    finally:
+        release_locks()
+        if record_run:
+            tracer.finish([sys.argv[0], *(sys.argv[1:] if argv is None else argv)], args.timings, args.trace_json)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+""".lstrip(
+    "\n"
+)
+
+
+def add_scripts(server_name, download=False):
+    """
+    Add custom scripts to the server directory.
+
+    Args:
+        server_name (str): The name of the server to add the scripts to.
+        download (bool): Download the server JAR as well, so the first start doesn't have to.
+
+    Raises:
+        RuntimeError: If PaperMC couldn't be reached or the download failed.
+    """
+
+    if sys.executable.endswith("python3"):
+        python_executable = "python3"
+    else:
+        python_executable = "python"
+
+    update_script = f"#!/usr/bin/env {python_executable}\n\n" + UPDATE_SCRIPT
+
+    update_script_path = os.path.join(server_name, "update.py")
+    with open(update_script_path, "w") as f:
+        f.write(update_script)
+    if not is_windows():
+        # Make the script executable.
+        os.chmod(update_script_path, os.stat(update_script_path).st_mode | stat.S_IEXEC)
+
+    # Look up the version in this process rather than running 'update.py', reusing what earlier servers fetched.
+    with tracer.span("papermc"), working_directory(server_name):
+        # Add what this server cached before, if it is being set up again.
+        updater.load_cache()
+        try:
+            mc_version = updater.latest_mc_version(updater.CACHE_TTL)
+            if download:
+                updater.install(mc_version, updater.latest_build(mc_version, updater.CACHE_TTL))
+        except (OSError, ValueError) as e:
+            raise RuntimeError(f"Could not get PaperMC for '{server_name}': {e}")
+        finally:
+            updater.release_locks()
+        # Give the server the API responses so its first start doesn't ask for them again.
+        updater.save_cache()
+
+    start_script = (
+        f"#!/usr/bin/env {python_executable}\n\n"
+        """
+import atexit
+import glob
+import json
+import os.path
+import re
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+# The updater runs in this process, so starting the server doesn't wait for a second Python to start.
+import update
+
+"""
+        f'MC_VERSION = "{mc_version}"\n'
+        """
+# Per-server overrides of the settings below, e.g. {"max_heap": "6G", "jvm_args": ["-Dfile.encoding=UTF-8"]}.
+# {"pretouch": true} commits the whole heap when the server starts, which suits hosts that run only this server.
+SETTINGS_PATH = "start.json"
+
+# Share of the host's memory given to the heaps when 'max_heap' isn't set. It is split evenly between the servers set
+# up next to this one, and the rest is left for the JVMs' own memory and the system.
+HEAP_FRACTION = 0.7
+# Heap bounds in MiB when sizing automatically. Without 'pretouch', the heap starts at the minimum and grows as needed.
+MIN_HEAP = 1024
+MAX_HEAP = 16384
+
+# Class data sharing archives, one per JAR build and Java version.
+CDS_DIR = ".cds"
+
+
+def load_settings():
+    \"""
+    Load the per-server settings from 'start.json'.
+
+    Returns:
+        A dictionary of settings. Empty if there is no 'start.json'.
+    \"""
+
+    try:
+        with open(SETTINGS_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        print(f"Could not read {SETTINGS_PATH}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def parse_size(size):
+    \"""
+    Convert a size like '6G' or '512M' to MiB.
+
+    Args:
+        size (str): The size with a K, M or G suffix. MiB if there is no suffix.
+
+    Returns:
+        The size in MiB, rounded up.
+    \"""
+
+    match = re.fullmatch(r"(\\d+)([KMG]?)", str(size).strip().upper())
+    if not match or int(match.group(1)) == 0:
+        print(f"Invalid size '{size}' in {SETTINGS_PATH}. Use a number with K, M or G, like '6G'.", file=sys.stderr)
+        sys.exit(1)
+    number, unit = int(match.group(1)), match.group(2)
+    return {"K": -(-number // 1024), "": number, "M": number, "G": number * 1024}[unit]
+
+
+def cgroup_memory():
+    \"""
+    Find the memory limit of this process's cgroups and how much of it is still free.
+
+    Returns:
+        A tuple of the limit and the free memory in bytes of the most limited cgroups, or None if no cgroup has a
+        memory limit.
+    \"""
+
+    try:
+        with open("/proc/self/cgroup") as f:
+            cgroups = [line.rstrip("\\n").split(":", 2) for line in f]
+    except OSError:
+        return None
+
+    limits = []
+    free = []
+    for _, controllers, path in cgroups:
+        if controllers == "":
+            # cgroup v2 limits apply from every ancestor, so check each level up to the root.
+            directory = "/sys/fs/cgroup" + path.rstrip("/")
+            files = ("memory.max", "memory.current")
+        elif "memory" in controllers.split(","):
+            directory = "/sys/fs/cgroup/memory" + path.rstrip("/")
+            files = ("memory.limit_in_bytes", "memory.usage_in_bytes")
+        else:
+            continue
+        while directory.startswith("/sys/fs/cgroup"):
+            try:
+                with open(os.path.join(directory, files[0])) as f:
+                    limit = f.read().strip()
+                with open(os.path.join(directory, files[1])) as f:
+                    usage = int(f.read())
+            except (OSError, ValueError):
+                limit = "max"
+            # cgroup v1 reports no limit as a number close to the largest 64-bit value.
+            if limit != "max" and int(limit) < 2**60:
+                limits.append(int(limit))
+                free.append(max(int(limit) - usage, 0))
+            directory = os.path.dirname(directory)
+    return (min(limits), min(free)) if limits else None
+
+
+def host_memory():
+    \"""
+    Find how much memory the host has and how much of it is free, taking cgroup limits into account.
+
+    Returns:
+        A tuple of the total and the free memory in bytes. Either is None if it can't be determined.
+    \"""
+
+    total = free = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    total = int(line.split()[1]) * 1024
+                elif line.startswith("MemAvailable:"):
+                    free = int(line.split()[1]) * 1024
+    except OSError:
+        try:
+            # On systems without '/proc'.
+            total = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (AttributeError, OSError, ValueError):
+            pass
+
+    cgroup = cgroup_memory()
+    if cgroup is not None:
+        total = cgroup[0] if total is None else min(total, cgroup[0])
+        free = cgroup[1] if free is None else min(free, cgroup[1])
+    return total, free
+
+
+def server_count():
+    \"""
+    Count the servers set up next to this one by 'server.py', which share the host's memory with it.
+
+    Returns:
+        The number of servers, including this one.
+    \"""
+
+    try:
+        servers = [entry for entry in os.scandir("..") if os.path.isfile(os.path.join(entry.path, "start.py"))]
+    except OSError:
+        return 1
+    return max(len(servers), 1)
+
+
+def heap_size(settings):
+    \"""
+    Decide how large the heap should be.
+
+    Args:
+        settings (dict): The per-server settings.
+
+    Returns:
+        A tuple of the initial and maximum heap size in MiB.
+    \"""
+
+    if "max_heap" in settings:
+        max_heap = parse_size(settings["max_heap"])
+    else:
+        total, free = host_memory()
+        fraction = settings.get("heap_fraction", HEAP_FRACTION)
+        if total is None:
+            max_heap = 4096
+        else:
+            # Every server gets its share of the budget, so the first ones to start can't take all of it.
+            heap = total * fraction / server_count()
+            if free is not None:
+                heap = min(heap, free * fraction)
+            # Round down to 256 MiB.
+            max_heap = min(max(int(heap / 1024**2) // 256 * 256, MIN_HEAP), MAX_HEAP)
+
+    if "min_heap" in settings:
+        min_heap = min(parse_size(settings["min_heap"]), max_heap)
+    elif settings.get("pretouch"):
+        # G1 works best with the whole heap committed up front.
+        min_heap = max_heap
+    else:
+        min_heap = min(MIN_HEAP, max_heap)
+    return min_heap, max_heap
+
+
+def g1_flags(max_heap):
+    \"""
+    Get the G1 garbage collector flags tuned for Minecraft servers, as published at https://mcflags.emc.gs.
+
+    Args:
+        max_heap (int): The maximum heap size in MiB.
+
+    Returns:
+        A list of JVM arguments.
+    \"""
+
+    # Large heaps get a bigger young generation and larger regions.
+    large = max_heap >= 12 * 1024
+    return [
+        "-XX:+UseG1GC",
+        "-XX:+ParallelRefProcEnabled",
+        "-XX:MaxGCPauseMillis=200",
+        "-XX:+UnlockExperimentalVMOptions",
+        "-XX:+DisableExplicitGC",
+        f"-XX:G1NewSizePercent={40 if large else 30}",
+        f"-XX:G1MaxNewSizePercent={50 if large else 40}",
+        f"-XX:G1HeapRegionSize={'16M' if large else '8M'}",
+        f"-XX:G1ReservePercent={15 if large else 20}",
+        "-XX:G1HeapWastePercent=5",
+        "-XX:G1MixedGCCountTarget=4",
+        f"-XX:InitiatingHeapOccupancyPercent={20 if large else 15}",
+        "-XX:G1MixedGCLiveThresholdPercent=90",
+        "-XX:G1RSetUpdatingPauseTimePercent=5",
+        "-XX:SurvivorRatio=32",
+        "-XX:+PerfDisableSharedMem",
+        "-XX:MaxTenuringThreshold=1",
+        "-Dusing.aikars.flags=https://mcflags.emc.gs",
+        "-Daikars.new.flags=true",
+    ]
+
+
+def java_version(java):
+    \"""
+    Get the version of a Java runtime.
+
+    Args:
+        java (str): The 'java' executable.
+
+    Returns:
+        The version string, e.g. '21.0.2', or None if it couldn't be read.
+    \"""
+
+    try:
+        output = subprocess.run([java, "-version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout
+    except OSError:
+        return None
+    match = re.search(r'version "([^"]+)"', output.decode(errors="replace"))
+    return match.group(1) if match else None
+
+
+def cds_args(java, jar):
+    \"""
+    Get the arguments that create and reuse a class data sharing archive for a JAR, which cuts the time spent
+    loading classes when the server starts.
+
+    The archive is written when the server stops, so the first start after an update builds it and later starts use
+    it. Archives for other JARs or Java versions are deleted, unless this is a dry run.
+
+    Args:
+        java (str): The 'java' executable.
+        jar (str): The server JAR.
+
+    Returns:
+        A list of JVM arguments. Empty if the Java version doesn't support dynamic archives.
+    \"""
+
+    version = java_version(java)
+    # Java 8 reports '1.8.0'.
+    major = int(re.match(r"(\\d+)", version).group(1)) if version else 0
+    if major == 1 or major < 13:
+        return []
+
+    archive = os.path.join(CDS_DIR, f"{os.path.splitext(jar)[0]}-java{version}.jsa")
+    if not args.dry_run:
+        os.makedirs(CDS_DIR, exist_ok=True)
+        for file in glob.glob(os.path.join(CDS_DIR, "*.jsa")):
+            if file != archive:
+                os.remove(file)
+
+    if major >= 19:
+        # Creates the archive when it is missing or unusable and uses it otherwise.
+        return ["-XX:+AutoCreateSharedArchive", f"-XX:SharedArchiveFile={archive}"]
+    if os.path.isfile(archive):
+        return [f"-XX:SharedArchiveFile={archive}"]
+    return [f"-XX:ArchiveClassesAtExit={archive}"]
+
+
+parser = ArgumentParser(description="Update and start the PaperMC server.")
+parser.add_argument(
+    "--update",
+    choices=["wait", "background", "skip"],
+    default="wait",
+    help="'wait' updates before starting, 'background' starts right away and stages the update for the next restart, "
+    "'skip' doesn't check for updates. Default is 'wait'.",
+)
+parser.add_argument("--dry-run", action="store_true", help="Print the Java command instead of starting the server")
+parser.add_argument(
+    "--timings",
+    action="store_true",
+    help="Print how long each phase took, up to the server stopping, and the CPU, disk and memory it used, and add "
+    f"the run to '{update.TIMINGS_HISTORY_PATH}'",
+)
+parser.add_argument(
+    "--trace-json",
+    metavar="PATH",
+    help="Save the phases as a trace for chrome://tracing or https://ui.perfetto.dev, and add the run to "
+    f"'{update.TIMINGS_HISTORY_PATH}'",
+)
+# The defaults, for when this is imported instead of run.
+args = parser.parse_args([])
+
+
+def main(argv=None):
+    \"""
+    Update the server JAR and start the server in the current directory.
+
+    Args:
+        argv (list): The command line arguments. Defaults to the arguments the script was run with.
+
+    Returns:
+        The exit code.
+    \"""
+
+    global args
+    args = parser.parse_args(argv)
+    if args.timings or args.trace_json:
+        update.tracer.enabled = True
+        # Also records runs that end in 'sys.exit()'.
+        atexit.register(
+            update.tracer.finish,
+            [sys.argv[0], *(sys.argv[1:] if argv is None else argv)],
+            args.timings,
+            args.trace_json,
+        )
+
+    # Swap in an update that finished downloading in the background.
+    if not args.dry_run:
+        with update.tracer.span("apply staged"):
+            update.apply_staged()
+
+    # Check if there is an update and if so, update the server JAR.
+    update_exit_code = 0
+    if args.dry_run:
+        pass
+    elif args.update == "background" and glob.glob("paper*.jar"):
+        # Background updates outlive this script, so they run in their own process.
+        update_args = [os.path.join(".", "update.py"), "--mc-version", MC_VERSION, "--stage", "--quiet"]
+        if "win" in sys.platform:
+            update_args.insert(0, "py")
+        subprocess.Popen(update_args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    elif args.update != "skip" or not glob.glob("paper*.jar"):
+        with update.tracer.span("update"):
+            try:
+                update_exit_code = update.main(["--mc-version", MC_VERSION])
+            except OSError as e:
+                # The updater only gives up on an unreachable API when there is no JAR to fall back on.
+                print(f"Could not download PaperMC: {e}", file=sys.stderr)
+                return 1
+
+    # Start PaperMC.
+    with update.tracer.span("java command"):
+        settings = load_settings()
+        java = settings.get("java", "java")
+        papermc_jars = glob.glob("paper*.jar")
+        if not papermc_jars:
+            print("There is no PaperMC JAR to start. Run it again once PaperMC can be downloaded.", file=sys.stderr)
+            return update_exit_code or 1
+        papermc_jar = papermc_jars[0]
+        min_heap, max_heap = heap_size(settings)
+        command = [java, f"-Xms{min_heap}M", f"-Xmx{max_heap}M"]
+        if settings.get("gc_flags", True):
+            command += g1_flags(max_heap)
+        if settings.get("pretouch"):
+            command.append("-XX:+AlwaysPreTouch")
+        if settings.get("cds", True):
+            command += cds_args(java, papermc_jar)
+        command += [*settings.get("jvm_args", []), "-jar", papermc_jar, "nogui"]
+
+    if args.dry_run:
+        print(subprocess.list2cmdline(command))
+        return 0
+    # The JVM's CPU time and peak memory are counted once it exits.
+    with update.tracer.span("java", jar=papermc_jar, heap=f"{max_heap}M") as span:
+        span["exit_code"] = subprocess.run(command).returncode
+    return span["exit_code"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+""".lstrip(
+            "\n"
+        )
+    )
+
+    start_script_path = os.path.join(server_name, "start.py")
+    with open(start_script_path, "w") as f:
+        f.write(start_script)
+    if not is_windows():
+        # Make the script executable.
+        os.chmod(start_script_path, os.stat(start_script_path).st_mode | stat.S_IEXEC)
+
+
+def load_updater():
+    """
+    Import the code of the generated 'update.py' as a module.
+
+    Returns:
+        The update module.
+    """
+
+    module = types.ModuleType("update")
+    exec(compile(UPDATE_SCRIPT, "update.py", "exec"), module.__dict__)
+    return module
+
+
+# The update module. It is shared by every server set up in one run, so the PaperMC API is only asked once.
+updater = load_updater()
+# Records the spans of this run for '--timings' and '--trace-json', including the updater's API calls and downloads.
+tracer = updater.tracer
+
+
+@contextmanager
+def working_directory(path):
+    """
+    Change the working directory until the block exits.
+
+    Args:
+        path (str): The directory to change to.
+    """
+
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def is_windows():
+    return "win" in sys.platform
+
+
+def is_macos():
+    return sys.platform == "darwin"
+
+
+def is_linux():
+    return sys.platform == "linux"
+
+
+# Region (.mca) files start with a table of 1024 chunk locations followed by a table of 1024 timestamps, each one
+# sector long. A location is a 3-byte sector offset and a 1-byte sector count.
+REGION_SECTOR_SIZE = 4096
+
+
+def read_region_header(f):
+    """
+    Read the location and timestamp tables of a region file.
+
+    Args:
+        f (file): The region file opened in binary mode.
+
+    Returns:
+        A list of 1024 (sector offset, sector count, timestamp) tuples indexed by '(x & 31) + (z & 31) * 32'. Chunks
+        that haven't been generated have an offset of 0.
+    """
+
+    f.seek(0)
+    header = f.read(2 * REGION_SECTOR_SIZE)
+    if len(header) < 2 * REGION_SECTOR_SIZE:
+        raise ValueError("The region file is too short to have a header.")
+    locations = struct.unpack(">1024I", header[:REGION_SECTOR_SIZE])
+    timestamps = struct.unpack(">1024I", header[REGION_SECTOR_SIZE:])
+    return [(location >> 8, location & 0xFF, timestamp) for location, timestamp in zip(locations, timestamps)]
+
+
+def read_region_chunk(f, offset, sector_count):
+    """
+    Read a chunk's record from a region file.
+
+    Args:
+        f (file): The region file opened in binary mode.
+        offset (int): The sector the chunk starts at.
+        sector_count (int): The number of sectors the chunk takes up.
+
+    Returns:
+        The record as stored in the file: a 4-byte length, a 1-byte compression type and the chunk data.
+    """
+
+    f.seek(offset * REGION_SECTOR_SIZE)
+    length_bytes = f.read(4)
+    if len(length_bytes) < 4:
+        raise ValueError(f"The chunk at sector {offset} is past the end of the file.")
+    length = struct.unpack(">I", length_bytes)[0]
+    if length == 0 or length + 4 > sector_count * REGION_SECTOR_SIZE:
+        raise ValueError(f"The chunk at sector {offset} has an invalid length of {length}.")
+    data = f.read(length)
+    if len(data) < length:
+        raise ValueError(f"The chunk at sector {offset} is truncated.")
+    return length_bytes + data
+
+
+def write_region(path, chunks):
+    """
+    Write a region file with its chunks packed back to back.
+
+    Args:
+        path (str): The region file to write.
+        chunks (dict): (timestamp, record) tuples keyed by chunk index, with records as returned by
+            'read_region_chunk()'.
+    """
+
+    locations = [0] * 1024
+    timestamps = [0] * 1024
+    sector = 2
+    with open(path, "wb") as f:
+        f.seek(sector * REGION_SECTOR_SIZE)
+        for index in sorted(chunks):
+            timestamp, record = chunks[index]
+            padding = -len(record) % REGION_SECTOR_SIZE
+            sector_count = (len(record) + padding) // REGION_SECTOR_SIZE
+            f.write(record)
+            f.write(bytes(padding))
+            locations[index] = (sector << 8) | sector_count
+            timestamps[index] = timestamp
+            sector += sector_count
+        f.seek(0)
+        f.write(struct.pack(">1024I", *locations))
+        f.write(struct.pack(">1024I", *timestamps))
+
+
+NBT_NUMBER_FORMATS = {1: ">b", 2: ">h", 3: ">i", 4: ">q", 5: ">f", 6: ">d"}
+
+
+def skip_nbt_payload(data, position, tag_type):
+    """
+    Find where an NBT tag's payload ends without decoding it.
+
+    Args:
+        data (bytes): The uncompressed NBT data.
+        position (int): Where the payload starts.
+        tag_type (int): The tag's type ID.
+
+    Returns:
+        The position after the payload.
+    """
+
+    if tag_type in NBT_NUMBER_FORMATS:
+        return position + struct.calcsize(NBT_NUMBER_FORMATS[tag_type])
+    if tag_type == 8:
+        return position + 2 + struct.unpack_from(">H", data, position)[0]
+    if tag_type in [7, 11, 12]:
+        item_size = {7: 1, 11: 4, 12: 8}[tag_type]
+        return position + 4 + item_size * struct.unpack_from(">i", data, position)[0]
+    if tag_type == 9:
+        item_type = data[position]
+        length = struct.unpack_from(">i", data, position + 1)[0]
+        position += 5
+        if item_type in NBT_NUMBER_FORMATS:
+            return position + struct.calcsize(NBT_NUMBER_FORMATS[item_type]) * max(length, 0)
+        for _ in range(length):
+            position = skip_nbt_payload(data, position, item_type)
+        return position
+    if tag_type == 10:
+        while True:
+            child_type = data[position]
+            position += 1
+            if child_type == 0:
+                return position
+            position += 2 + struct.unpack_from(">H", data, position)[0]
+            position = skip_nbt_payload(data, position, child_type)
+    raise ValueError(f"Unknown NBT tag type {tag_type}.")
+
+
+def read_nbt_numbers(data, paths):
+    """
+    Read number tags from NBT data, skipping over everything else.
+
+    Args:
+        data (bytes): The uncompressed NBT data, starting with its root compound.
+        paths (list): Tuples of tag names leading to the wanted tags from the root compound, e.g.
+            ('Data', 'SpawnX').
+
+    Returns:
+        A dictionary of the values found keyed by path.
+
+    Raises:
+        ValueError: If the data isn't valid NBT.
+    """
+
+    if not data or data[0] != 10:
+        raise ValueError("NBT data must start with a compound tag.")
+    values = {}
+
+    def read_compound(position, parent):
+        while True:
+            tag_type = data[position]
+            position += 1
+            if tag_type == 0:
+                return position
+            name_length = struct.unpack_from(">H", data, position)[0]
+            path = (*parent, data[position + 2 : position + 2 + name_length].decode(errors="replace"))
+            position += 2 + name_length
+            if path in paths and tag_type in NBT_NUMBER_FORMATS:
+                values[path] = struct.unpack_from(NBT_NUMBER_FORMATS[tag_type], data, position)[0]
+            if tag_type == 10 and any(wanted[: len(path)] == path for wanted in paths):
+                position = read_compound(position, path)
+            else:
+                position = skip_nbt_payload(data, position, tag_type)
+
+    try:
+        read_compound(3 + struct.unpack_from(">H", data, 1)[0], ())
+    except (IndexError, struct.error) as e:
+        raise ValueError(f"Truncated NBT data: {e}")
+    return values
+
+
+def decompress_chunk(record):
+    """
+    Decompress a chunk's NBT data.
+
+    Args:
+        record (bytes): The chunk's record as returned by 'read_region_chunk()'.
+
+    Returns:
+        The uncompressed NBT data, or None if the chunk is stored in a separate '.mcc' file or uses a compression
+        this script can't read.
+    """
+
+    compression = record[4]
+    if compression == 1:
+        return gzip.decompress(record[5:])
+    if compression == 2:
+        return zlib.decompress(record[5:])
+    if compression == 3:
+        return record[5:]
+    return None
+
+
+class TokenBucket:
+    """
+    Limits how many bytes per second all threads together may read.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        # Lowered while the server is lagging.
+        self.factor = 1.0
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def consume(self, amount):
+        """
+        Take tokens for the given number of bytes, sleeping until the rate allows it.
+
+        Args:
+            amount (int): The number of bytes about to be read.
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            rate = self.rate * self.factor
+            # Allow bursts of up to one second's worth of reads.
+            self.tokens = min(rate, self.tokens + (now - self.updated) * rate) - amount
+            self.updated = now
+            delay = -self.tokens / rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+            self.local.waited = self.waited() + delay
+
+    def waited(self):
+        """
+        Get how long the current thread has been held back.
+
+        Returns:
+            The number of seconds the current thread has slept.
+        """
+
+        return getattr(self.local, "waited", 0.0)
+
+    def adapt_to_tps(self, read_tps, min_tps, interval=10):
+        """
+        Halve the rate whenever the server's TPS is below 'min_tps' and double it again once it recovers.
+
+        Args:
+            read_tps (function): Returns the server's current TPS, or None if it couldn't be read.
+            min_tps (float): The TPS below which reads are slowed down.
+            interval (float): How many seconds to wait between checks.
+
+        Returns:
+            An Event that stops the monitoring when set.
+        """
+
+        stop = threading.Event()
+
+        def monitor():
+            while not stop.wait(interval):
+                tps = read_tps()
+                if tps is None:
+                    continue
+                with self.lock:
+                    if tps < min_tps:
+                        self.factor = max(self.factor / 2, 1 / 16)
+                    else:
+                        self.factor = min(self.factor * 2, 1.0)
+            self.factor = 1.0
+
+        threading.Thread(target=monitor, daemon=True).start()
+        return stop
+
+
+class ThrottledWriter:
+    """
+    A write-only file object that passes data on to another file object no faster than 'read_throttle' allows.
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, data):
+        read_throttle.consume(len(data))
+        return self.f.write(data)
+
+
+# Set by 'limit_reads()' to throttle how fast backups read world files.
+read_throttle = None
+
+
+def limit_reads(rate):
+    """
+    Limit how fast backups read world files.
+
+    Args:
+        rate (float): The maximum number of bytes per second.
+    """
+
+    global read_throttle
+    read_throttle = TokenBucket(rate)
+
+
+def throttle_read(amount):
+    """
+    Wait until reading the given number of bytes stays within the read limit, if there is one.
+
+    Args:
+        amount (int): The number of bytes read.
+    """
+
+    if read_throttle:
+        read_throttle.consume(amount)
+
+
+def throttle_process(process, interval=0.05):
+    """
+    Keep a process that reads the world files itself, like 7z, within the read limit by pausing it whenever it gets
+    ahead. Only works on Linux, where '/proc' tells how much a process has read.
+
+    Args:
+        process (subprocess.Popen): The process to throttle.
+        interval (float): How many seconds the process runs between checks.
+
+    Returns:
+        The exit code of the process.
+    """
+
+    read = 0
+    while process.poll() is None:
+        try:
+            with open(f"/proc/{process.pid}/io") as f:
+                total = next(int(line.split()[1]) for line in f if line.startswith("rchar:"))
+        except (OSError, StopIteration):
+            break
+        if total > read:
+            os.kill(process.pid, signal.SIGSTOP)
+            try:
+                read_throttle.consume(total - read)
+            finally:
+                os.kill(process.pid, signal.SIGCONT)
+            read = total
+        time.sleep(interval)
+    return process.wait()
+
+
+def lower_priority(niceness=None, io_class=None):
+    """
+    Lower the CPU and disk priority of this process and the processes it starts.
+
+    Args:
+        niceness (int): How much to increase the niceness by.
+        io_class (str): 'idle' to only use the disk when nothing else does or 'best-effort' for the lowest
+            best-effort priority.
+    """
+
+    if niceness:
+        os.nice(niceness)
+    if io_class:
+        if not shutil.which("ionice"):
+            print("Could not find 'ionice'. The disk priority was not changed.")
+            return
+        io_priority = ["-c", "3"] if io_class == "idle" else ["-c", "2", "-n", "7"]
+        subprocess.run(["ionice", *io_priority, "-p", str(os.getpid())], check=True)
+
+
+# Incremental backups split files into fixed-size chunks so only the parts of a world that changed get stored again.
+BACKUP_CHUNK_SIZE = 1024 * 1024
+
+
+def chunk_path(repository, digest):
+    """
+    Get the path of a chunk in an incremental backup repository.
+
+    Args:
+        repository (str): The path to the backup repository.
+        digest (str): The SHA-256 of the chunk's uncompressed data.
+
+    Returns:
+        The path of the chunk.
+    """
+
+    return os.path.join(repository, "chunks", digest[:2], digest)
+
+
+def load_snapshot(repository, snapshot):
+    """
+    Load a snapshot manifest from an incremental backup repository.
+
+    Args:
+        repository (str): The path to the backup repository.
+        snapshot (str): The name of the snapshot.
+
+    Returns:
+        The snapshot manifest.
+    """
+
+    with open(os.path.join(repository, "snapshots", f"{snapshot}.json")) as f:
+        return json.load(f)
+
+
+def list_snapshots(repository):
+    """
+    List the snapshots in an incremental backup repository, oldest first.
+
+    Args:
+        repository (str): The path to the backup repository.
+
+    Returns:
+        A list of snapshot names.
+    """
+
+    snapshots_directory = os.path.join(repository, "snapshots")
+    if not os.path.isdir(snapshots_directory):
+        return []
+    return sorted(file[: -len(".json")] for file in os.listdir(snapshots_directory) if file.endswith(".json"))
+
+
+def store_chunk(repository, data):
+    """
+    Compress and store a chunk unless the repository already has it.
+
+    Args:
+        repository (str): The path to the backup repository.
+        data (bytes): The chunk's data.
+
+    Returns:
+        A tuple of the chunk's SHA-256 and the number of compressed bytes written (0 if it was already stored).
+    """
+
+    digest = hashlib.sha256(data).hexdigest()
+    path = chunk_path(repository, digest)
+    if os.path.exists(path):
+        return digest, 0
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    compressed = zlib.compress(data)
+    # Write to a temporary file first so an interrupted backup never leaves a truncated chunk behind.
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(compressed)
+    os.replace(temp_path, path)
+    return digest, len(compressed)
+
+
+def read_chunk(repository, digest):
+    """
+    Read and verify a chunk from an incremental backup repository.
+
+    Args:
+        repository (str): The path to the backup repository.
+        digest (str): The SHA-256 of the chunk's uncompressed data.
+
+    Returns:
+        The chunk's uncompressed data.
+    """
+
+    with open(chunk_path(repository, digest), "rb") as f:
+        data = zlib.decompress(f.read())
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"Chunk {digest} in '{repository}' is corrupt.")
+    return data
+
+
+def backup_incremental(server_path, world_saves, repository, snapshot):
+    """
+    Back up world saves into an incremental backup repository.
+
+    Files whose size and modification time match the previous snapshot are not read again. Changed files are split
+    into chunks and only chunks the repository doesn't already have are compressed and written.
+
+    Args:
+        server_path (str): The path to the server directory.
+        world_saves (list): The world save directories relative to the server directory.
+        repository (str): The path to the backup repository.
+        snapshot (str): The name of the new snapshot.
+
+    Returns:
+        A dictionary of statistics about the backup.
+    """
+
+    snapshots = list_snapshots(repository)
+    previous_files = load_snapshot(repository, snapshots[-1])["files"] if snapshots else {}
+
+    manifest = {"created": datetime.now().isoformat(), "world_saves": world_saves, "directories": [], "files": {}}
+    stats = {"files": 0, "files_read": 0, "bytes_read": 0, "chunks_written": 0, "bytes_written": 0}
+    for world_save in world_saves:
+        for root, directories, files in os.walk(os.path.join(server_path, world_save)):
+            relative_root = os.path.relpath(root, server_path)
+            manifest["directories"].append(relative_root)
+            for file in files:
+                path = os.path.join(root, file)
+                relative_path = os.path.join(relative_root, file)
+                file_stat = os.stat(path)
+                entry = {"size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns, "mode": file_stat.st_mode}
+                stats["files"] += 1
+
+                previous = previous_files.get(relative_path)
+                if previous and previous["size"] == entry["size"] and previous["mtime_ns"] == entry["mtime_ns"]:
+                    entry.update((key, previous[key]) for key in ["chunks", "region"] if key in previous)
+                elif file.endswith(".mca") and backup_region(path, entry, previous, repository, stats):
+                    stats["files_read"] += 1
+                else:
+                    entry["chunks"] = []
+                    with open(path, "rb") as f:
+                        for data in iter(lambda: f.read(BACKUP_CHUNK_SIZE), b""):
+                            throttle_read(len(data))
+                            digest, written = store_chunk(repository, data)
+                            entry["chunks"].append(digest)
+                            stats["bytes_read"] += len(data)
+                            if written:
+                                stats["chunks_written"] += 1
+                                stats["bytes_written"] += written
+                    stats["files_read"] += 1
+                manifest["files"][relative_path] = entry
+
+    # The manifest is written last so a snapshot only exists once all of its chunks do.
+    snapshot_path = os.path.join(repository, "snapshots", f"{snapshot}.json")
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    with open(f"{snapshot_path}.tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(f"{snapshot_path}.tmp", snapshot_path)
+    return stats
+
+
+def backup_region(path, entry, previous, repository, stats):
+    """
+    Back up a region file chunk by chunk.
+
+    Each Minecraft chunk is stored on its own, and a chunk whose timestamp, sector and length match the previous
+    snapshot is taken from it without being read, so a region where players only touched a few chunks costs a few
+    chunks to back up.
+
+    Args:
+        path (str): The region file.
+        entry (dict): The file's manifest entry. A 'region' list of [index, timestamp, digest, sector offset, length]
+            is added to it.
+        previous (dict): The file's manifest entry in the previous snapshot, if any.
+        repository (str): The path to the backup repository.
+        stats (dict): Backup statistics to update.
+
+    Returns:
+        True if the region file was backed up, False if it couldn't be parsed and should be backed up as a
+        regular file.
+    """
+
+    previous_chunks = {}
+    if previous and "region" in previous:
+        previous_chunks = {chunk[0]: chunk for chunk in previous["region"]}
+
+    region = []
+    with open(path, "rb") as f:
+        try:
+            header = read_region_header(f)
+            throttle_read(2 * REGION_SECTOR_SIZE)
+            stats["bytes_read"] += 2 * REGION_SECTOR_SIZE
+            for index, (offset, sector_count, timestamp) in enumerate(header):
+                if offset == 0:
+                    continue
+                # Timestamps are in whole seconds, so a chunk saved again in the second of the previous backup only
+                # differs in where it was written and how long it is.
+                f.seek(offset * REGION_SECTOR_SIZE)
+                length = f.read(4)
+                length = struct.unpack(">I", length)[0] if len(length) == 4 else None
+                previous_chunk = previous_chunks.get(index)
+                if previous_chunk and previous_chunk[1] == timestamp and previous_chunk[3:] == [offset, length]:
+                    region.append(previous_chunk)
+                    continue
+                record = read_region_chunk(f, offset, sector_count)
+                throttle_read(len(record))
+                digest, written = store_chunk(repository, record)
+                region.append([index, timestamp, digest, offset, length])
+                stats["bytes_read"] += len(record)
+                if written:
+                    stats["chunks_written"] += 1
+                    stats["bytes_written"] += written
+        except ValueError:
+            return False
+
+    entry["region"] = region
+    return True
+
+
+def path_selected(path, paths):
+    """
+    Check if a path in a backup is one of the given paths or inside one of them.
+
+    Args:
+        path (str): The path relative to the server directory.
+        paths (list): The paths to select, or None to select everything.
+
+    Returns:
+        True if the path is selected.
+    """
+
+    if paths is None:
+        return True
+    path = os.path.normpath(path)
+    return any(path == selected or path.startswith(selected + os.sep) for selected in paths)
+
+
+def restore_snapshot(repository, snapshot, target_path, paths=None):
+    """
+    Rebuild the world saves of a snapshot from an incremental backup repository.
+
+    Args:
+        repository (str): The path to the backup repository.
+        snapshot (str): The name of the snapshot to restore.
+        target_path (str): The directory to restore the world saves into.
+        paths (list): Only restore these files and directories. None restores everything.
+    """
+
+    manifest = load_snapshot(repository, snapshot)
+    for directory in manifest["directories"]:
+        if path_selected(directory, paths):
+            os.makedirs(os.path.join(target_path, directory), exist_ok=True)
+    for relative_path, entry in manifest["files"].items():
+        if not path_selected(relative_path, paths):
+            continue
+        os.makedirs(os.path.dirname(os.path.join(target_path, relative_path)), exist_ok=True)
+        path = os.path.join(target_path, relative_path)
+        if "region" in entry:
+            write_region(
+                path,
+                {chunk[0]: (chunk[1], read_chunk(repository, chunk[2])) for chunk in entry["region"]},
+            )
+        else:
+            with open(path, "wb") as f:
+                for digest in entry["chunks"]:
+                    f.write(read_chunk(repository, digest))
+        os.chmod(path, stat.S_IMODE(entry["mode"]))
+        os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+
+def archive_members(archive):
+    """
+    List the files and directories in a tar or 7z archive.
+
+    Args:
+        archive (str): The path to the archive.
+
+    Returns:
+        A list of the paths in the archive.
+
+    Raises:
+        subprocess.CalledProcessError: If the archive can't be read.
+    """
+
+    if archive.endswith(".7z"):
+        process = subprocess.run(
+            ["7z", "l", "-slt", archive], stdout=subprocess.PIPE, universal_newlines=True, check=True
+        )
+        # The technical listing describes the archive itself before the line of dashes, then every file in it.
+        listing = process.stdout.split("\n----------\n", 1)[-1]
+        return [line[len("Path = ") :] for line in listing.splitlines() if line.startswith("Path = ")]
+    process = subprocess.run(
+        ["tar", "--list", "--auto-compress", "--file", archive],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    return [line.rstrip("/") for line in process.stdout.splitlines()]
+
+
+def restore_backup(server_path, backup, paths=None, y=False):
+    """
+    Replace a server's world saves, or only some files and directories in them, with the ones from a backup.
+
+    The backup is restored into a temporary directory first, so the current files are only removed once the
+    restore has succeeded. Seekable archives and incremental snapshots only read the data for the selected paths.
+
+    Args:
+        server_path (str): The path to the server directory.
+        backup (str): The name of an incremental snapshot, or the file name or path of an archive.
+        paths (list): Only restore these files and directories, relative to the server directory. None restores
+            every world save in the backup.
+        y (bool): Don't ask for confirmation before replacing the current files.
+    """
+
+    repository = os.path.join(server_path, "backup", "repository")
+    archive = None
+    if backup not in list_snapshots(repository):
+        archive = backup if os.path.isfile(backup) else os.path.join(server_path, "backup", backup)
+        if not os.path.isfile(archive):
+            print(f"Could not find a backup named '{backup}' in '{server_path}'.")
+            sys.exit(1)
+
+    if paths is not None:
+        paths = [os.path.normpath(path) for path in paths]
+    if not y:
+        try:
+            restore_confirmation = input(
+                f"Are you sure you want to replace {', '.join(paths) if paths else 'the worlds'} in '{server_path}' "
+                f"with '{backup}'? (y/N): "
+            )
+        except KeyboardInterrupt:
+            sys.exit()
+        if restore_confirmation.lower() not in ["y", "yes"]:
+            sys.exit()
+
+    temp_path = os.path.join(server_path, ".restore")
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    os.makedirs(temp_path)
+    if archive is None:
+        restore_snapshot(repository, backup, temp_path, paths)
+    elif archive.endswith(f".{compression_file_extensions['seekable']}"):
+        extract_seekable_archive(archive, temp_path, paths)
+    else:
+        try:
+            found = None
+            if paths is not None:
+                # tar and 7z fail on paths they don't have, and would extract everything if given none.
+                members = archive_members(archive)
+                found = [
+                    path for path in paths if any(member == path or member.startswith(f"{path}/") for member in members)
+                ]
+            if found is None or found:
+                if archive.endswith(".7z"):
+                    command = ["7z", "x", os.path.abspath(archive), *(found or [])]
+                else:
+                    command = ["tar", "--extract", "--auto-compress", "--file", os.path.abspath(archive)]
+                    command += found or []
+                subprocess.run(command, cwd=temp_path, check=True)
+        except subprocess.CalledProcessError:
+            shutil.rmtree(temp_path)
+            print(f"Could not extract '{backup}'.")
+            sys.exit(1)
+
+    for path in paths or os.listdir(temp_path):
+        if not os.path.lexists(os.path.join(temp_path, path)):
+            print(f"'{path}' is not in '{backup}'.")
+            continue
+        current_path = os.path.join(server_path, path)
+        if os.path.isdir(current_path) and not os.path.islink(current_path):
+            shutil.rmtree(current_path)
+        elif os.path.lexists(current_path):
+            os.remove(current_path)
+        os.makedirs(os.path.dirname(os.path.abspath(current_path)), exist_ok=True)
+        os.replace(os.path.join(temp_path, path), current_path)
+        print(f"Restored '{path}'.")
+    shutil.rmtree(temp_path)
+
+
+if not is_windows() and not is_macos() and not is_linux():
+    print("Unsupported operating system.")
+    exit(1)
+
+compression_file_extensions = {
+    "7z": "7z",
+    "gzip": "tar.gz",
+    "bzip2": "tar.bz2",
+    "xz": "tar.xz",
+    "lzip": "tar.lz",
+    "lzma": "tar.lzma",
+    "lzop": "tar.lzo",
+    "zstd": "tar.zst",
+    "compress": "tar.Z",
+    "seekable": "mcbk",
+}
+
+# Commands that compress stdin to stdout for each tar format, best first. None stands for compressing blocks in a
+# pool of processes, which is faster than the single-threaded tools listed after it.
+tar_compressors = {
+    "gzip": [["pigz", "-p", "{jobs}"], None],
+    "bzip2": [["pbzip2", "-p{jobs}"], ["lbzip2", "-n", "{jobs}"], None],
+    "xz": [["xz", "-T", "{jobs}"], None],
+    "lzip": [["plzip", "-n", "{jobs}"], ["lzip"]],
+    "lzma": [["xz", "--format=lzma"], ["lzma"]],
+    "lzop": [["lzop"]],
+    "zstd": [["zstd", "-q", "-T{jobs}"]],
+    "compress": [["compress"]],
+}
+
+# Size of the blocks a tar stream is split into when it is compressed in a pool of processes.
+ARCHIVE_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def compress_block(compression, data):
+    """
+    Compress a block of a tar stream as a complete stream of its own.
+
+    gzip, bzip2 and xz files may consist of several streams back to back, which is what lets each block be
+    compressed independently while the result is still a standard archive.
+
+    Args:
+        compression (str): 'gzip', 'bzip2' or 'xz'.
+        data (bytes): The block to compress.
+
+    Returns:
+        The compressed block.
+    """
+
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if compression == "bzip2":
+        return bz2.compress(data)
+    return lzma.compress(data, format=lzma.FORMAT_XZ)
+
+
+class ParallelCompressor:
+    """
+    A write-only file object that compresses what is written to it in blocks across a pool of processes and writes
+    the compressed blocks in order.
+    """
+
+    def __init__(self, f, compression, jobs):
+        self.f = f
+        self.compression = compression
+        self.executor = ProcessPoolExecutor(max_workers=jobs)
+        # Cap the blocks in flight so memory use stays bounded when compression is slower than reading.
+        self.max_pending = jobs * 2
+        self.pending = deque()
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= ARCHIVE_BLOCK_SIZE:
+            self.submit(bytes(self.buffer[:ARCHIVE_BLOCK_SIZE]))
+            del self.buffer[:ARCHIVE_BLOCK_SIZE]
+        return len(data)
+
+    def submit(self, block):
+        if len(self.pending) >= self.max_pending:
+            self.f.write(self.pending.popleft().result())
+        self.pending.append(self.executor.submit(compress_block, self.compression, block))
+
+    def close(self):
+        if self.buffer:
+            self.submit(bytes(self.buffer))
+            self.buffer.clear()
+        while self.pending:
+            self.f.write(self.pending.popleft().result())
+        self.executor.shutdown()
+
+
+def find_tar_compressor(compression, jobs):
+    """
+    Find the best available way to compress a tar stream.
+
+    Args:
+        compression (str): The compression type.
+        jobs (int): The number of threads or processes to use.
+
+    Returns:
+        A command that compresses stdin to stdout, None to use a ParallelCompressor.
+    """
+
+    for command in tar_compressors[compression]:
+        if command is None:
+            return None
+        if shutil.which(command[0]):
+            return [argument.format(jobs=jobs) for argument in command] + ["-c"]
+
+    print(f"Could not find a program to compress with {compression}.")
+    sys.exit(1)
+
+
+def create_archive(server_path, world_saves, backup_path, compression, jobs):
+    """
+    Archive world saves into a single compressed file.
+
+    Tar archives are streamed from Python straight into a multi-threaded compressor, or into a pool of processes
+    when no such compressor is installed. The archive is written under a temporary name and only renamed once it is
+    complete.
+
+    Args:
+        server_path (str): The path to the server directory.
+        world_saves (list): The world save directories relative to the server directory.
+        backup_path (str): The archive to create.
+        compression (str): The compression type.
+        jobs (int): The number of threads or processes to use.
+    """
+
+    temp_path = f"{backup_path}.part"
+    if compression == "seekable":
+        create_seekable_archive(server_path, world_saves, temp_path, jobs)
+    elif compression == "7z":
+        command = ["7z", "a", "-t7z", f"-mmt={jobs}", os.path.abspath(temp_path), *world_saves]
+        process = subprocess.Popen(command, cwd=server_path)
+        # 7z reads the files itself, so it is paused whenever it reads faster than the limit.
+        if (throttle_process(process) if read_throttle else process.wait()) != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+    else:
+        command = find_tar_compressor(compression, jobs)
+        with open(temp_path, "wb") as f:
+            if command:
+                process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=f)
+                stream = process.stdin
+            else:
+                stream = ParallelCompressor(f, compression, jobs)
+
+            with tarfile.open(fileobj=ThrottledWriter(stream) if read_throttle else stream, mode="w|") as tar:
+                for world_save in world_saves:
+                    tar.add(os.path.join(server_path, world_save), arcname=world_save)
+            stream.close()
+
+            if command and process.wait() != 0:
+                raise subprocess.CalledProcessError(process.returncode, command)
+    os.replace(temp_path, backup_path)
+
+
+# How long to wait for the server to finish writing the world to disk before giving up on a live backup.
+SAVE_TIMEOUT = 120
+
+# RCON packet types.
+RCON_RESPONSE = 0
+RCON_COMMAND = 2
+RCON_LOGIN = 3
+# Minecraft answers packets of an unknown type with a single packet, which marks the end of a split response.
+RCON_END_MARKER = 200
+
+
+def read_server_properties(server_name):
+    """
+    Read a server's 'server.properties'.
+
+    Args:
+        server_name (str): The name of the server.
+
+    Returns:
+        A dictionary of the properties, which is empty if the file doesn't exist yet.
+    """
+
+    properties = {}
+    try:
+        with open(os.path.join(server_name, "server.properties"), encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith(("#", "!")) or "=" not in line:
+                    continue
+                key, value = line.split("=", 1)
+                properties[key.strip()] = value.strip().replace("\\:", ":").replace("\\=", "=")
+    except FileNotFoundError:
+        pass
+    return properties
+
+
+class RconClient:
+    """
+    A client for the RCON protocol that Minecraft servers use for remote commands.
+    """
+
+    def __init__(self, host, port, password, timeout=10):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self.socket = None
+        self.request_id = 0
+        # One command at a time, so responses can't get mixed up between threads.
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """
+        Connect and log in.
+
+        Raises:
+            PermissionError: If the password is wrong.
+        """
+
+        self.socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        request_id = self.send(RCON_LOGIN, self.password)
+        response_id, _, _ = self.receive()
+        if response_id == -1 or response_id != request_id:
+            self.close()
+            raise PermissionError(f"RCON login to {self.host}:{self.port} failed. Check 'rcon.password'.")
+
+    def close(self):
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+
+    def connection_lost(self):
+        """
+        Check if the server closed the connection since the last command, as it does when it restarts.
+
+        Returns:
+            True if the connection can't be used anymore.
+        """
+
+        try:
+            readable, _, _ = select.select([self.socket], [], [], 0)
+            # A closed connection is readable and has nothing left to read.
+            return bool(readable) and not self.socket.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def send(self, packet_type, body):
+        self.request_id = self.request_id % 0x7FFFFFFF + 1
+        payload = struct.pack("<ii", self.request_id, packet_type) + body.encode("utf-8") + b"\x00\x00"
+        self.socket.sendall(struct.pack("<i", len(payload)) + payload)
+        return self.request_id
+
+    def receive_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("The server closed the RCON connection.")
+            data += chunk
+        return data
+
+    def receive(self):
+        """
+        Receive a packet.
+
+        Returns:
+            A tuple of the request id, packet type and body.
+        """
+
+        (length,) = struct.unpack("<i", self.receive_exactly(4))
+        payload = self.receive_exactly(length)
+        request_id, packet_type = struct.unpack("<ii", payload[:8])
+        return request_id, packet_type, payload[8:-2].decode("utf-8", errors="replace")
+
+    def command(self, command):
+        """
+        Run a command and return its output, reconnecting if the connection was lost since the last command.
+
+        A command is only sent again if it couldn't be sent at all. Once it was sent, the server may have run it, so
+        losing the connection while waiting for the output is an error rather than a reason to run it twice.
+
+        Args:
+            command (str): The command to run, without a leading slash.
+
+        Returns:
+            The command's output.
+
+        Raises:
+            OSError: If the server can't be reached or the connection was lost after sending the command.
+        """
+
+        with self.lock:
+            for attempt in range(2):
+                if self.socket and self.connection_lost():
+                    self.close()
+                if not self.socket:
+                    self.connect()
+                try:
+                    request_id = self.send(RCON_COMMAND, command)
+                except OSError:
+                    self.close()
+                    if attempt:
+                        raise
+                    continue
+
+                try:
+                    end_id = self.send(RCON_END_MARKER, "")
+                    output = []
+                    while True:
+                        response_id, _, body = self.receive()
+                        if response_id == end_id:
+                            return "".join(output)
+                        if response_id == request_id:
+                            output.append(body)
+                except OSError:
+                    self.close()
+                    raise
+
+
+# Open RCON connections by server name, so repeated commands reuse one connection.
+rcon_clients = {}
+rcon_clients_lock = threading.Lock()
+
+
+def rcon_enabled(server_name):
+    """
+    Check if a server has RCON turned on in 'server.properties'.
+
+    Args:
+        server_name (str): The name of the server.
+
+    Returns:
+        True if RCON is enabled and has a password.
+    """
+
+    properties = read_server_properties(server_name)
+    return properties.get("enable-rcon") == "true" and bool(properties.get("rcon.password"))
+
+
+def rcon_command(server_name, command):
+    """
+    Run a command on a server over RCON, reusing the server's open connection if there is one.
+
+    Args:
+        server_name (str): The name of the server.
+        command (str): The command to run.
+
+    Returns:
+        The command's output.
+
+    Raises:
+        OSError: If the server can't be reached.
+    """
+
+    with rcon_clients_lock:
+        client = rcon_clients.get(server_name)
+        if client is None:
+            properties = read_server_properties(server_name)
+            client = RconClient(
+                properties.get("server-ip") or "127.0.0.1",
+                int(properties.get("rcon.port") or 25575),
+                properties.get("rcon.password", ""),
+            )
+            rcon_clients[server_name] = client
+    return client.command(command)
+
+
+def rcon_reachable(server_name):
+    """
+    Check if a server is running and accepts RCON commands.
+
+    Args:
+        server_name (str): The name of the server.
+
+    Returns:
+        True if a command can be sent over RCON.
+    """
+
+    if not rcon_enabled(server_name):
+        return False
+    try:
+        rcon_command(server_name, "list")
+    except OSError:
+        return False
+    return True
+
+
+def session_running(tmux_id):
+    """
+    Check if a tmux session with exactly the given name exists.
+
+    Args:
+        tmux_id (str): The name of the tmux session.
+
+    Returns:
+        True if the session exists.
+    """
+
+    # The '=' prefix stops tmux from matching sessions that only start with the name.
+    return (
+        subprocess.run(
+            ["tmux", "has-session", "-t", f"={tmux_id}"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ).returncode
+        == 0
+    )
+
+
+def send_console_command(tmux_id, command):
+    """
+    Type a command into a server console running in a tmux session.
+
+    Args:
+        tmux_id (str): The name of the tmux session.
+        command (str): The command to run.
+    """
+
+    subprocess.run(["tmux", "send-keys", "-t", f"={tmux_id}:", "-l", command], check=True)
+    subprocess.run(["tmux", "send-keys", "-t", f"={tmux_id}:", "Enter"], check=True)
+
+
+def console_output(tmux_id):
+    """
+    Get the console output of a tmux session, including its scrollback.
+
+    Args:
+        tmux_id (str): The name of the tmux session.
+
+    Returns:
+        The console output.
+    """
+
+    return subprocess.run(
+        ["tmux", "capture-pane", "-p", "-J", "-S", "-", "-t", f"={tmux_id}:"], stdout=subprocess.PIPE
+    ).stdout.decode(errors="replace")
+
+
+def run_console_command(tmux_id, command, response, timeout):
+    """
+    Run a command in a server console and wait for the server to print a response.
+
+    Args:
+        tmux_id (str): The name of the tmux session.
+        command (str): The command to run.
+        response (str): Text the server prints once the command has finished.
+        timeout (float): How many seconds to wait for the response.
+
+    Returns:
+        True if the response was printed before the timeout.
+    """
+
+    seen = console_output(tmux_id).count(response)
+    send_console_command(tmux_id, command)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if console_output(tmux_id).count(response) > seen:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+# The Unix socket a supervised server listens on for attaching and commands, relative to the server directory.
+SUPERVISOR_SOCKET = ".supervisor.sock"
+# How many lines of console output the supervisor keeps for clients that attach later.
+CONSOLE_BUFFER_LINES = 2000
+# Seconds to wait before restarting a crashed server. Doubles after every crash up to the maximum.
+RESTART_BACKOFF = 5
+RESTART_BACKOFF_MAX = 300
+# A server that ran this many seconds before crashing starts over with the shortest backoff.
+RESTART_STABLE_AFTER = 600
+# Seconds a server gets to shut down after 'stop' before it is killed.
+STOP_TIMEOUT = 120
+
+
+class Supervisor:
+    """
+    Runs a server's 'start.py' with its console on pipes, restarts it when it crashes and serves its console over a
+    Unix socket.
+
+    Clients send one request line to the socket:
+        'attach' replays the buffered console output, then streams new output and forwards every line sent to the
+        server console until the client disconnects. 'follow' does the same without the replay.
+        'status' returns the supervisor state as JSON.
+        'stop' stops the server and the supervisor.
+    """
+
+    def __init__(self, server_name):
+        self.server_name = server_name
+        self.socket_path = os.path.join(server_name, SUPERVISOR_SOCKET)
+        self.buffer = deque(maxlen=CONSOLE_BUFFER_LINES)
+        self.clients = set()
+        self.process = None
+        self.started = None
+        self.restarts = 0
+        self.stopping = False
+        self.stop_requested = None
+
+    def log(self, message):
+        self.broadcast(f"[supervisor] {message}\n".encode())
+
+    def broadcast(self, line):
+        self.buffer.append(line)
+        sys.stdout.buffer.write(line)
+        sys.stdout.flush()
+        for writer in list(self.clients):
+            # Drop clients that stopped reading rather than buffering output for them forever.
+            if writer.transport.get_write_buffer_size() > 1024 * 1024:
+                self.clients.discard(writer)
+                writer.close()
+            else:
+                writer.write(line)
+
+    def send(self, line):
+        """
+        Write a line to the server console.
+
+        Args:
+            line (bytes): The line to write, including the newline.
+        """
+
+        if self.process and self.process.returncode is None:
+            self.process.stdin.write(line)
+
+    def stop(self):
+        """
+        Ask the server to stop and keep it from being restarted.
+        """
+
+        if not self.stopping:
+            self.stopping = True
+            self.log("Stopping the server.")
+            self.send(b"stop\n")
+            self.stop_requested.set()
+
+    async def run_server(self):
+        """
+        Run the server until it stops cleanly or a stop is requested, restarting it after crashes.
+        """
+
+        backoff = RESTART_BACKOFF
+        while not self.stopping:
+            start_script = [sys.executable, "start.py"]
+            if self.restarts:
+                # Don't keep a crashed server down waiting on the network. The update is used on the next restart.
+                start_script += ["--update", "background"]
+            self.process = await asyncio.create_subprocess_exec(
+                *start_script,
+                cwd=self.server_name,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                # A new process group so Java can be killed along with 'start.py'.
+                start_new_session=True,
+                limit=1024 * 1024,
+            )
+            self.started = time.time()
+            self.log(f"Started '{self.server_name}' with PID {self.process.pid}.")
+
+            stop_waiter = asyncio.ensure_future(self.kill_after_stop())
+            while True:
+                line = await self.process.stdout.readline()
+                if not line:
+                    break
+                self.broadcast(line)
+            return_code = await self.process.wait()
+            stop_waiter.cancel()
+
+            if self.stopping or return_code == 0:
+                self.log(f"'{self.server_name}' stopped with exit code {return_code}.")
+                return
+            if time.time() - self.started >= RESTART_STABLE_AFTER:
+                backoff = RESTART_BACKOFF
+            self.log(f"'{self.server_name}' crashed with exit code {return_code}. Restarting in {backoff} seconds.")
+            try:
+                await asyncio.wait_for(self.stop_requested.wait(), backoff)
+            except asyncio.TimeoutError:
+                pass
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+            self.restarts += 1
+
+    async def kill_after_stop(self):
+        await self.stop_requested.wait()
+        try:
+            await asyncio.wait_for(asyncio.shield(self.process.wait()), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.log(f"'{self.server_name}' did not stop within {STOP_TIMEOUT} seconds. Killing it.")
+            os.killpg(self.process.pid, signal.SIGKILL)
+
+    async def handle_client(self, reader, writer):
+        request = (await reader.readline()).decode(errors="replace").strip()
+        try:
+            if request == "status":
+                status = {
+                    "pid": self.process.pid if self.process and self.process.returncode is None else None,
+                    "started": self.started,
+                    "restarts": self.restarts,
+                    "stopping": self.stopping,
+                }
+                writer.write(json.dumps(status).encode() + b"\n")
+            elif request == "stop":
+                self.stop()
+            elif request in ["attach", "follow"]:
+                if request == "attach":
+                    writer.write(b"".join(self.buffer))
+                self.clients.add(writer)
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self.send(line if line.endswith(b"\n") else line + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def run(self):
+        """
+        Serve the socket and run the server until it stops.
+        """
+
+        self.stop_requested = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        for signal_number in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(signal_number, self.stop)
+
+        socket_server = await asyncio.start_unix_server(self.handle_client, self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        try:
+            await self.run_server()
+        finally:
+            socket_server.close()
+            for writer in list(self.clients):
+                writer.close()
+            os.remove(self.socket_path)
+
+
+def supervisor_connect(server_name, request, timeout=10):
+    """
+    Open a connection to a server's supervisor and send a request.
+
+    Args:
+        server_name (str): The name of the server.
+        request (str): The request line, e.g. 'attach' or 'status'.
+        timeout (float): The socket timeout in seconds.
+
+    Returns:
+        The connected socket.
+
+    Raises:
+        OSError: If the server isn't supervised.
+    """
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(os.path.join(server_name, SUPERVISOR_SOCKET))
+        connection.sendall(f"{request}\n".encode())
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+
+def supervisor_status(server_name):
+    """
+    Ask a server's supervisor for its state.
+
+    Args:
+        server_name (str): The name of the server.
+
+    Returns:
+        A dictionary with the 'pid' of 'start.py', when it was 'started', the number of 'restarts' and whether it is
+        'stopping', or None if the server isn't supervised.
+    """
+
+    if is_windows() or not os.path.exists(os.path.join(server_name, SUPERVISOR_SOCKET)):
+        return None
+    try:
+        with supervisor_connect(server_name, "status", timeout=5) as connection:
+            return json.loads(connection.makefile().readline())
+    except (OSError, ValueError):
+        return None
+
+
+def supervisor_command(server_name, command, response=None, timeout=1):
+    """
+    Run a command in a supervised server's console and collect the output it prints.
+
+    Args:
+        server_name (str): The name of the server.
+        command (str): The command to run.
+        response (str): Stop collecting output once this text is printed. Without it, output is collected until
+            the timeout.
+        timeout (float): How many seconds to collect output for.
+
+    Returns:
+        The output printed after the command was sent, or None if the response wasn't printed before the timeout.
+
+    Raises:
+        OSError: If the server isn't supervised.
+    """
+
+    with supervisor_connect(server_name, "follow") as connection:
+        connection.sendall(f"{command}\n".encode())
+        output = b""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            connection.settimeout(max(deadline - time.monotonic(), 0.01))
+            try:
+                data = connection.recv(65536)
+            except socket.timeout:
+                break
+            if not data:
+                break
+            output += data
+            if response and response.encode() in output and output.endswith(b"\n"):
+                return output.decode(errors="replace")
+    return None if response else output.decode(errors="replace")
+
+
+def attach_supervisor(server_name):
+    """
+    Show a supervised server's console and forward typed lines to it until Ctrl+C or Ctrl+D.
+
+    Args:
+        server_name (str): The name of the server.
+    """
+
+    connection = supervisor_connect(server_name, "attach")
+    connection.settimeout(None)
+
+    def show_output():
+        while True:
+            data = connection.recv(65536)
+            if not data:
+                break
+            sys.stdout.buffer.write(data)
+            sys.stdout.flush()
+
+    output_thread = threading.Thread(target=show_output, daemon=True)
+    output_thread.start()
+    print(f"Attached to '{server_name}'. Press Ctrl+C or Ctrl+D to detach.")
+    try:
+        for line in sys.stdin:
+            connection.sendall(line.encode())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connection.close()
+    print(f"\nDetached from '{server_name}'.")
+
+
+@contextmanager
+def saving_paused(server_name):
+    """
+    Flush the world to disk and keep the server from saving until the block exits.
+
+    Does nothing if the server isn't running.
+
+    Args:
+        server_name (str): The name of the server.
+    """
+
+    tmux_id = f"mc-{server_name}"
+    # RCON is preferred since commands only return once the server has run them.
+    if rcon_reachable(server_name):
+        console = "rcon"
+    elif supervisor_status(server_name):
+        console = "supervisor"
+    elif is_linux() and session_running(tmux_id):
+        console = "tmux"
+    else:
+        yield
+        return
+
+    def run(command, response=None):
+        if console == "rcon":
+            rcon_command(server_name, command)
+        elif console == "supervisor":
+            if supervisor_command(server_name, command, response, SAVE_TIMEOUT if response else 0) is None:
+                return False
+        elif response:
+            return run_console_command(tmux_id, command, response, SAVE_TIMEOUT)
+        else:
+            send_console_command(tmux_id, command)
+        return True
+
+    paused_at = time.monotonic()
+    run("save-off")
+    try:
+        if not run("save-all flush", "Saved the game"):
+            raise TimeoutError(f"'{server_name}' did not finish saving within {SAVE_TIMEOUT} seconds.")
+        yield
+    finally:
+        run("save-on")
+        print(f"Saving '{server_name}' was paused for {(time.monotonic() - paused_at) * 1000:.0f} ms.")
+
+
+def read_tps(server_name):
+    """
+    Ask a server for its TPS over the last minute, over RCON if it is enabled or through its console otherwise.
+
+    Args:
+        server_name (str): The name of the server.
+
+    Returns:
+        The TPS, or None if the server didn't answer.
+    """
+
+    if rcon_enabled(server_name):
+        try:
+            output = rcon_command(server_name, "tps")
+        except OSError:
+            return None
+    elif supervisor_status(server_name):
+        try:
+            output = supervisor_command(server_name, "tps", "TPS from last", 5)
+        except OSError:
+            return None
+        if output is None:
+            return None
+    else:
+        tmux_id = f"mc-{server_name}"
+        if not is_linux() or not run_console_command(tmux_id, "tps", "TPS from last", 5):
+            return None
+        output = console_output(tmux_id)
+    # Strip colors so only the numbers are left.
+    matches = re.findall(r"TPS from last 1m, 5m, 15m: \*?([\d.]+)", strip_colors(output))
+    return float(matches[-1]) if matches else None
+
+
+def reflinks_supported(source_directory, target_directory):
+    """
+    Check if files can be reflinked from one directory into another.
+
+    This needs GNU cp and a filesystem with copy-on-write, like Btrfs or XFS, holding both directories.
+
+    Args:
+        source_directory (str): The directory to copy from.
+        target_directory (str): The directory to copy into.
+
+    Returns:
+        True if a test file could be reflinked.
+    """
+
+    source = os.path.join(source_directory, f".reflink-test-{os.getpid()}")
+    target = os.path.join(target_directory, f".reflink-test-{os.getpid()}")
+    try:
+        with open(source, "wb") as f:
+            f.write(bytes(4096))
+        process = subprocess.run(
+            ["cp", "--reflink=always", source, target], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        return process.returncode == 0
+    except OSError:
+        return False
+    finally:
+        for path in [source, target]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def snapshot_world_saves(server_path, world_saves, snapshot_path, reflink):
+    """
+    Take a point-in-time copy of world saves.
+
+    Reflinking is near-instant. Hardlinks aren't used because the server rewrites region files in place, which would
+    change the snapshot too.
+
+    Args:
+        server_path (str): The path to the server directory.
+        world_saves (list): The world save directories relative to the server directory.
+        snapshot_path (str): The directory to copy the world saves into.
+        reflink (bool): Reflink the files, as checked with 'reflinks_supported()', rather than copy them.
+    """
+
+    os.makedirs(snapshot_path)
+    if reflink:
+        subprocess.run(
+            [
+                "cp",
+                "--archive",
+                "--reflink=always",
+                *[os.path.join(server_path, world_save) for world_save in world_saves],
+                snapshot_path,
+            ],
+            check=True,
+        )
+        return
+    for world_save in world_saves:
+        shutil.copytree(os.path.join(server_path, world_save), os.path.join(snapshot_path, world_save), symlinks=True)
+
+
+# Seekable archives store every file as independently compressed frames, followed by a compressed JSON index of the
+# frames and a fixed-size footer pointing at the index, so any file can be read back without touching the rest.
+SEEKABLE_MAGIC = b"MCBK\x01"
+SEEKABLE_FOOTER = struct.Struct(">QQ8s")
+SEEKABLE_FOOTER_MAGIC = b"MCBKTOC1"
+SEEKABLE_FRAME_SIZE = 4 * 1024 * 1024
+
+
+def create_seekable_archive(server_path, world_saves, archive_path, jobs):
+    """
+    Archive world saves into a seekable archive, compressing frames across a pool of processes.
+
+    Args:
+        server_path (str): The path to the server directory.
+        world_saves (list): The world save directories relative to the server directory.
+        archive_path (str): The archive to create.
+        jobs (int): The number of processes to use.
+    """
+
+    index = {"world_saves": world_saves, "directories": [], "files": []}
+
+    def frames():
+        for world_save in world_saves:
+            for root, directories, files in os.walk(os.path.join(server_path, world_save)):
+                relative_root = os.path.relpath(root, server_path)
+                index["directories"].append(relative_root.replace(os.sep, "/"))
+                for file in files:
+                    path = os.path.join(root, file)
+                    file_stat = os.stat(path)
+                    entry = {
+                        "path": os.path.join(relative_root, file).replace(os.sep, "/"),
+                        "size": file_stat.st_size,
+                        "mode": file_stat.st_mode,
+                        "mtime_ns": file_stat.st_mtime_ns,
+                        "frames": [],
+                    }
+                    index["files"].append(entry)
+                    with open(path, "rb") as f:
+                        for data in iter(lambda: f.read(SEEKABLE_FRAME_SIZE), b""):
+                            throttle_read(len(data))
+                            yield entry, data
+
+    with open(archive_path, "wb") as f, ProcessPoolExecutor(max_workers=jobs) as executor:
+        f.write(SEEKABLE_MAGIC)
+        pending = deque()
+
+        def write_frame():
+            entry, size, future = pending.popleft()
+            compressed = future.result()
+            entry["frames"].append([f.tell(), len(compressed), size])
+            f.write(compressed)
+
+        for entry, data in frames():
+            # Cap the frames in flight so memory use stays bounded when compression is slower than reading.
+            if len(pending) >= jobs * 2:
+                write_frame()
+            pending.append((entry, len(data), executor.submit(zlib.compress, data)))
+        while pending:
+            write_frame()
+
+        index_offset = f.tell()
+        compressed_index = zlib.compress(json.dumps(index).encode())
+        f.write(compressed_index)
+        f.write(SEEKABLE_FOOTER.pack(index_offset, len(compressed_index), SEEKABLE_FOOTER_MAGIC))
+
+
+def read_seekable_index(f):
+    """
+    Read the index of a seekable archive.
+
+    Args:
+        f (file): The archive opened in binary mode.
+
+    Returns:
+        The archive's index.
+    """
+
+    f.seek(-SEEKABLE_FOOTER.size, os.SEEK_END)
+    index_offset, index_length, magic = SEEKABLE_FOOTER.unpack(f.read(SEEKABLE_FOOTER.size))
+    if magic != SEEKABLE_FOOTER_MAGIC:
+        raise ValueError("The file is not a seekable archive or is incomplete.")
+    f.seek(index_offset)
+    return json.loads(zlib.decompress(f.read(index_length)))
+
+
+def extract_seekable_archive(archive_path, target_path, paths=None):
+    """
+    Extract files from a seekable archive, reading only the frames of the selected files.
+
+    Args:
+        archive_path (str): The archive to extract.
+        target_path (str): The directory to extract into.
+        paths (list): Only extract these files and directories. None extracts everything.
+    """
+
+    with open(archive_path, "rb") as f:
+        index = read_seekable_index(f)
+        for directory in index["directories"]:
+            directory = os.path.join(*directory.split("/"))
+            if path_selected(directory, paths):
+                os.makedirs(os.path.join(target_path, directory), exist_ok=True)
+        for entry in index["files"]:
+            relative_path = os.path.join(*entry["path"].split("/"))
+            if not path_selected(relative_path, paths):
+                continue
+            path = os.path.join(target_path, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as output:
+                for offset, length, size in entry["frames"]:
+                    f.seek(offset)
+                    data = zlib.decompress(f.read(length))
+                    if len(data) != size:
+                        raise ValueError(f"A frame of '{entry['path']}' in '{archive_path}' is corrupt.")
+                    output.write(data)
+            os.chmod(path, stat.S_IMODE(entry["mode"]))
+            os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+
+def find_servers():
+    """
+    Find the servers in the current directory, which are the directories with a 'start.py' from 'add_scripts()'.
+
+    Returns:
+        A sorted list of server names.
+    """
+
+    return sorted(
+        entry.name for entry in os.scandir() if entry.is_dir() and os.path.isfile(os.path.join(entry.path, "start.py"))
+    )
+
+
+def tmux_sessions():
+    """
+    List the tmux sessions and the process running in each one.
+
+    Returns:
+        A dictionary keyed by session name with 'attached' and 'pane_pid' entries. Empty if tmux isn't installed or
+        isn't running.
+    """
+
+    if not shutil.which("tmux"):
+        return {}
+    panes = subprocess.run(
+        ["tmux", "list-panes", "-a", "-F", "#{session_name}\t#{session_attached}\t#{pane_pid}"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    sessions = {}
+    for line in panes.stdout.decode().splitlines():
+        name, attached, pane_pid = line.split("\t")
+        # Only keep the first pane of each session.
+        sessions.setdefault(name, {"attached": attached != "0", "pane_pid": int(pane_pid)})
+    return sessions
+
+
+def process_table():
+    """
+    Read the name, parent and CPU statistics of every process from '/proc'.
+
+    Returns:
+        A dictionary of process details keyed by PID. Empty on systems without '/proc'.
+    """
+
+    processes = {}
+    if not os.path.isdir("/proc"):
+        return processes
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat_line = f.read()
+        except OSError:
+            continue
+        # The process name is in parentheses and may contain spaces, so split after it.
+        name = stat_line[stat_line.index("(") + 1 : stat_line.rindex(")")]
+        fields = stat_line[stat_line.rindex(")") + 2 :].split()
+        processes[int(entry)] = {
+            "name": name,
+            "ppid": int(fields[1]),
+            "cpu_ticks": int(fields[11]) + int(fields[12]),
+            "start_ticks": int(fields[19]),
+        }
+    return processes
+
+
+def find_server_process(pid, processes):
+    """
+    Find the Java process started by the process in a server's tmux session.
+
+    Args:
+        pid (int): The PID of the process in the tmux session.
+        processes (dict): The processes returned by 'process_table()'.
+
+    Returns:
+        The PID of the Java process, or None if it isn't running.
+    """
+
+    children = {}
+    for child, details in processes.items():
+        children.setdefault(details["ppid"], []).append(child)
+    pending = [pid]
+    while pending:
+        current = pending.pop(0)
+        if processes.get(current, {}).get("name") == "java":
+            return current
+        pending.extend(children.get(current, []))
+    return None
+
+
+def directory_size(path):
+    """
+    Get the total size of the files in a directory tree.
+
+    Args:
+        path (str): The directory.
+
+    Returns:
+        The size in bytes.
+    """
+
+    size = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            size += directory_size(entry.path)
+        elif entry.is_file(follow_symlinks=False):
+            size += entry.stat(follow_symlinks=False).st_size
+    return size
+
+
+def last_backup_time(server_name):
+    """
+    Get when a server was last backed up.
+
+    Args:
+        server_name (str): The name of the server.
+
+    Returns:
+        When the newest backup in the catalog was made, or None if there are no backups.
+    """
+
+    return max((entry["created"] for entry in load_catalog(server_name).values()), default=None)
+
+
+def server_status(server_name, world_name, sessions, processes):
+    """
+    Collect the state of a server.
+
+    Args:
+        server_name (str): The name of the server.
+        world_name (str): The name of the server's world.
+        sessions (dict): The tmux sessions returned by 'tmux_sessions()'.
+        processes (dict): The processes returned by 'process_table()'.
+
+    Returns:
+        A dictionary describing the server.
+    """
+
+    session = sessions.get(f"mc-{server_name}")
+    supervisor = None if session else supervisor_status(server_name)
+    jars = sorted(file for file in os.listdir(server_name) if file.startswith("paper") and file.endswith(".jar"))
+    backed_up = last_backup_time(server_name)
+    status = {
+        "server": server_name,
+        "state": (
+            "supervised"
+            if supervisor
+            else "stopped" if not session else "attached" if session["attached"] else "running"
+        ),
+        "pid": None,
+        "rss_bytes": None,
+        "cpu_percent": None,
+        "uptime_seconds": None,
+        "version": jars[-1][len("paper-") : -len(".jar")] if jars else None,
+        "world_bytes": sum(
+            directory_size(os.path.join(server_name, world_save))
+            for world_save in [world_name, f"{world_name}_nether", f"{world_name}_the_end"]
+        ),
+        "last_backup_age_seconds": time.time() - backed_up if backed_up else None,
+    }
+
+    parent_pid = session["pane_pid"] if session else supervisor["pid"] if supervisor else None
+    pid = find_server_process(parent_pid, processes) if parent_pid else None
+    if pid:
+        status["pid"] = pid
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        status["rss_bytes"] = int(line.split()[1]) * 1024
+            with open("/proc/uptime") as f:
+                system_uptime = float(f.read().split()[0])
+        except OSError:
+            return status
+        ticks_per_second = os.sysconf("SC_CLK_TCK")
+        uptime = system_uptime - processes[pid]["start_ticks"] / ticks_per_second
+        status["uptime_seconds"] = round(uptime)
+        # Average CPU use since the server started, where 100% is one core.
+        status["cpu_percent"] = round(processes[pid]["cpu_ticks"] / ticks_per_second / max(uptime, 1) * 100, 1)
+    return status
+
+
+def format_duration(seconds):
+    """
+    Format a duration in the largest units that fit, e.g. '3d 4h' or '12m'.
+
+    Args:
+        seconds (float): The duration.
+
+    Returns:
+        The formatted duration.
+    """
+
+    seconds = int(seconds)
+    for unit, size, smaller_unit, smaller_size in [("d", 86400, "h", 3600), ("h", 3600, "m", 60)]:
+        if seconds >= size:
+            return f"{seconds // size}{unit} {seconds % size // smaller_size}{smaller_unit}"
+    return f"{seconds // 60}m" if seconds >= 60 else f"{seconds}s"
+
+
+def format_size(size):
+    """
+    Format a number of bytes with a binary unit, e.g. '1.5 GiB'.
+
+    Args:
+        size (int): The number of bytes.
+
+    Returns:
+        The formatted size.
+    """
+
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def print_table(rows):
+    """
+    Print rows of strings as left-aligned columns.
+
+    Args:
+        rows (list): The rows, starting with the header.
+    """
+
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+
+def print_status(statuses):
+    """
+    Print the state of servers as a table.
+
+    Args:
+        statuses (list): The dictionaries returned by 'server_status()'.
+    """
+
+    rows = [["SERVER", "STATE", "PID", "RSS", "CPU", "UPTIME", "VERSION", "WORLD", "LAST BACKUP"]]
+    for status in statuses:
+        rows.append(
+            [
+                status["server"],
+                status["state"],
+                str(status["pid"] or "-"),
+                format_size(status["rss_bytes"]) if status["rss_bytes"] is not None else "-",
+                f"{status['cpu_percent']}%" if status["cpu_percent"] is not None else "-",
+                format_duration(status["uptime_seconds"]) if status["uptime_seconds"] is not None else "-",
+                status["version"] or "-",
+                format_size(status["world_bytes"]),
+                (
+                    f"{format_duration(status['last_backup_age_seconds'])} ago"
+                    if status["last_backup_age_seconds"] is not None
+                    else "never"
+                ),
+            ]
+        )
+    print_table(rows)
+
+
+def world_dimensions(world_name):
+    """
+    Get the directories holding each dimension's region files.
+
+    Args:
+        world_name (str): The name of the server's world.
+
+    Returns:
+        The overworld, nether and end directories, relative to the server directory.
+    """
+
+    return [
+        world_name,
+        os.path.join(f"{world_name}_nether", "DIM-1"),
+        os.path.join(f"{world_name}_the_end", "DIM1"),
+    ]
+
+
+# InhabitedTime is at the root of chunks since 1.18 and under 'Level' before that.
+INHABITED_TIME_PATHS = [("InhabitedTime",), ("Level", "InhabitedTime")]
+
+
+def region_size(chunks):
+    """
+    Get the size a region file would have when written by 'write_region()'.
+
+    Args:
+        chunks (dict): (timestamp, record) tuples keyed by chunk index.
+
+    Returns:
+        The size in bytes. 0 if there are no chunks, since the file is deleted then.
+    """
+
+    if not chunks:
+        return 0
+    sectors = sum(-(-len(record) // REGION_SECTOR_SIZE) for _, record in chunks.values())
+    return (2 + sectors) * REGION_SECTOR_SIZE
+
+
+def rewrite_region(path, chunks):
+    """
+    Replace a region file with one holding only the given chunks, or delete it if there are none.
+
+    Args:
+        path (str): The region file.
+        chunks (dict): (timestamp, record) tuples keyed by chunk index.
+    """
+
+    if not chunks:
+        os.remove(path)
+        return
+    temp_path = f"{path}.part"
+    write_region(temp_path, chunks)
+    os.replace(temp_path, path)
+
+
+def read_region_chunks(path):
+    """
+    Read every chunk in a region file.
+
+    Args:
+        path (str): The region file.
+
+    Returns:
+        (timestamp, record) tuples keyed by chunk index.
+
+    Raises:
+        ValueError: If the region file is damaged.
+    """
+
+    chunks = {}
+    with open(path, "rb") as f:
+        for index, (offset, sector_count, timestamp) in enumerate(read_region_header(f)):
+            if offset:
+                chunks[index] = (timestamp, read_region_chunk(f, offset, sector_count))
+    return chunks
+
+
+def prune_region(path, related_paths, min_inhabited_time, protected, dry_run):
+    """
+    Drop the chunks of a region file that players spent too little time in, then compact the file.
+
+    Chunks stored in '.mcc' files or compressed with LZ4 are always kept.
+
+    Args:
+        path (str): The region file.
+        related_paths (list): The 'entities' and 'poi' region files with the same coordinates. The pruned chunks
+            are dropped from these as well.
+        min_inhabited_time (int): Chunks with a lower InhabitedTime, in ticks, are dropped.
+        protected (list): (x, z, radius) tuples in blocks. Chunks whose center is inside one of these circles are
+            kept.
+        dry_run (bool): Only work out what would be dropped.
+
+    Returns:
+        A dictionary with the number of 'chunks' and 'pruned' chunks, the size in bytes 'before' and 'after', and an
+        'error' if the file couldn't be read.
+    """
+
+    match = re.fullmatch(r"r\.(-?\d+)\.(-?\d+)\.mca", os.path.basename(path))
+    region_x, region_z = int(match.group(1)), int(match.group(2))
+    stats = {"chunks": 0, "pruned": 0, "before": 0, "after": 0, "error": None}
+    try:
+        chunks = read_region_chunks(path)
+        pruned = set()
+        for index, (_, record) in chunks.items():
+            data = decompress_chunk(record)
+            if data is None:
+                continue
+            values = read_nbt_numbers(data, INHABITED_TIME_PATHS)
+            inhabited_time = values.get(INHABITED_TIME_PATHS[0], values.get(INHABITED_TIME_PATHS[1]))
+            if inhabited_time is None or inhabited_time >= min_inhabited_time:
+                continue
+            block_x = (region_x * 32 + index % 32) * 16 + 8
+            block_z = (region_z * 32 + index // 32) * 16 + 8
+            if any((block_x - x) ** 2 + (block_z - z) ** 2 <= radius**2 for x, z, radius in protected):
+                continue
+            pruned.add(index)
+
+        files = [(path, chunks)]
+        for related_path in related_paths:
+            if os.path.isfile(related_path):
+                files.append((related_path, read_region_chunks(related_path)))
+    except (ValueError, OSError, zlib.error, EOFError) as e:
+        stats["error"] = f"{path}: {e}"
+        return stats
+
+    stats["chunks"] = len(chunks)
+    stats["pruned"] = len(pruned)
+    for file_path, file_chunks in files:
+        kept = {index: chunk for index, chunk in file_chunks.items() if index not in pruned}
+        before = os.path.getsize(file_path)
+        after = region_size(kept)
+        stats["before"] += before
+        if after < before and not dry_run:
+            rewrite_region(file_path, kept)
+        stats["after"] += min(after, before)
+    return stats
+
+
+def world_spawn(level_path):
+    """
+    Read the world spawn from 'level.dat'.
+
+    Args:
+        level_path (str): The path to 'level.dat'.
+
+    Returns:
+        A tuple of the spawn's x and z block coordinates. (0, 0) if 'level.dat' can't be read.
+    """
+
+    paths = [("Data", "SpawnX"), ("Data", "SpawnZ")]
+    try:
+        with gzip.open(level_path, "rb") as f:
+            values = read_nbt_numbers(f.read(), paths)
+    except (OSError, ValueError, EOFError):
+        return 0, 0
+    return values.get(paths[0], 0), values.get(paths[1], 0)
+
+
+def prune_world(server_name, world_name, min_inhabited_time, protected, spawn_radius, dry_run, jobs):
+    """
+    Drop the chunks of a server's worlds that players spent too little time in, in parallel across region files.
+
+    Args:
+        server_name (str): The name of the server.
+        world_name (str): The name of the server's world.
+        min_inhabited_time (int): Chunks with a lower InhabitedTime, in ticks, are dropped.
+        protected (list): (x, z, radius) tuples in blocks, kept in every dimension.
+        spawn_radius (int): The radius in blocks kept around the overworld spawn.
+        dry_run (bool): Only work out what would be dropped.
+        jobs (int): How many region files to process at once.
+
+    Returns:
+        A dictionary of summed statistics, as returned by 'prune_region()', keyed by dimension directory, with the
+        number of 'regions' and a list of 'errors'.
+    """
+
+    dimensions = world_dimensions(world_name)
+    spawn_x, spawn_z = world_spawn(os.path.join(server_name, world_name, "level.dat"))
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for dimension in dimensions:
+            region_directory = os.path.join(server_name, dimension, "region")
+            if not os.path.isdir(region_directory):
+                continue
+            dimension_protected = list(protected)
+            if dimension == world_name:
+                dimension_protected.append((spawn_x, spawn_z, spawn_radius))
+            futures[dimension] = [
+                executor.submit(
+                    prune_region,
+                    os.path.join(region_directory, file),
+                    [os.path.join(server_name, dimension, directory, file) for directory in ["entities", "poi"]],
+                    min_inhabited_time,
+                    dimension_protected,
+                    dry_run,
+                )
+                for file in sorted(os.listdir(region_directory))
+                if re.fullmatch(r"r\.-?\d+\.-?\d+\.mca", file)
+            ]
+        for dimension, dimension_futures in futures.items():
+            total = {"regions": len(dimension_futures), "chunks": 0, "pruned": 0, "before": 0, "after": 0, "errors": []}
+            for future in dimension_futures:
+                stats = future.result()
+                for key in ["chunks", "pruned", "before", "after"]:
+                    total[key] += stats[key]
+                if stats["error"]:
+                    total["errors"].append(stats["error"])
+            results[dimension] = total
+    return results
+
+
+def protected_area(value):
+    """
+    Parse a '--protect' value.
+
+    Args:
+        value (str): The area as 'X,Z,RADIUS' in blocks.
+
+    Returns:
+        A tuple of the x and z coordinates and the radius.
+
+    Raises:
+        ArgumentTypeError: If the value isn't three integers.
+    """
+
+    try:
+        x, z, radius = (int(number) for number in value.split(","))
+    except ValueError:
+        raise ArgumentTypeError(f"'{value}' is not in the form X,Z,RADIUS")
+    return x, z, radius
+
+
+def print_prune_report(results, dry_run):
+    """
+    Print a summary table of a prune.
+
+    Args:
+        results (dict): The statistics returned by 'prune_world()'.
+        dry_run (bool): Whether the prune was a dry run.
+    """
+
+    rows = [["DIMENSION", "REGIONS", "CHUNKS", "PRUNED", "BEFORE", "AFTER", "RECLAIMED"]]
+    for dimension, total in results.items():
+        rows.append(
+            [
+                dimension,
+                str(total["regions"]),
+                str(total["chunks"]),
+                str(total["pruned"]),
+                format_size(total["before"]),
+                format_size(total["after"]),
+                format_size(total["before"] - total["after"]),
+            ]
+        )
+    print_table(rows)
+
+    reclaimed = sum(total["before"] - total["after"] for total in results.values())
+    print(f"\n{'Would reclaim' if dry_run else 'Reclaimed'} {format_size(reclaimed)}.")
+    for total in results.values():
+        for error in total["errors"]:
+            print(f"Skipped damaged region file {error}")
+
+
+# Where '--scan' caches the results for region files that haven't changed, relative to the server directory.
+REGION_SCAN_PATH = ".region-scan.json"
+
+
+def scan_region(path, compact):
+    """
+    Check a region file's sector table and chunks, and optionally rewrite it without unused sectors.
+
+    Files with problems are never rewritten, so nothing that could still be recovered is lost.
+
+    Args:
+        path (str): The region file.
+        compact (bool): Rewrite the file if it has unused sectors.
+
+    Returns:
+        A dictionary with the number of 'chunks', the 'size' of the file before compacting, the 'wasted' bytes in
+        unused sectors, a list of 'problems', and whether it was 'compacted'.
+    """
+
+    match = re.fullmatch(r"r\.(-?\d+)\.(-?\d+)\.mca", os.path.basename(path))
+    region_x, region_z = int(match.group(1)), int(match.group(2))
+    size = os.path.getsize(path)
+    result = {"chunks": 0, "size": size, "wasted": 0, "problems": [], "compacted": False}
+    # The server creates empty region files before it writes to them.
+    if size == 0:
+        return result
+    if size < 2 * REGION_SECTOR_SIZE:
+        result["problems"].append("the file is too short to have a header")
+        return result
+    if size % REGION_SECTOR_SIZE:
+        result["problems"].append(f"the size isn't a multiple of {REGION_SECTOR_SIZE} bytes")
+
+    chunks = {}
+    owners = {}
+    with open(path, "rb") as f:
+        for index, (offset, sector_count, timestamp) in enumerate(read_region_header(f)):
+            if offset == 0:
+                continue
+            chunk_x, chunk_z = region_x * 32 + index % 32, region_z * 32 + index // 32
+            name = f"chunk ({chunk_x}, {chunk_z})"
+            if offset < 2 or sector_count == 0:
+                result["problems"].append(f"{name} has an invalid location (sector {offset}, {sector_count} sectors)")
+                continue
+            if (offset + sector_count) * REGION_SECTOR_SIZE > size:
+                result["problems"].append(f"{name} ends past the end of the file")
+                continue
+            overlaps = {owners[sector] for sector in range(offset, offset + sector_count) if sector in owners}
+            if overlaps:
+                result["problems"].append(f"{name} overlaps {', '.join(sorted(overlaps))}")
+            for sector in range(offset, offset + sector_count):
+                owners[sector] = name
+
+            try:
+                record = read_region_chunk(f, offset, sector_count)
+                compression = record[4]
+                if compression & 128:
+                    # The chunk is too large for the region file and is stored next to it.
+                    if not os.path.isfile(os.path.join(os.path.dirname(path), f"c.{chunk_x}.{chunk_z}.mcc")):
+                        raise ValueError("is stored in a '.mcc' file that is missing")
+                elif compression in [1, 2, 3]:
+                    data = decompress_chunk(record)
+                    if not data or data[0] != 10:
+                        raise ValueError("doesn't start with a compound tag")
+                    skip_nbt_payload(data, 3 + struct.unpack_from(">H", data, 1)[0], 10)
+                elif compression != 4:
+                    raise ValueError(f"uses unknown compression type {compression}")
+            except (ValueError, IndexError, struct.error, zlib.error, EOFError, OSError) as e:
+                message = str(e)
+                # Messages from 'read_region_chunk()' already name the chunk's sector.
+                result["problems"].append(f"{name}: {message[0].lower() + message[1:]}" if message else name)
+                continue
+            chunks[index] = (timestamp, record)
+
+    result["chunks"] = len(chunks)
+    if result["problems"] or not chunks:
+        return result
+    result["wasted"] = size - region_size(chunks)
+    if compact and result["wasted"] >= REGION_SECTOR_SIZE:
+        rewrite_region(path, chunks)
+        result["compacted"] = True
+    return result
+
+
+def scan_world(server_name, world_name, compact, jobs):
+    """
+    Check the region files of a server's worlds in parallel, skipping files that haven't changed since the last scan.
+
+    Args:
+        server_name (str): The name of the server.
+        world_name (str): The name of the server's world.
+        compact (bool): Rewrite files that have unused sectors.
+        jobs (int): How many region files to check at once.
+
+    Returns:
+        The results returned by 'scan_region()' keyed by path relative to the server directory, with 'cached' set
+        for files that were skipped.
+    """
+
+    cache_path = os.path.join(server_name, REGION_SCAN_PATH)
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for dimension in world_dimensions(world_name):
+            for kind in ["region", "entities", "poi"]:
+                directory = os.path.join(dimension, kind)
+                if not os.path.isdir(os.path.join(server_name, directory)):
+                    continue
+                for file in sorted(os.listdir(os.path.join(server_name, directory))):
+                    if not re.fullmatch(r"r\.-?\d+\.-?\d+\.mca", file):
+                        continue
+                    path = os.path.join(directory, file)
+                    file_stat = os.stat(os.path.join(server_name, path))
+                    cached = cache.get(path)
+                    if (
+                        cached
+                        and cached["mtime_ns"] == file_stat.st_mtime_ns
+                        and cached["size"] == file_stat.st_size
+                        and not (compact and cached["result"]["wasted"] >= REGION_SECTOR_SIZE)
+                    ):
+                        results[path] = dict(cached["result"], cached=True)
+                    else:
+                        futures[path] = executor.submit(scan_region, os.path.join(server_name, path), compact)
+        for path, future in futures.items():
+            results[path] = dict(future.result(), cached=False)
+
+    # Only keep files that still exist, and remember them as they are after compacting.
+    cache = {}
+    for path, result in results.items():
+        full_path = os.path.join(server_name, path)
+        if not os.path.exists(full_path):
+            continue
+        file_stat = os.stat(full_path)
+        cached_result = dict(result, compacted=False)
+        del cached_result["cached"]
+        if result["compacted"]:
+            cached_result.update(size=file_stat.st_size, wasted=0)
+        cache[path] = {"mtime_ns": file_stat.st_mtime_ns, "size": file_stat.st_size, "result": cached_result}
+    temp_path = f"{cache_path}.part"
+    with open(temp_path, "w") as f:
+        json.dump(cache, f)
+    os.replace(temp_path, cache_path)
+    return results
+
+
+def print_scan_report(results):
+    """
+    Print a summary table of a region scan followed by every problem found.
+
+    Args:
+        results (dict): The results returned by 'scan_world()'.
+    """
+
+    totals = {}
+    for path, result in results.items():
+        total = totals.setdefault(
+            os.path.dirname(path), {"files": 0, "scanned": 0, "chunks": 0, "problems": 0, "wasted": 0, "compacted": 0}
+        )
+        total["files"] += 1
+        total["scanned"] += 0 if result["cached"] else 1
+        total["chunks"] += result["chunks"]
+        total["problems"] += len(result["problems"])
+        total["wasted"] += result["wasted"]
+        total["compacted"] += 1 if result["compacted"] else 0
+
+    rows = [["DIRECTORY", "FILES", "SCANNED", "CHUNKS", "PROBLEMS", "UNUSED", "COMPACTED"]]
+    for directory, total in totals.items():
+        rows.append(
+            [
+                directory,
+                str(total["files"]),
+                str(total["scanned"]),
+                str(total["chunks"]),
+                str(total["problems"]),
+                format_size(total["wasted"]),
+                str(total["compacted"]),
+            ]
+        )
+    print_table(rows)
+
+    reclaimed = sum(result["wasted"] for result in results.values() if result["compacted"])
+    if reclaimed:
+        print(f"\nReclaimed {format_size(reclaimed)}.")
+    problems = [(path, problem) for path, result in results.items() for problem in result["problems"]]
+    if problems:
+        print()
+        for path, problem in problems:
+            print(f"{path}: {problem}")
+
+
+# Where '--analyze-logs' keeps its progress and the events found so far, relative to the server directory.
+LOG_ANALYSIS_PATH = ".log-analysis.json"
+
+LOG_LINE = re.compile(r"\[(\d\d):(\d\d):(\d\d)\] \[[^\]]*/\w+\]: (.*)")
+LOG_EVENTS = [
+    (
+        "lag",
+        re.compile(r"Can't keep up! Is the server overloaded\? Running (?P<ms>\d+)ms or (?P<ticks>\d+) ticks behind"),
+    ),
+    ("stall", re.compile(r"The server has not responded for (?P<seconds>\d+) seconds")),
+    (
+        "crash",
+        re.compile(
+            r"The server has stopped responding!"
+            r"|This crash report has been saved to"
+            r"|Encountered an unexpected exception"
+        ),
+    ),
+    ("start", re.compile(r"Done \((?P<seconds>[\d.,]+)s\)! For help")),
+    ("stop", re.compile(r"Stopping server$|Stopping the server$")),
+    ("save-off", re.compile(r"Automatic saving is now disabled")),
+    ("save-on", re.compile(r"Automatic saving is now enabled")),
+    ("join", re.compile(r"^\w+ joined the game")),
+    ("leave", re.compile(r"^\w+ left the game")),
+]
+
+
+def log_files(server_name):
+    """
+    List a server's logs from oldest to newest.
+
+    Args:
+        server_name (str): The name of the server.
+
+    Returns:
+        The paths of the rotated logs followed by 'latest.log'.
+    """
+
+    logs_directory = os.path.join(server_name, "logs")
+    if not os.path.isdir(logs_directory):
+        return []
+    rotated = []
+    for file in os.listdir(logs_directory):
+        match = re.fullmatch(r"(\d{4}-\d\d-\d\d)-(\d+)\.log\.gz", file)
+        if match:
+            rotated.append(((match.group(1), int(match.group(2))), os.path.join(logs_directory, file)))
+    paths = [path for _, path in sorted(rotated)]
+    if os.path.isfile(os.path.join(logs_directory, "latest.log")):
+        paths.append(os.path.join(logs_directory, "latest.log"))
+    return paths
+
+
+def log_start_date(path):
+    """
+    Work out the date a log starts on. Log lines only have a time, so the date comes from the name of rotated logs
+    and from the modification time of 'latest.log', less the number of times the clock passed midnight.
+
+    Args:
+        path (str): The log.
+
+    Returns:
+        The date as a 'datetime.date'.
+    """
+
+    match = re.match(r"(\d{4}-\d\d-\d\d)-\d+\.log\.gz$", os.path.basename(path))
+    if match:
+        return datetime.strptime(match.group(1), "%Y-%m-%d").date()
+    midnights = 0
+    previous = None
+    with open(path, "rb") as f:
+        for line in f:
+            match = LOG_LINE.match(line.decode(errors="replace"))
+            if match:
+                clock = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + int(match.group(3))
+                if previous is not None and clock + 43200 < previous:
+                    midnights += 1
+                previous = clock
+    return datetime.fromtimestamp(os.path.getmtime(path)).date() - timedelta(days=midnights)
+
+
+def analyze_log(f, position, state):
+    """
+    Read log lines from a position onwards and record the events they contain.
+
+    Args:
+        f (file): The log, opened in binary mode.
+        position (dict): Where to start reading, with the byte 'offset', the 'date' and the time of day in seconds
+            ('clock') of the last line read. Updated as lines are read.
+        state (dict): The analysis state, with the 'events' found so far, the number of 'players' online and whether
+            the server is 'running'.
+    """
+
+    f.seek(position["offset"])
+    date = datetime.strptime(position["date"], "%Y-%m-%d").date()
+    for line in f:
+        # A line without a newline is still being written. It is read again next time.
+        if not line.endswith(b"\n"):
+            break
+        position["offset"] += len(line)
+        match = LOG_LINE.match(re.sub(r"\x1b\[[0-9;]*m", "", line.decode(errors="replace")))
+        if not match:
+            continue
+        clock = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + int(match.group(3))
+        if position["clock"] is not None and clock + 43200 < position["clock"]:
+            date += timedelta(days=1)
+        position["clock"] = clock
+        position["date"] = date.isoformat()
+
+        message = match.group(4).strip()
+        for event_type, pattern in LOG_EVENTS:
+            event_match = pattern.search(message)
+            if event_match:
+                break
+        else:
+            continue
+
+        if event_type == "join":
+            state["players"] += 1
+            continue
+        if event_type == "leave":
+            state["players"] = max(state["players"] - 1, 0)
+            continue
+
+        events = state["events"]
+        event = {"time": f"{date.isoformat()}T{match.group(1)}:{match.group(2)}:{match.group(3)}", "type": event_type}
+        if event_type == "lag":
+            event.update(ms=int(event_match.group("ms")), ticks=int(event_match.group("ticks")))
+            event["players"] = state["players"]
+        elif event_type == "stall":
+            # The watchdog repeats its warning while the server is stuck, so count that as one stall.
+            if events and events[-1]["type"] == "stall" and int(event_match.group("seconds")) > events[-1]["seconds"]:
+                events[-1]["seconds"] = int(event_match.group("seconds"))
+                continue
+            event["seconds"] = int(event_match.group("seconds"))
+        elif event_type == "start":
+            state["players"] = 0
+            if state["running"]:
+                # The server started again without stopping, so it must have died.
+                events.append({"time": event["time"], "type": "crash", "detail": "no clean shutdown before start"})
+            state["running"] = True
+            event["seconds"] = float(event_match.group("seconds").replace(",", "."))
+        elif event_type in ["stop", "crash"]:
+            state["running"] = False
+            state["players"] = 0
+        events.append(event)
+
+
+def analyze_logs(server_name):
+    """
+    Find lag, watchdog stalls, crashes, restarts and saving pauses in a server's logs.
+
+    Only the parts of the logs that weren't read by an earlier run are read. Logs are matched by their first
+    kilobyte rather than their name, so 'latest.log' isn't read again after it is rotated into a '.log.gz'.
+
+    Args:
+        server_name (str): The name of the server.
+
+    Returns:
+        The events found in every run so far, oldest first.
+    """
+
+    state_path = os.path.join(server_name, LOG_ANALYSIS_PATH)
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {"logs": {}, "finished": {}, "events": [], "players": 0, "running": False}
+
+    for path in log_files(server_name):
+        name = os.path.basename(path)
+        rotated = name.endswith(".gz")
+        # Rotated logs don't change, so they only need to be read once.
+        if rotated and state["finished"].get(name) == os.path.getsize(path):
+            continue
+
+        with (gzip.open if rotated else open)(path, "rb") as f:
+            head = f.read(1024)
+            # Wait until 'latest.log' is long enough to tell apart from other logs.
+            if not rotated and len(head) < 1024:
+                continue
+            fingerprint = hashlib.sha1(head).hexdigest()
+            position = state["logs"].get(fingerprint) or {
+                "offset": 0,
+                "date": log_start_date(path).isoformat(),
+                "clock": None,
+            }
+            analyze_log(f, position, state)
+        state["logs"][fingerprint] = position
+
+        if rotated:
+            state["finished"][name] = os.path.getsize(path)
+            del state["logs"][fingerprint]
+
+    temp_path = f"{state_path}.part"
+    with open(temp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(temp_path, state_path)
+    return state["events"]
+
+
+def print_log_report(events):
+    """
+    Print a timeline of log events followed by a summary.
+
+    Args:
+        events (list): The events returned by 'analyze_logs()'.
+    """
+
+    descriptions = {
+        "lag": lambda event: f"{event['ms']} ms / {event['ticks']} ticks behind with {event['players']} player(s)",
+        "stall": lambda event: f"watchdog: no response for {event['seconds']} seconds",
+        "crash": lambda event: event.get("detail", "crashed"),
+        "start": lambda event: f"started in {event['seconds']:g} seconds",
+        "stop": lambda event: "stopped",
+        "save-off": lambda event: "saving paused (backup started)",
+        "save-on": lambda event: "saving resumed (backup finished)",
+    }
+    rows = [["TIME", "EVENT", "DETAIL"]]
+    for event in events:
+        rows.append([event["time"].replace("T", " "), event["type"], descriptions[event["type"]](event)])
+    if len(rows) > 1:
+        print_table(rows)
+        print()
+
+    lag = [event for event in events if event["type"] == "lag"]
+    # Lag while saving was paused for a backup.
+    saving_paused = False
+    lag_during_backups = 0
+    for event in events:
+        if event["type"] in ["save-off", "save-on"]:
+            saving_paused = event["type"] == "save-off"
+        elif event["type"] == "lag" and saving_paused:
+            lag_during_backups += 1
+    print(f"Lag events: {len(lag)} ({lag_during_backups} during backups)")
+    print(f"Ticks skipped: {sum(event['ticks'] for event in lag)}")
+    print(f"Time behind: {sum(event['ms'] for event in lag) / 1000:.1f} s")
+    if lag:
+        print(f"Average players during lag: {sum(event['players'] for event in lag) / len(lag):.1f}")
+    for event_type, label in [("stall", "Watchdog stalls"), ("crash", "Crashes"), ("start", "Starts")]:
+        print(f"{label}: {sum(1 for event in events if event['type'] == event_type)}")
+
+
+# Every backup is recorded in the catalog when it is made, so listing, verifying and pruning backups doesn't depend
+# on scanning the backup directory and parsing file names.
+BACKUP_CATALOG_PATH = os.path.join("backup", ".catalog.json")
+
+
+def load_catalog(server_name):
+    """
+    Load the catalog of a server's backups.
+
+    Backups made before there was a catalog are added from the backup directory, without the details only known
+    when a backup is made. Their checksums are recorded the first time they are verified.
+
+    Args:
+        server_name (str): The name of the server.
+
+    Returns:
+        A dictionary of catalog entries keyed by the archive's file name or the snapshot's name.
+    """
+
+    try:
+        with open(os.path.join(server_name, BACKUP_CATALOG_PATH)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    catalog = {}
+    backup_directory = os.path.join(server_name, "backup")
+    if os.path.isdir(backup_directory):
+        for entry in os.scandir(backup_directory):
+            if entry.is_file() and not entry.name.startswith(".") and not entry.name.endswith(".part"):
+                file_stat = entry.stat()
+                catalog[entry.name] = {"type": "archive", "created": file_stat.st_mtime, "size": file_stat.st_size}
+    repository = os.path.join(backup_directory, "repository")
+    for snapshot in list_snapshots(repository):
+        file_stat = os.stat(os.path.join(repository, "snapshots", f"{snapshot}.json"))
+        catalog[snapshot] = {"type": "incremental", "created": file_stat.st_mtime, "size": file_stat.st_size}
+    return catalog
+
+
+def save_catalog(server_name, catalog):
+    """
+    Save the catalog of a server's backups.
+
+    Args:
+        server_name (str): The name of the server.
+        catalog (dict): The catalog returned by 'load_catalog()'.
+    """
+
+    path = os.path.join(server_name, BACKUP_CATALOG_PATH)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.part", "w") as f:
+        json.dump(catalog, f, indent=4)
+    os.replace(f"{path}.part", path)
+
+
+def world_saves_stats(server_path, world_saves):
+    """
+    Count the files in world saves and add up their sizes.
+
+    Args:
+        server_path (str): The path to the server directory.
+        world_saves (list): The world save directories relative to the server directory.
+
+    Returns:
+        A tuple of the number of files and their total size in bytes.
+    """
+
+    files = size = 0
+    for world_save in world_saves:
+        for root, directories, names in os.walk(os.path.join(server_path, world_save)):
+            for name in names:
+                files += 1
+                size += os.path.getsize(os.path.join(root, name))
+    return files, size
+
+
+@contextmanager
+def repository_lock(repository):
+    """
+    Lock an incremental backup repository, so pruning never deletes chunks a running backup is about to reuse.
+
+    Args:
+        repository (str): The path to the backup repository.
+
+    Raises:
+        RuntimeError: If another process holds the lock.
+    """
+
+    path = os.path.join(repository, ".lock")
+    os.makedirs(repository, exist_ok=True)
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                with open(path) as f:
+                    pid = int(f.read().strip() or 0)
+            except (OSError, ValueError):
+                pid = 0
+            # Take over a lock left behind by a process that was killed.
+            if pid <= 0 or (not is_windows() and not pid_exists(pid)):
+                os.remove(path)
+                continue
+            raise RuntimeError(
+                f"'{repository}' is in use by process {pid}. Delete '{path}' if that process isn't a backup."
+            )
+    os.write(fd, str(os.getpid()).encode())
+    os.close(fd)
+    try:
+        yield
+    finally:
+        os.remove(path)
+
+
+def pid_exists(pid):
+    """
+    Check whether a process exists.
+
+    Args:
+        pid (int): The PID of the process.
+
+    Returns:
+        True if the process exists.
+    """
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user.
+        pass
+    return True
+
+
+def backup_server(server_name, args):
+    """
+    Back up the world saves of a server into its 'backup' directory.
+
+    Args:
+        server_name (str): The name of the server.
+        args (Namespace): The parsed command line arguments with the backup options.
+
+    Returns:
+        The name of the new backup in the catalog.
+
+    Raises:
+        RuntimeError: If the world saves are missing or a live snapshot could not be taken.
+    """
+
+    world_saves = [
+        args.world_name,
+        f"{args.world_name}_nether",
+        f"{args.world_name}_the_end",
+    ]
+    # Make sure the world save directories exist.
+    for directory in world_saves:
+        if not os.path.exists(os.path.join(server_name, directory)):
+            raise RuntimeError(f"Could not find a world save at '{directory}' in '{server_name}'.")
+
+    current_date = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    backup_directory = os.path.join(server_name, "backup")
+    os.makedirs(backup_directory, exist_ok=True)
+
+    started = time.monotonic()
+    waited = read_throttle.waited() if read_throttle else 0.0
+    tps_monitor = None
+    if read_throttle and args.min_tps and (
+        rcon_reachable(server_name) or (is_linux() and session_running(f"mc-{server_name}"))
+    ):
+        tps_monitor = read_throttle.adapt_to_tps(lambda: read_tps(server_name), args.min_tps)
+
+    # Back up from a snapshot taken while saving is paused so the server can keep running.
+    source_path = server_name
+    if is_linux() and args.live:
+        source_path = os.path.join(backup_directory, f".snapshot-{current_date}")
+        reflink = reflinks_supported(server_name, backup_directory)
+        if not reflink:
+            print(
+                f"The filesystem of '{server_name}' can't reflink files, so saving stays paused while the worlds "
+                f"({format_size(world_saves_stats(server_name, world_saves)[1])}) are copied for the live backup."
+            )
+        try:
+            with tracer.span("live snapshot", reflink=reflink), saving_paused(server_name):
+                snapshot_world_saves(server_name, world_saves, source_path, reflink)
+        except (OSError, subprocess.CalledProcessError) as e:
+            if os.path.exists(source_path):
+                shutil.rmtree(source_path)
+            if tps_monitor:
+                tps_monitor.set()
+            raise RuntimeError(f"Could not take a live snapshot of '{server_name}': {e}")
+
+    try:
+        with tracer.span("world stats") as span:
+            files, world_size = world_saves_stats(source_path, world_saves)
+            span.update(files=files, bytes=world_size)
+        if args.incremental:
+            repository = os.path.join(backup_directory, "repository")
+            with tracer.span("incremental") as span, repository_lock(repository):
+                stats = backup_incremental(source_path, world_saves, repository, current_date)
+                span.update(bytes_read=stats["bytes_read"], bytes_written=stats["bytes_written"])
+            print(
+                f"Created backup '{current_date}' of '{server_name}': read {stats['files_read']} of {stats['files']} "
+                f"files ({stats['bytes_read'] / 1024 ** 2:.1f} MiB) and stored {stats['chunks_written']} new chunks "
+                f"({stats['bytes_written'] / 1024 ** 2:.1f} MiB)."
+            )
+            backup_name = current_date
+            backup_path = os.path.join(repository, "snapshots", f"{current_date}.json")
+            # An incremental backup's size is the new data it stored.
+            size = stats["bytes_written"] + os.path.getsize(backup_path)
+        else:
+            backup_name = f"{current_date}.{compression_file_extensions[args.compression]}"
+            backup_path = os.path.join(backup_directory, backup_name)
+            with tracer.span("archive", compression=args.compression, jobs=args.jobs) as span:
+                create_archive(source_path, world_saves, backup_path, args.compression, args.jobs)
+                size = os.path.getsize(backup_path)
+                span["bytes_written"] = size
+
+        with tracer.span("catalog"):
+            catalog = load_catalog(server_name)
+            catalog[backup_name] = {
+                "type": "incremental" if args.incremental else "archive",
+                "created": time.time(),
+                "size": size,
+                "sha256": updater.file_sha256(backup_path),
+                "files": files,
+                "world_size": world_size,
+            }
+            save_catalog(server_name, catalog)
+        return backup_name
+    finally:
+        if source_path != server_name:
+            shutil.rmtree(source_path)
+        if tps_monitor:
+            tps_monitor.set()
+        if read_throttle:
+            throttled = read_throttle.waited() - waited
+            elapsed = max(time.monotonic() - started, 1e-9)
+            print(
+                f"Throttling added {throttled:.1f}s to the {elapsed:.1f}s backup of '{server_name}' "
+                f"({throttled / elapsed * 100:.0f}% of the time)."
+            )
+
+
+def backup_fleet(servers, args):
+    """
+    Back up several servers concurrently.
+
+    At most '--parallel' backups run at once, at most '--per-disk' of them on the same disk, and starts are spread
+    '--stagger' seconds apart. The compression jobs are split between the concurrent backups.
+
+    Args:
+        servers (list): The names of the servers.
+        args (Namespace): The parsed command line arguments with the backup options.
+
+    Returns:
+        A list with a result dictionary for every server, in the order they were given.
+    """
+
+    parallel = max(1, min(args.parallel, len(servers)))
+    server_args = Namespace(**vars(args))
+    server_args.jobs = max(1, args.jobs // parallel)
+
+    disks = {}
+    for server_name in servers:
+        disks.setdefault(os.stat(server_name).st_dev, []).append(server_name)
+    disk_slots = {disk: threading.Semaphore(args.per_disk) for disk in disks}
+    # Alternate between disks so a busy disk doesn't hold up servers waiting for a different one.
+    queue = [server_name for group in zip_longest(*disks.values()) for server_name in group if server_name]
+
+    start_lock = threading.Lock()
+    next_start = [time.monotonic()]
+
+    def run(server_name):
+        result = {"server": server_name, "backup": None, "size": 0, "duration": 0.0, "error": None}
+        with disk_slots[os.stat(server_name).st_dev]:
+            with start_lock:
+                time.sleep(max(0.0, next_start[0] - time.monotonic()))
+                next_start[0] = time.monotonic() + args.stagger
+            started = time.monotonic()
+            try:
+                with tracer.span("backup", server=server_name):
+                    result["backup"] = backup_server(server_name, server_args)
+                # The size recorded in the catalog, which for an incremental backup is the new data it stored.
+                result["size"] = load_catalog(server_name)[result["backup"]]["size"]
+            except Exception as e:
+                result["error"] = str(e)
+            result["duration"] = time.monotonic() - started
+        return result
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        results = {result["server"]: result for result in executor.map(run, queue)}
+    return [results[server_name] for server_name in servers]
+
+
+def print_backup_report(results):
+    """
+    Print a summary table of a fleet backup.
+
+    Args:
+        results (list): The results returned by 'backup_fleet()'.
+    """
+
+    rows = [["SERVER", "RESULT", "DURATION", "SIZE"]]
+    for result in results:
+        rows.append(
+            [
+                result["server"],
+                f"failed: {result['error']}" if result["error"] else result["backup"],
+                f"{result['duration']:.1f}s",
+                format_size(result["size"]) if not result["error"] else "-",
+            ]
+        )
+    print_table(rows)
+
+    failed = sum(1 for result in results if result["error"])
+    print(f"\n{len(results) - failed} of {len(results)} backups succeeded.")
+
+
+def verify_archive(path, entry):
+    """
+    Check that an archive is unchanged since it was made and that every file in it can be read.
+
+    Args:
+        path (str): The path to the archive.
+        entry (dict): The archive's catalog entry.
+
+    Returns:
+        A dictionary with the archive's 'sha256', the number of 'files' in it (None if unknown) and an 'error'
+        describing what is wrong with it, or None if it is intact.
+    """
+
+    result = {"sha256": updater.file_sha256(path), "files": None, "error": None}
+    if entry.get("sha256") and result["sha256"] != entry["sha256"]:
+        result["error"] = "its checksum doesn't match the one recorded when it was made"
+        return result
+
+    try:
+        if path.endswith(f".{compression_file_extensions['seekable']}"):
+            with open(path, "rb") as f:
+                index = read_seekable_index(f)
+                for file in index["files"]:
+                    for offset, length, size in file["frames"]:
+                        f.seek(offset)
+                        if len(zlib.decompress(f.read(length))) != size:
+                            raise ValueError(f"a frame of '{file['path']}' is corrupt")
+            result["files"] = len(index["files"])
+        elif path.endswith(".7z"):
+            process = subprocess.run(
+                ["7z", "t", path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True
+            )
+            if process.returncode != 0:
+                raise ValueError(process.stdout.strip().splitlines()[-1])
+            match = re.search(r"^Files: (\d+)", process.stdout, re.MULTILINE)
+            result["files"] = int(match.group(1)) if match else None
+        else:
+            # Listing a tar archive decompresses all of it, which checks every block against its checksum.
+            process = subprocess.run(
+                ["tar", "--list", "--auto-compress", "--file", path],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+            )
+            if process.returncode != 0:
+                # The first error is the decompressor's or tar's own, the rest only say that tar gave up.
+                raise ValueError(process.stderr.strip().splitlines()[0])
+            result["files"] = sum(1 for line in process.stdout.splitlines() if not line.endswith("/"))
+    except (OSError, ValueError, zlib.error) as e:
+        result["error"] = str(e)
+        return result
+
+    if entry.get("files") is not None and result["files"] not in [None, entry["files"]]:
+        result["error"] = f"it has {result['files']} files instead of {entry['files']}"
+    return result
+
+
+def verify_chunks(repository, digests):
+    """
+    Check that chunks of an incremental backup repository are intact.
+
+    Args:
+        repository (str): The path to the backup repository.
+        digests (list): The chunks to check.
+
+    Returns:
+        A dictionary of what is wrong with each damaged chunk, keyed by digest.
+    """
+
+    damaged = {}
+    for digest in digests:
+        try:
+            read_chunk(repository, digest)
+        except FileNotFoundError:
+            damaged[digest] = f"chunk {digest} is missing"
+        except (OSError, ValueError, zlib.error) as e:
+            damaged[digest] = f"chunk {digest} is corrupt: {e}"
+    return damaged
+
+
+def snapshot_chunks(manifest):
+    """
+    List the chunks a snapshot uses.
+
+    Args:
+        manifest (dict): The snapshot manifest.
+
+    Returns:
+        A set of chunk digests.
+    """
+
+    digests = set()
+    for entry in manifest["files"].values():
+        digests.update(entry.get("chunks", []))
+        digests.update(chunk[2] for chunk in entry.get("region", []))
+    return digests
+
+
+def verify_backups(servers, jobs):
+    """
+    Verify the backups of servers in parallel and record the results in their catalogs.
+
+    Backups that passed before and haven't changed since are skipped. The chunks of all incremental snapshots being
+    verified are checked once each, split between the workers.
+
+    Args:
+        servers (list): The names of the servers.
+        jobs (int): How many backups or batches of chunks to check at once.
+
+    Returns:
+        A list of dictionaries with the 'server', the 'backup', whether it was 'skipped' and the 'error' found,
+        ordered by server and then by when the backups were made.
+    """
+
+    results = []
+    catalogs = {}
+    archives = []
+    repositories = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for server_name in servers:
+            catalog = catalogs[server_name] = load_catalog(server_name)
+            repository = os.path.join(server_name, "backup", "repository")
+            snapshots = []
+            for name, entry in sorted(catalog.items(), key=lambda item: item[1]["created"]):
+                result = {"server": server_name, "backup": name, "skipped": False, "error": None}
+                results.append(result)
+                if entry["type"] == "archive":
+                    path = os.path.join(server_name, "backup", name)
+                else:
+                    path = os.path.join(repository, "snapshots", f"{name}.json")
+
+                if not os.path.isfile(path):
+                    result["error"] = "it is missing"
+                elif (
+                    entry.get("verified")
+                    and not entry.get("error")
+                    and os.stat(path).st_mtime <= entry["verified"]
+                    and (entry["type"] != "archive" or os.path.getsize(path) == entry["size"])
+                ):
+                    result["skipped"] = True
+                elif entry["type"] == "archive":
+                    archives.append((result, entry, executor.submit(verify_archive, path, entry)))
+                else:
+                    sha256 = updater.file_sha256(path)
+                    if entry.get("sha256") and sha256 != entry["sha256"]:
+                        result["error"] = "its checksum doesn't match the one recorded when it was made"
+                        continue
+                    entry["sha256"] = sha256
+                    try:
+                        manifest = load_snapshot(repository, name)
+                    except ValueError as e:
+                        result["error"] = f"its manifest can't be read: {e}"
+                        continue
+                    if entry.get("files") is None:
+                        entry["files"] = len(manifest["files"])
+                    snapshots.append((result, snapshot_chunks(manifest)))
+
+            # Split the chunks between the workers, checking the ones snapshots share only once.
+            digests = sorted(set().union(*[chunks for result, chunks in snapshots]))
+            batch_size = max(1, -(-len(digests) // jobs))
+            futures = [
+                executor.submit(verify_chunks, repository, digests[start : start + batch_size])
+                for start in range(0, len(digests), batch_size)
+            ]
+            repositories.append((snapshots, futures))
+
+        for result, entry, future in archives:
+            archive_result = future.result()
+            result["error"] = archive_result["error"]
+            if not entry.get("sha256"):
+                entry["sha256"] = archive_result["sha256"]
+            if entry.get("files") is None:
+                entry["files"] = archive_result["files"]
+        for snapshots, futures in repositories:
+            damaged = {}
+            for future in futures:
+                damaged.update(future.result())
+            for result, chunks in snapshots:
+                problems = sorted(damaged[digest] for digest in chunks if digest in damaged)
+                if len(problems) > 1:
+                    result["error"] = f"{problems[0]} (and {len(problems) - 1} more)"
+                elif problems:
+                    result["error"] = problems[0]
+
+    for result in results:
+        catalog = catalogs[result["server"]]
+        if result["error"] == "it is missing":
+            # The catalog only lists backups that exist, so a missing one is reported once and then forgotten.
+            del catalog[result["backup"]]
+        elif not result["skipped"]:
+            catalog[result["backup"]].update(verified=time.time(), error=result["error"])
+    for server_name, catalog in catalogs.items():
+        save_catalog(server_name, catalog)
+    return results
+
+
+def print_verify_report(results):
+    """
+    Print a table of the backups that were verified.
+
+    Args:
+        results (list): The results returned by 'verify_backups()'.
+    """
+
+    rows = [["SERVER", "BACKUP", "RESULT"]]
+    for result in results:
+        if result["error"]:
+            status = f"failed: {result['error']}"
+        else:
+            status = "intact (verified before)" if result["skipped"] else "intact"
+        rows.append([result["server"], result["backup"], status])
+    print_table(rows)
+
+    failed = sum(1 for result in results if result["error"])
+    print(f"\n{len(results) - failed} of {len(results)} backups are intact.")
+
+
+def backups_to_keep(catalog, keep_hourly, keep_daily, keep_weekly):
+    """
+    Choose the backups a retention policy keeps.
+
+    The newest backup is always kept, as is the newest backup of each of the last N hours, days and weeks that have
+    backups. Backups that failed verification don't count towards these.
+
+    Args:
+        catalog (dict): The catalog returned by 'load_catalog()'.
+        keep_hourly (int): How many hours to keep a backup for.
+        keep_daily (int): How many days to keep a backup for.
+        keep_weekly (int): How many weeks to keep a backup for.
+
+    Returns:
+        A set of the names of the backups to keep.
+    """
+
+    intact = sorted(
+        (name for name, entry in catalog.items() if not entry.get("error")),
+        key=lambda name: catalog[name]["created"],
+        reverse=True,
+    )
+    # Never leave a server without a backup that might be intact.
+    if not intact:
+        return set(catalog)
+
+    keep = {intact[0]}
+    periods = [
+        (keep_hourly, lambda time: (time.date(), time.hour)),
+        (keep_daily, lambda time: time.date()),
+        (keep_weekly, lambda time: time.isocalendar()[:2]),
+    ]
+    for count, period in periods:
+        seen = set()
+        for name in intact:
+            current = period(datetime.fromtimestamp(catalog[name]["created"]))
+            if current in seen:
+                continue
+            if len(seen) == count:
+                break
+            seen.add(current)
+            keep.add(name)
+    return keep
+
+
+def unreferenced_chunks(repository, snapshots):
+    """
+    Find the chunks of an incremental backup repository that none of the given snapshots use.
+
+    Args:
+        repository (str): The path to the backup repository.
+        snapshots (list): The names of the snapshots to keep.
+
+    Returns:
+        A list of the paths of the unused chunks, including ones left behind by interrupted backups.
+    """
+
+    referenced = set()
+    for snapshot in snapshots:
+        referenced |= snapshot_chunks(load_snapshot(repository, snapshot))
+    paths = []
+    for root, directories, files in os.walk(os.path.join(repository, "chunks")):
+        paths += [os.path.join(root, file) for file in files if file not in referenced]
+    return paths
+
+
+def prune_backups(server_name, keep_hourly, keep_daily, keep_weekly, dry_run):
+    """
+    Delete the backups of a server that a retention policy doesn't keep.
+
+    Args:
+        server_name (str): The name of the server.
+        keep_hourly (int): How many hours to keep a backup for.
+        keep_daily (int): How many days to keep a backup for.
+        keep_weekly (int): How many weeks to keep a backup for.
+        dry_run (bool): Only work out what would be deleted.
+
+    Returns:
+        A dictionary with the names of the backups 'deleted' and 'kept', oldest first, and the bytes 'freed'.
+
+    Raises:
+        RuntimeError: If an incremental backup of the server is running.
+    """
+
+    catalog = load_catalog(server_name)
+    keep = backups_to_keep(catalog, keep_hourly, keep_daily, keep_weekly)
+    by_age = sorted(catalog, key=lambda name: catalog[name]["created"])
+    result = {
+        "deleted": [name for name in by_age if name not in keep],
+        "kept": [name for name in by_age if name in keep],
+        "freed": 0,
+    }
+
+    backup_directory = os.path.join(server_name, "backup")
+    for name in result["deleted"]:
+        if catalog[name]["type"] == "archive":
+            path = os.path.join(backup_directory, name)
+            if os.path.exists(path):
+                result["freed"] += os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+
+    snapshots = [name for name in result["deleted"] if catalog[name]["type"] == "incremental"]
+    repository = os.path.join(backup_directory, "repository")
+    if snapshots:
+        with repository_lock(repository):
+            remaining = [snapshot for snapshot in list_snapshots(repository) if snapshot not in snapshots]
+            for snapshot in snapshots:
+                path = os.path.join(repository, "snapshots", f"{snapshot}.json")
+                if os.path.exists(path):
+                    result["freed"] += os.path.getsize(path)
+                    if not dry_run:
+                        os.remove(path)
+            for path in unreferenced_chunks(repository, remaining):
+                result["freed"] += os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+
+    if not dry_run:
+        for name in result["deleted"]:
+            del catalog[name]
+        save_catalog(server_name, catalog)
+    return result
+
+
+# Replication targets reached over ssh start their agent with this Python.
+REPLICATION_PYTHON = "python3"
+# Every message is a JSON header and a binary payload, each preceded by its length.
+REPLICATION_HEADER = struct.Struct(">II")
+# The signature of a block is its Adler-32 checksum, which can be rolled along a file a byte at a time, and a
+# BLAKE2b digest to confirm a match.
+REPLICATION_BLOCK = struct.Struct(">I16s")
+ADLER32_MODULUS = 65521
+# An interrupted transfer resumes after the last piece of this size that arrived intact.
+REPLICATION_CHECKPOINT = 4 * 1024 * 1024
+REPLICATION_READ_SIZE = 4 * 1024 * 1024
+# Data that isn't in the previous backup is sent in messages of at most this size.
+REPLICATION_LITERAL_SIZE = 1024 * 1024
+# Stop looking for matching blocks after this much data without any. Past a change, 7z and tar archives compress
+# everything differently, and rolling the checksum through the rest would only slow the transfer down.
+REPLICATION_GIVE_UP_SIZE = 64 * 1024 * 1024
+
+# The receiving end of a replication. It runs at the target with 'python -c' so nothing has to be installed there,
+# and writes everything under the directory given as its only argument.
+REPLICATION_AGENT = r'''
+import hashlib
+import json
+import os
+import struct
+import sys
+import zlib
+
+HEADER = struct.Struct(">II")
+BLOCK = struct.Struct(">I16s")
+root = os.path.expanduser(sys.argv[1])
+stdin = sys.stdin.buffer
+stdout = sys.stdout.buffer
+errors = []
+
+
+def receive():
+    header = stdin.read(HEADER.size)
+    if len(header) < HEADER.size:
+        sys.exit()
+    message_length, payload_length = HEADER.unpack(header)
+    message = json.loads(stdin.read(message_length).decode())
+    return message, stdin.read(payload_length)
+
+
+def send(message, payload=b""):
+    data = json.dumps(message).encode()
+    stdout.write(HEADER.pack(len(data), len(payload)) + data + payload)
+    stdout.flush()
+
+
+def local_path(path):
+    parts = path.split("/")
+    if any(part in ["", ".", ".."] for part in parts):
+        raise ValueError("Invalid path '%s'." % path)
+    return os.path.join(root, *parts)
+
+
+def file_sha256(path):
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(4 * 1024 * 1024), b""):
+            checksum.update(data)
+    return checksum.hexdigest()
+
+
+def list_files(message, payload):
+    os.makedirs(root, exist_ok=True)
+    top = local_path(message["path"])
+    files = {}
+    for directory, _, names in os.walk(top):
+        for name in names:
+            path = os.path.join(directory, name)
+            files[os.path.relpath(path, top).replace(os.sep, "/")] = os.path.getsize(path)
+    return {"files": files}, b""
+
+
+def signature(message, payload):
+    block_size = message["block_size"]
+    blocks = []
+    with open(local_path(message["path"]), "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            # The last block is left out so every block has the size the sender rolls its checksum over.
+            if len(block) == block_size:
+                blocks.append(BLOCK.pack(zlib.adler32(block), hashlib.blake2b(block, digest_size=16).digest()))
+    return {"blocks": len(blocks)}, b"".join(blocks)
+
+
+def resume(message, payload):
+    hashes = []
+    path = local_path(message["path"]) + ".part"
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            for data in iter(lambda: f.read(message["checkpoint"]), b""):
+                if len(data) == message["checkpoint"]:
+                    hashes.append(hashlib.blake2b(data, digest_size=16).hexdigest())
+    return {"hashes": hashes}, b""
+
+
+def patch(message, payload):
+    # The operations that follow are always read to the end, so a failure doesn't leave the stream out of step.
+    error = None
+    f = basis = None
+    try:
+        path = local_path(message["path"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if message["basis"]:
+            basis = open(local_path(message["basis"]), "rb")
+        f = open(path + ".part", "r+b" if os.path.exists(path + ".part") else "wb")
+        f.truncate(message["offset"])
+        f.seek(message["offset"])
+    except (OSError, ValueError) as e:
+        error = str(e)
+
+    while True:
+        operation, data = receive()
+        if operation["op"] == "done":
+            break
+        if error:
+            continue
+        try:
+            if operation["op"] == "data":
+                f.write(data)
+            else:
+                basis.seek(operation["index"] * message["block_size"])
+                for _ in range(operation["count"]):
+                    f.write(basis.read(message["block_size"]))
+        except OSError as e:
+            error = str(e)
+
+    if basis:
+        basis.close()
+    if f:
+        f.close()
+    if error:
+        return {"error": error}, b""
+    # Check the whole file, not just what was sent, so a bad basis or a corrupt resumed part is caught too.
+    if file_sha256(path + ".part") != operation["sha256"]:
+        os.remove(path + ".part")
+        return {"error": "The copy of '%s' doesn't match the original." % message["path"]}, b""
+    with open(path + ".part", "rb") as f:
+        os.fsync(f.fileno())
+    os.utime(path + ".part", ns=(operation["mtime_ns"], operation["mtime_ns"]))
+    os.replace(path + ".part", path)
+    return {}, b""
+
+
+def put(message, payload):
+    try:
+        if hashlib.sha256(payload).hexdigest() != message["sha256"]:
+            raise ValueError("'%s' was damaged in transit." % message["path"])
+        path = local_path(message["path"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(payload)
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+    except (OSError, ValueError) as e:
+        errors.append(str(e))
+
+
+def sync(message, payload):
+    # Puts aren't answered one by one, so that they can be streamed. Their errors are collected until now.
+    response = {"errors": errors[:]}
+    del errors[:]
+    return response, b""
+
+
+handlers = {"list": list_files, "signature": signature, "resume": resume, "patch": patch, "put": put, "sync": sync}
+while True:
+    message, payload = receive()
+    try:
+        response = handlers[message["op"]](message, payload)
+    except (OSError, ValueError) as e:
+        response = {"error": str(e)}, b""
+    if response:
+        send(*response)
+'''
+
+
+def split_target(target):
+    """
+    Split a replication target into a host and a path.
+
+    Args:
+        target (str): A local directory or '[user@]host:path'.
+
+    Returns:
+        A tuple of the host, or None for a local directory, and the path.
+    """
+
+    match = re.match(r"^([^/\\:]+):(.*)$", target)
+    # 'C:\backups' is a local path on Windows.
+    if not match or (is_windows() and len(match.group(1)) == 1):
+        return None, target
+    return match.group(1), match.group(2) or "."
+
+
+class ReplicationAgent:
+    """
+    A connection to a replication agent started at a target directory, locally or over ssh.
+    """
+
+    def __init__(self, target, ssh_command="ssh"):
+        host, path = split_target(target)
+        if host:
+            command = [
+                *shlex.split(ssh_command),
+                host,
+                f"{REPLICATION_PYTHON} -c {shlex.quote(REPLICATION_AGENT)} {shlex.quote(path)}",
+            ]
+        else:
+            command = [sys.executable, "-c", REPLICATION_AGENT, path]
+        try:
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except OSError as e:
+            raise RuntimeError(f"Could not start the replication agent for '{target}': {e}")
+        self.target = target
+
+    def send(self, message, payload=b""):
+        data = json.dumps(message).encode()
+        try:
+            self.process.stdin.write(REPLICATION_HEADER.pack(len(data), len(payload)) + data + payload)
+        except OSError:
+            raise RuntimeError(f"Lost the connection to '{self.target}'.")
+
+    def receive(self):
+        self.process.stdin.flush()
+        header = self.process.stdout.read(REPLICATION_HEADER.size)
+        if len(header) < REPLICATION_HEADER.size:
+            raise RuntimeError(f"Lost the connection to '{self.target}'.")
+        message_length, payload_length = REPLICATION_HEADER.unpack(header)
+        message = json.loads(self.process.stdout.read(message_length))
+        payload = self.process.stdout.read(payload_length)
+        if "error" in message:
+            raise RuntimeError(message["error"])
+        return message, payload
+
+    def request(self, message, payload=b""):
+        self.send(message, payload)
+        return self.receive()
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+        self.process.stdout.close()
+
+
+def replication_block_size(size):
+    """
+    Choose the block size for a delta against a file.
+
+    Like rsync, this uses about the square root of the file's size, which balances the size of the signature
+    against how much of a block that changed has to be sent again.
+
+    Args:
+        size (int): The size of the file the delta is against.
+
+    Returns:
+        The block size in bytes.
+    """
+
+    return max(2048, min(128 * 1024, int(math.sqrt(size)) // 8 * 8))
+
+
+def delta_operations(f, checksum, blocks, block_size):
+    """
+    Describe the rest of a file as blocks of a previous version and the data in between.
+
+    An Adler-32 checksum is rolled along the file a byte at a time and looked up among the previous version's
+    blocks, and matches are confirmed with their digest, as rsync does.
+
+    Args:
+        f (file): The file, opened in binary mode at the position to start from.
+        checksum (hash): Updated with everything read from the file.
+        blocks (list): The (Adler-32, digest) signatures of the previous version's blocks.
+        block_size (int): The size of the blocks.
+
+    Yields:
+        Tuples of ('copy', first block, number of blocks) or ('data', bytes).
+    """
+
+    def read():
+        data = f.read(REPLICATION_READ_SIZE)
+        checksum.update(data)
+        throttle_read(len(data))
+        return data
+
+    def rest(buffer):
+        for data in chain([buffer], iter(read, b"")):
+            for start in range(0, len(data), REPLICATION_LITERAL_SIZE):
+                yield "data", data[start : start + REPLICATION_LITERAL_SIZE]
+
+    if not blocks:
+        yield from rest(b"")
+        return
+
+    weak_index = {}
+    for index, (weak, strong) in enumerate(blocks):
+        weak_index.setdefault(weak, {}).setdefault(strong, index)
+
+    buffer = read()
+    eof = not buffer
+    position = literal_start = 0
+    a = b = None
+    copy = None
+    unmatched = 0
+    while True:
+        # Keep a block and the byte after it in the buffer, which rolling the checksum needs.
+        if len(buffer) - position <= block_size and not eof:
+            data = read()
+            eof = not data
+            buffer = buffer[literal_start:] + data
+            position -= literal_start
+            literal_start = 0
+            continue
+        end = position + block_size
+        if end > len(buffer):
+            break
+
+        if a is None:
+            weak = zlib.adler32(buffer[position:end])
+            a, b = weak & 0xFFFF, weak >> 16
+        # Roll the checksum forward until a block matches or there is enough unmatched data to send.
+        limit = min(len(buffer), literal_start + REPLICATION_LITERAL_SIZE + block_size)
+        index = None
+        while True:
+            matches = weak_index.get(b << 16 | a)
+            if matches:
+                index = matches.get(hashlib.blake2b(buffer[position:end], digest_size=16).digest())
+                if index is not None:
+                    break
+            if end >= limit:
+                break
+            removed = buffer[position]
+            a = (a - removed + buffer[end]) % ADLER32_MODULUS
+            b = (b - block_size * removed + a - 1) % ADLER32_MODULUS
+            position += 1
+            end += 1
+
+        if index is None:
+            if position - literal_start >= REPLICATION_LITERAL_SIZE:
+                if copy:
+                    yield copy
+                    copy = None
+                yield "data", buffer[literal_start:position]
+                unmatched += position - literal_start
+                literal_start = position
+                if unmatched >= REPLICATION_GIVE_UP_SIZE:
+                    yield from rest(buffer[literal_start:])
+                    return
+            elif eof and end == len(buffer):
+                break
+            continue
+
+        if position > literal_start:
+            if copy:
+                yield copy
+                copy = None
+            yield "data", buffer[literal_start:position]
+        if copy and copy[1] + copy[2] == index:
+            copy = ("copy", copy[1], copy[2] + 1)
+        else:
+            if copy:
+                yield copy
+            copy = ("copy", index, 1)
+        position = literal_start = end
+        a = None
+        unmatched = 0
+
+    if copy:
+        yield copy
+    yield from rest(buffer[literal_start:])
+
+
+def replicate_file(agent, path, remote_path, basis, basis_size, resume):
+    """
+    Send a file to a replication target as a delta against a file already there.
+
+    Args:
+        agent (ReplicationAgent): The connection to the target.
+        path (str): The file to send.
+        remote_path (str): Where to put it at the target.
+        basis (str): The file at the target to send a delta against, or None to send the whole file.
+        basis_size (int): The size of the basis.
+        resume (bool): Whether the target has part of the file from an interrupted transfer.
+
+    Returns:
+        The number of bytes of file data sent.
+
+    Raises:
+        RuntimeError: If the transfer failed or the copy doesn't match the file.
+    """
+
+    checksum = hashlib.sha256()
+    offset = 0
+    with open(path, "rb") as f:
+        if resume:
+            response, _ = agent.request({"op": "resume", "path": remote_path, "checkpoint": REPLICATION_CHECKPOINT})
+            for expected in response["hashes"]:
+                data = f.read(REPLICATION_CHECKPOINT)
+                if len(data) < REPLICATION_CHECKPOINT or hashlib.blake2b(data, digest_size=16).hexdigest() != expected:
+                    break
+                checksum.update(data)
+                offset += len(data)
+            f.seek(offset)
+
+        blocks = []
+        block_size = replication_block_size(basis_size) if basis else 0
+        if basis:
+            _, signature = agent.request({"op": "signature", "path": basis, "block_size": block_size})
+            blocks = list(REPLICATION_BLOCK.iter_unpack(signature))
+
+        agent.send({"op": "patch", "path": remote_path, "basis": basis, "block_size": block_size, "offset": offset})
+        sent = 0
+        for operation in delta_operations(f, checksum, blocks, block_size):
+            if operation[0] == "data":
+                agent.send({"op": "data"}, operation[1])
+                sent += len(operation[1])
+            else:
+                agent.send({"op": "copy", "index": operation[1], "count": operation[2]})
+        agent.request({"op": "done", "sha256": checksum.hexdigest(), "mtime_ns": os.stat(path).st_mtime_ns})
+    return sent
+
+
+def replicate_backups(agent, server_name):
+    """
+    Copy a server's backups that a replication target doesn't have yet.
+
+    Archives are sent oldest first, each as a delta against the newest older archive of the same type at the
+    target. Incremental repositories only need the chunks and snapshots the target is missing.
+
+    Args:
+        agent (ReplicationAgent): The connection to the target.
+        server_name (str): The name of the server.
+
+    Returns:
+        A dictionary with the number of 'files' replicated, their total 'size' and the bytes actually 'sent'.
+
+    Raises:
+        RuntimeError: If a backup could not be replicated.
+    """
+
+    backup_directory = os.path.join(server_name, "backup")
+    prefix = os.path.basename(os.path.abspath(server_name))
+    remote_files = agent.request({"op": "list", "path": prefix})[0]["files"]
+    stats = {"files": 0, "size": 0, "sent": 0}
+    if not os.path.isdir(backup_directory):
+        return stats
+
+    archives = sorted(
+        file
+        for file in os.listdir(backup_directory)
+        if os.path.isfile(os.path.join(backup_directory, file))
+        and not file.startswith(".")
+        and not file.endswith(".part")
+    )
+    for archive in archives:
+        path = os.path.join(backup_directory, archive)
+        size = os.path.getsize(path)
+        if remote_files.get(archive) == size:
+            continue
+
+        extension = archive.split(".", 1)[-1]
+        older = [file for file in remote_files if "/" not in file and file < archive and file.endswith(f".{extension}")]
+        basis = max(older) if older else None
+        with tracer.span("replicate archive", archive=archive, basis=basis, bytes=size) as span:
+            span["bytes_sent"] = replicate_file(
+                agent,
+                path,
+                f"{prefix}/{archive}",
+                f"{prefix}/{basis}" if basis else None,
+                remote_files.get(basis, 0),
+                f"{archive}.part" in remote_files,
+            )
+        stats["sent"] += span["bytes_sent"]
+        remote_files[archive] = size
+        stats["files"] += 1
+        stats["size"] += size
+
+    repository = os.path.join(backup_directory, "repository")
+    # Snapshots go after the chunks they refer to, so the target never has a snapshot it can't restore.
+    for directory in ["chunks", "snapshots"]:
+        for root, directories, files in os.walk(os.path.join(repository, directory)):
+            for file in files:
+                path = os.path.join(root, file)
+                relative_path = os.path.relpath(path, backup_directory).replace(os.sep, "/")
+                if file.endswith(".tmp") or relative_path in remote_files:
+                    continue
+                with open(path, "rb") as f:
+                    data = f.read()
+                throttle_read(len(data))
+                agent.send(
+                    {"op": "put", "path": f"{prefix}/{relative_path}", "sha256": hashlib.sha256(data).hexdigest()},
+                    data,
+                )
+                stats["files"] += 1
+                stats["size"] += len(data)
+                stats["sent"] += len(data)
+        errors = agent.request({"op": "sync"})[0]["errors"]
+        if errors:
+            raise RuntimeError(errors[0])
+    return stats
+
+
+def replicate_servers(servers, target, ssh_command):
+    """
+    Replicate the backups of servers to a target and print what was sent.
+
+    Args:
+        servers (list): The names of the servers.
+        target (str): A local directory or '[user@]host:path'.
+        ssh_command (str): The command used to reach targets over ssh.
+
+    Returns:
+        True if the backups of every server were replicated.
+    """
+
+    try:
+        agent = ReplicationAgent(target, ssh_command)
+    except RuntimeError as e:
+        print(e)
+        return False
+
+    succeeded = True
+    try:
+        for server_name in servers:
+            try:
+                with tracer.span("replicate", server=server_name) as span:
+                    stats = replicate_backups(agent, server_name)
+                    span.update(bytes=stats["size"], bytes_sent=stats["sent"])
+            except RuntimeError as e:
+                print(f"Could not replicate the backups of '{server_name}' to '{target}': {e}")
+                succeeded = False
+                continue
+            if not stats["files"]:
+                print(f"The backups of '{server_name}' are already replicated to '{target}'.")
+                continue
+            print(
+                f"Replicated the backups of '{server_name}' to '{target}': sent {format_size(stats['sent'])} "
+                f"for {format_size(stats['size'])} of new backups."
+            )
+    finally:
+        agent.close()
+    return succeeded
+
+
+# How often the metrics exporter asks servers for their state. HTTP requests in between get the cached values.
+METRICS_INTERVAL = 15
+# Walking the world saves is much slower than asking for the TPS, so disk sizes are refreshed less often.
+DISK_METRICS_INTERVAL = 300
+
+METRICS_HELP = {
+    "minecraft_up": ("gauge", "Whether the server process is running."),
+    "minecraft_rcon_up": ("gauge", "Whether the server answered over RCON."),
+    "minecraft_tps": ("gauge", "Ticks per second averaged over the window."),
+    "minecraft_mspt_seconds": ("gauge", "Average time taken per tick over the window."),
+    "minecraft_players_online": ("gauge", "Players currently online."),
+    "minecraft_players_max": ("gauge", "Maximum number of players."),
+    "minecraft_process_resident_memory_bytes": ("gauge", "Resident memory of the server's Java process."),
+    "minecraft_process_cpu_seconds_total": ("counter", "CPU time used by the server's Java process."),
+    "minecraft_process_start_time_seconds": ("gauge", "Start time of the server's Java process since the epoch."),
+    "minecraft_world_size_bytes": ("gauge", "Size of the world saves."),
+    "minecraft_backup_size_bytes": ("gauge", "Size of the backup directory."),
+    "minecraft_last_backup_timestamp_seconds": ("gauge", "Time of the newest backup since the epoch."),
+    "minecraft_scrape_duration_seconds": ("gauge", "Time taken to collect the server's metrics."),
+}
+
+
+def boot_time():
+    """
+    Get when the system booted.
+
+    Returns:
+        The boot time in seconds since the epoch.
+    """
+
+    with open("/proc/stat") as f:
+        for line in f:
+            if line.startswith("btime "):
+                return int(line.split()[1])
+    return 0
+
+
+def strip_colors(output):
+    """
+    Remove ANSI and Minecraft formatting codes from command output.
+
+    Args:
+        output (str): The command output.
+
+    Returns:
+        The output as plain text.
+    """
+
+    return re.sub(r"\x1b\[[0-9;]*m|\u00a7.", "", output)
+
+
+def game_metrics(server_name):
+    """
+    Ask a server for its TPS, tick times and player count over RCON.
+
+    Args:
+        server_name (str): The name of the server.
+
+    Returns:
+        A list of (metric, labels, value) samples. Empty if the server didn't answer.
+    """
+
+    samples = []
+    try:
+        tps = strip_colors(rcon_command(server_name, "tps"))
+        mspt = strip_colors(rcon_command(server_name, "mspt"))
+        players = strip_colors(rcon_command(server_name, "list"))
+    except OSError:
+        return samples
+
+    match = re.search(r"TPS from last 1m, 5m, 15m: \*?([\d.]+), \*?([\d.]+), \*?([\d.]+)", tps)
+    if match:
+        for window, value in zip(["1m", "5m", "15m"], match.groups()):
+            samples.append(("minecraft_tps", {"window": window}, float(value)))
+    # Paper prints 'avg/min/max' for the last 5s, 10s and 1m.
+    averages = re.findall(r"([\d.]+)/[\d.]+/[\d.]+", mspt)
+    for window, value in zip(["5s", "10s", "1m"], averages):
+        samples.append(("minecraft_mspt_seconds", {"window": window}, round(float(value) / 1000, 6)))
+    match = re.search(r"There are (\d+) of a max of (\d+) players online", players)
+    if match:
+        samples.append(("minecraft_players_online", {}, int(match.group(1))))
+        samples.append(("minecraft_players_max", {}, int(match.group(2))))
+    return samples
+
+
+def process_metrics(pid, processes):
+    """
+    Read the memory and CPU use of a server's Java process from '/proc'.
+
+    Args:
+        pid (int): The PID of the Java process.
+        processes (dict): The processes returned by 'process_table()'.
+
+    Returns:
+        A list of (metric, labels, value) samples.
+    """
+
+    ticks_per_second = os.sysconf("SC_CLK_TCK")
+    samples = [
+        ("minecraft_process_cpu_seconds_total", {}, processes[pid]["cpu_ticks"] / ticks_per_second),
+        ("minecraft_process_start_time_seconds", {}, boot_time() + processes[pid]["start_ticks"] / ticks_per_second),
+    ]
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    samples.append(("minecraft_process_resident_memory_bytes", {}, int(line.split()[1]) * 1024))
+    except OSError:
+        pass
+    return samples
+
+
+def disk_metrics(server_name, world_name):
+    """
+    Measure the size of a server's world saves and backups.
+
+    Args:
+        server_name (str): The name of the server.
+        world_name (str): The name of the server's world.
+
+    Returns:
+        A list of (metric, labels, value) samples.
+    """
+
+    world_bytes = sum(
+        directory_size(os.path.join(server_name, world_save))
+        for world_save in [world_name, f"{world_name}_nether", f"{world_name}_the_end"]
+    )
+    samples = [
+        ("minecraft_world_size_bytes", {}, world_bytes),
+        ("minecraft_backup_size_bytes", {}, directory_size(os.path.join(server_name, "backup"))),
+    ]
+    backed_up = last_backup_time(server_name)
+    if backed_up:
+        samples.append(("minecraft_last_backup_timestamp_seconds", {}, backed_up))
+    return samples
+
+
+class MetricsExporter:
+    """
+    Collects metrics from servers in the background and renders them in the Prometheus text format.
+    """
+
+    def __init__(self, servers, world_name, interval=METRICS_INTERVAL):
+        self.servers = servers
+        self.world_name = world_name
+        self.interval = interval
+        self.page = b""
+        self.disk_samples = {}
+        self.disk_checked = 0
+        self.lock = threading.Lock()
+
+    def scrape_server(self, server_name, sessions, processes):
+        start = time.monotonic()
+        session = sessions.get(f"mc-{server_name}")
+        supervisor = None if session else supervisor_status(server_name)
+        parent_pid = session["pane_pid"] if session else supervisor["pid"] if supervisor else None
+        pid = find_server_process(parent_pid, processes) if parent_pid else None
+        samples = [("minecraft_up", {}, 1 if pid else 0)]
+        if pid:
+            samples += process_metrics(pid, processes)
+        if pid and rcon_enabled(server_name):
+            game_samples = game_metrics(server_name)
+            samples.append(("minecraft_rcon_up", {}, 1 if game_samples else 0))
+            samples += game_samples
+        samples += self.disk_samples.get(server_name, [])
+        samples.append(("minecraft_scrape_duration_seconds", {}, time.monotonic() - start))
+        return samples
+
+    def scrape(self):
+        """
+        Collect the metrics of every server in parallel and update the cached page.
+        """
+
+        if time.monotonic() - self.disk_checked >= DISK_METRICS_INTERVAL:
+            self.disk_checked = time.monotonic()
+            with ThreadPoolExecutor() as executor:
+                self.disk_samples = dict(
+                    zip(
+                        self.servers,
+                        executor.map(lambda server_name: disk_metrics(server_name, self.world_name), self.servers),
+                    )
+                )
+
+        sessions = tmux_sessions()
+        processes = process_table()
+        with ThreadPoolExecutor() as executor:
+            results = list(
+                executor.map(lambda server_name: self.scrape_server(server_name, sessions, processes), self.servers)
+            )
+
+        # Group the samples by metric, as the text format expects.
+        metrics = {}
+        for server_name, samples in zip(self.servers, results):
+            for metric, labels, value in samples:
+                metrics.setdefault(metric, []).append((dict(server=server_name, **labels), value))
+        lines = []
+        for metric, samples in metrics.items():
+            metric_type, description = METRICS_HELP[metric]
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            for labels, value in samples:
+                # JSON string escaping matches the escaping the text format expects for label values.
+                label_text = ",".join(
+                    f"{key}={json.dumps(label, ensure_ascii=False)}" for key, label in labels.items()
+                )
+                lines.append(f"{metric}{{{label_text}}} {value}")
+        with self.lock:
+            self.page = ("\n".join(lines) + "\n").encode()
+
+    def run(self):
+        """
+        Scrape the servers every interval until the process exits.
+        """
+
+        while True:
+            start = time.monotonic()
+            try:
+                self.scrape()
+            except Exception as e:
+                print(f"Collecting metrics failed: {e}", file=sys.stderr)
+            time.sleep(max(0, self.interval - (time.monotonic() - start)))
+
+    def serve(self, address):
+        """
+        Serve the cached metrics over HTTP at '/metrics'.
+
+        Args:
+            address (str): The address to listen on as 'host:port' or ':port'.
+        """
+
+        host, _, port = address.rpartition(":")
+        exporter = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ["/", "/metrics"]:
+                    self.send_error(404)
+                    return
+                with exporter.lock:
+                    page = exporter.page
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, format, *args):
+                pass
+
+        # 'http.server.ThreadingHTTPServer' is only available from Python 3.7.
+        class MetricsServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        # Collect once up front so the first request already has data.
+        self.scrape()
+        threading.Thread(target=self.run, daemon=True).start()
+        server = MetricsServer((host.strip("[]"), int(port)), MetricsHandler)
+        print(f"Serving metrics for {len(self.servers)} server(s) on http://{address}/metrics")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main():
+    parser = ArgumentParser(description="Setup or backup a Minecraft server.")
+
+    parser.add_argument(
+        "server_name",
+        nargs="*",
+        help="The name of the Minecraft server to create or perform the action on. "
+        "Several servers can be given to create, back up, show the status of or serve metrics for at once.",
+    )
+    parser.add_argument(
+        "-a", "--all", action="store_true", help="Perform the action on every server in the current directory"
+    )
+
+    parser.add_argument("-y", action="store_true", help="Answer yes to all prompts")
+    parser.add_argument(
+        "--download",
+        action="store_true",
+        help="Download the server JAR while creating a server, so its first start doesn't have to. "
+        "Requires '-n' or '--new'.",
+    )
+    if is_linux():
+        parser.add_argument(
+            "-s", "--session", action="store_true", help="Continue or start a Minecraft server's console session"
+        )
+
+    server_options = parser.add_mutually_exclusive_group()
+    server_options.add_argument(
+        "-n", "--new", action="store_true", help="Create a new server. Several servers can be created at once."
+    )
+    server_options.add_argument("-b", "--backup", action="store_true", help="Backup an existing server")
+    server_options.add_argument("-d", "--delete", action="store_true", help="Delete an existing server")
+    server_options.add_argument(
+        "-c",
+        "--cmd",
+        metavar="COMMAND",
+        help="Run a command on a running server over RCON, or through its supervisor, and print its output",
+    )
+    if not is_windows():
+        server_options.add_argument(
+            "--supervise",
+            action="store_true",
+            help="Run a server in the foreground, restart it when it crashes and serve its console on a Unix socket "
+            f"at '{SUPERVISOR_SOCKET}' in the server directory. Stop it with Ctrl+C, SIGTERM or a 'stop' request.",
+        )
+        server_options.add_argument(
+            "--attach", action="store_true", help="Show the console of a server running under '--supervise'"
+        )
+    server_options.add_argument(
+        "-r",
+        "--restore",
+        metavar="BACKUP",
+        help="Replace the worlds of an existing server with a backup. "
+        "BACKUP is an incremental backup's name or an archive in the server's 'backup' directory.",
+    )
+    server_options.add_argument(
+        "--prune",
+        action="store_true",
+        help="Delete chunks of a stopped server's worlds that players spent less than '--min-inhabited' seconds in "
+        "and compact the region files. Use '--dry-run' to see how much space it would reclaim.",
+    )
+    server_options.add_argument(
+        "--scan",
+        action="store_true",
+        help="Check the sector tables and chunks of a server's region files and show how much space is unused. "
+        f"Files that haven't changed since the last scan are skipped, using the results kept in '{REGION_SCAN_PATH}'.",
+    )
+    server_options.add_argument(
+        "--analyze-logs",
+        action="store_true",
+        help="Show a timeline of lag, watchdog stalls, crashes, restarts and backups from a server's logs. "
+        f"Only log lines added since the last run are read. Progress is kept in '{LOG_ANALYSIS_PATH}'.",
+    )
+    server_options.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check that the backups of servers are unchanged and can be read, several at a time (see '-j'). "
+        f"Results are kept in the catalog at '{BACKUP_CATALOG_PATH}' and backups that passed before are skipped. "
+        "Checks every server in the current directory if no server is given.",
+    )
+    server_options.add_argument(
+        "--prune-backups",
+        action="store_true",
+        help="Delete the backups of servers that '--keep-hourly', '--keep-daily' and '--keep-weekly' don't keep. "
+        "The newest backup is always kept and backups that failed '--verify' don't count. "
+        "Use '--dry-run' to see what would be deleted.",
+    )
+
+    parser.add_argument(
+        "--status",
+        action="store_true",
+        help="Show whether servers are running, their memory and CPU use, uptime, version, world size and last backup. "
+        "Shows every server in the current directory if no server is given.",
+    )
+    parser.add_argument("--json", action="store_true", help="Print '--status', '--scan' or '--analyze-logs' as JSON")
+    parser.add_argument(
+        "--serve-metrics",
+        metavar="ADDRESS",
+        help="Serve Prometheus metrics for servers at 'ADDRESS/metrics', e.g. ':9225'. "
+        "Serves every server in the current directory if no server is given. TPS, tick times and players need RCON.",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=METRICS_INTERVAL,
+        help=f"Seconds between collecting metrics for '--serve-metrics'. Defaults to {METRICS_INTERVAL}.",
+    )
+    if is_linux():
+        parser.add_argument("--list-sessions", action="store_true", help="The same as '--status'")
+    parser.add_argument(
+        "--min-inhabited",
+        type=float,
+        default=60,
+        metavar="SECONDS",
+        help="Keep chunks players have spent at least this long in, added up over all players. Defaults to 60. "
+        "Requires '--prune'.",
+    )
+    parser.add_argument(
+        "--protect",
+        action="append",
+        default=[],
+        type=protected_area,
+        metavar="X,Z,RADIUS",
+        help="Keep every chunk within RADIUS blocks of X,Z, in every dimension. Can be given several times. "
+        "Requires '--prune'.",
+    )
+    parser.add_argument(
+        "--spawn-radius",
+        type=int,
+        default=512,
+        help="Keep every chunk within this many blocks of the world spawn. Defaults to 512. Requires '--prune'.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Show what '--prune' or '--prune-backups' would delete without deleting it",
+    )
+    for period, unit in [("hourly", "hours"), ("daily", "days"), ("weekly", "weeks")]:
+        parser.add_argument(
+            f"--keep-{period}",
+            type=int,
+            default=0,
+            metavar="N",
+            help=f"Keep the newest backup of each of the last N {unit} with backups. Requires '--prune-backups'.",
+        )
+    parser.add_argument(
+        "--defrag",
+        action="store_true",
+        help="Rewrite region files without their unused sectors. Files with problems are left alone. "
+        "Requires '--scan' and a stopped server.",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=compression_file_extensions.keys(),
+        default="7z",
+        help="Specify the compression type. Uses '7z' by default. Requires '-b' or '--backup' to be used.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Specify how many threads or processes compress a backup or prune or scan a world. "
+        "Defaults to the number of CPUs.",
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Store the backup in a deduplicated repository in 'backup/repository' instead of a single archive. "
+        "Only files that changed since the last backup are read and only new data is stored. Requires '-b' or '--backup'.",
+    )
+    if is_linux():
+        parser.add_argument(
+            "--live",
+            action="store_true",
+            help="Back up a running server safely. Saving is paused only while the worlds are flushed and snapshotted, "
+            "and the backup is made from the snapshot. The snapshot is near-instant on filesystems that can reflink "
+            "files (Btrfs, XFS), and a full copy otherwise. Requires '-b' or '--backup'.",
+        )
+    parser.add_argument(
+        "--bwlimit",
+        type=float,
+        help="Limit how fast backups read world files and '--replicate' reads backups, in MiB/s. "
+        "'--compression 7z' can only be limited on Linux.",
+    )
+    parser.add_argument(
+        "--min-tps",
+        type=float,
+        help="Slow reads down further while a running server's TPS is below this. Requires '--bwlimit'.",
+    )
+    if not is_windows():
+        parser.add_argument("--nice", type=int, help="Increase the CPU niceness of backups by this much")
+    if is_linux():
+        parser.add_argument(
+            "--ionice",
+            choices=["idle", "best-effort"],
+            help="Lower the disk priority of backups. 'idle' only reads when no other process needs the disk.",
+        )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=2,
+        help="Specify how many servers are backed up at the same time when backing up several servers. Default is 2.",
+    )
+    parser.add_argument(
+        "--per-disk",
+        type=int,
+        default=1,
+        help="Specify how many of those backups may run on the same disk at the same time. Default is 1.",
+    )
+    parser.add_argument(
+        "--stagger",
+        type=float,
+        default=0,
+        help="Specify how many seconds to wait between starting backups of several servers. Default is 0.",
+    )
+    parser.add_argument(
+        "--replicate",
+        metavar="TARGET",
+        help="Copy the backups TARGET doesn't have yet to it, after backing up if used with '-b'. TARGET is a "
+        "directory or '[user@]host:path' reached over ssh, which needs python3 there. Archives are sent as the "
+        "differences from the previous archive at TARGET, which works best with '--compression seekable'. "
+        "Interrupted transfers resume where they stopped and every copy is checked against its original.",
+    )
+    parser.add_argument(
+        "--ssh-command",
+        default="ssh",
+        help="Specify the command '--replicate' uses to reach a host, e.g. 'ssh -p 2222'. Default is 'ssh'.",
+    )
+    parser.add_argument(
+        "--path",
+        action="append",
+        help="Only restore this file or directory, e.g. 'world/region/r.0.0.mca'. Can be given more than once. "
+        "Seekable ('--compression seekable') and incremental backups only read the data needed for it. "
+        "Requires '-r' or '--restore'.",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print how long each phase took and the CPU, disk and memory it used, "
+        f"and add the run to '{updater.TIMINGS_HISTORY_PATH}' in the current directory",
+    )
+    parser.add_argument(
+        "--trace-json",
+        metavar="PATH",
+        help="Save the phases as a trace for chrome://tracing or https://ui.perfetto.dev, "
+        f"and add the run to '{updater.TIMINGS_HISTORY_PATH}' in the current directory",
+    )
+    parser.add_argument(
+        "--world-name",
+        default="world",
+        help="Specify the world name as is in server.properties. Only needs to be set if the world save name is not the default.",
+    )
+
+    args = parser.parse_args()
+
+    # Print usage example if no arguments are passed.
+    if len(sys.argv) == 1:
+        parser.print_usage()
+        print("run with '-h' to get help")
+        sys.exit()
+
+    if args.timings or args.trace_json:
+        tracer.enabled = True
+        # Also records runs that end in 'sys.exit()'.
+        atexit.register(tracer.finish, sys.argv, args.timings, args.trace_json and os.path.abspath(args.trace_json))
+
+    # Server names should not end with slashes.
+    servers = find_servers() if args.all else [server_name.rstrip("/\\") for server_name in args.server_name]
+    # '--replicate' runs on its own or after a backup.
+    other_action = any(
+        getattr(args, action, False)
+        for action in [
+            "new",
+            "delete",
+            "cmd",
+            "supervise",
+            "attach",
+            "restore",
+            "prune",
+            "scan",
+            "analyze_logs",
+            "verify",
+            "prune_backups",
+        ]
+    )
+    if args.replicate and other_action:
+        parser.error("'--replicate' can only be used on its own or with '-b' or '--backup'")
+    if len(servers) > 1 and not (
+        args.new
+        or args.backup
+        or args.replicate
+        or args.verify
+        or args.prune_backups
+        or args.status
+        or args.serve_metrics
+        or (is_linux() and args.list_sessions)
+    ):
+        parser.error(
+            "only '-n', '--new', '-b', '--backup', '--replicate', '--verify', '--prune-backups', '--status' and "
+            "'--serve-metrics' can be used with more than one server"
+        )
+    args.server_name = servers[0] if servers else None
+
+    if args.status or (is_linux() and args.list_sessions):
+        servers = servers or find_servers()
+        for server_name in servers:
+            if not os.path.isdir(server_name):
+                print(f"A server with the name '{server_name}' does not exist.")
+                sys.exit(1)
+
+        # Look up the sessions and processes once and share them between the servers.
+        sessions = tmux_sessions()
+        processes = process_table()
+        with tracer.span("status", servers=len(servers)), ThreadPoolExecutor() as executor:
+            statuses = list(
+                executor.map(
+                    lambda server_name: server_status(server_name, args.world_name, sessions, processes), servers
+                )
+            )
+
+        if args.json:
+            print(json.dumps(statuses, indent=4))
+        elif statuses:
+            print_status(statuses)
+        else:
+            print("No servers found.")
+
+        sys.exit()
+
+    if args.serve_metrics:
+        servers = servers or find_servers()
+        if not servers:
+            print("No servers found.")
+            sys.exit(1)
+        for server_name in servers:
+            if not os.path.isdir(server_name):
+                print(f"A server with the name '{server_name}' does not exist.")
+                sys.exit(1)
+
+        MetricsExporter(servers, args.world_name, args.metrics_interval).serve(args.serve_metrics)
+        sys.exit()
+
+    if args.new:
+        # Check if the servers given exist.
+        for server_name in servers:
+            if os.path.exists(server_name):
+                print(f"A server with the name '{server_name}' already exists.")
+                sys.exit(1)
+
+        # Create the server directories and add the custom scripts.
+        for server_name in servers:
+            os.makedirs(server_name, exist_ok=True)
+            try:
+                with tracer.span("new", server=server_name):
+                    add_scripts(server_name, args.download)
+            except RuntimeError as e:
+                print(e)
+                # Don't leave a half set up server behind.
+                shutil.rmtree(server_name)
+                sys.exit(1)
+
+    elif args.backup:
+        # Check if the servers given exist.
+        with tracer.span("check servers", servers=len(servers)):
+            for server_name in servers:
+                if not os.path.exists(server_name):
+                    print(f"A server with the name '{server_name}' does not exist.")
+                    print("Please check the spelling and try again.")
+                    sys.exit(1)
+
+        if args.min_tps and not args.bwlimit:
+            parser.error("'--min-tps' requires '--bwlimit'")
+        if args.bwlimit:
+            limit_reads(args.bwlimit * 1024**2)
+            if args.compression == "7z" and not args.incremental and not is_linux():
+                print("'--bwlimit' can only slow down 7z on Linux. The backup reads will not be limited.")
+        if not is_windows():
+            lower_priority(args.nice, getattr(args, "ionice", None))
+
+        if len(servers) > 1:
+            results = backup_fleet(servers, args)
+            print_backup_report(results)
+            backed_up = [result["server"] for result in results if not result["error"]]
+        else:
+            try:
+                with tracer.span("backup", server=args.server_name):
+                    backup_server(args.server_name, args)
+            except RuntimeError as e:
+                print(e)
+                sys.exit(1)
+            backed_up = servers
+
+        # Replicate the servers that were backed up even if others failed.
+        if args.replicate and backed_up and not replicate_servers(backed_up, args.replicate, args.ssh_command):
+            sys.exit(1)
+        if len(backed_up) < len(servers):
+            sys.exit(1)
+
+    elif args.replicate:
+        servers = servers or find_servers()
+        if not servers:
+            print("No servers found.")
+            sys.exit(1)
+        for server_name in servers:
+            if not os.path.isdir(server_name):
+                print(f"A server with the name '{server_name}' does not exist.")
+                print("Please check the spelling and try again.")
+                sys.exit(1)
+
+        if args.bwlimit:
+            limit_reads(args.bwlimit * 1024**2)
+        if not replicate_servers(servers, args.replicate, args.ssh_command):
+            sys.exit(1)
+
+    elif args.verify:
+        servers = servers or find_servers()
+        if not servers:
+            print("No servers found.")
+            sys.exit(1)
+        for server_name in servers:
+            if not os.path.isdir(server_name):
+                print(f"A server with the name '{server_name}' does not exist.")
+                print("Please check the spelling and try again.")
+                sys.exit(1)
+
+        with tracer.span("verify", servers=len(servers), jobs=args.jobs):
+            results = verify_backups(servers, args.jobs)
+        print_verify_report(results)
+        if any(result["error"] for result in results):
+            sys.exit(1)
+
+    elif args.prune_backups:
+        servers = servers or find_servers()
+        if not servers:
+            print("No servers found.")
+            sys.exit(1)
+        for server_name in servers:
+            if not os.path.isdir(server_name):
+                print(f"A server with the name '{server_name}' does not exist.")
+                print("Please check the spelling and try again.")
+                sys.exit(1)
+
+        if not (args.keep_hourly or args.keep_daily or args.keep_weekly):
+            parser.error("'--prune-backups' requires '--keep-hourly', '--keep-daily' or '--keep-weekly'")
+        if not args.dry_run:
+            try:
+                prune_confirmation = args.y or input(
+                    f"Backups of {', '.join(repr(server_name) for server_name in servers)} that the retention policy "
+                    "doesn't keep will be deleted. Continue? (y/N): "
+                )
+            except KeyboardInterrupt:
+                sys.exit()
+            if not args.y and prune_confirmation.lower() not in ["y", "yes"]:
+                sys.exit()
+
+        failed = False
+        for server_name in servers:
+            try:
+                with tracer.span("prune backups", server=server_name) as span:
+                    result = prune_backups(
+                        server_name, args.keep_hourly, args.keep_daily, args.keep_weekly, args.dry_run
+                    )
+                    span["bytes_freed"] = result["freed"]
+            except RuntimeError as e:
+                print(e)
+                failed = True
+                continue
+            print(
+                f"{'Would delete' if args.dry_run else 'Deleted'} {len(result['deleted'])} backups of '{server_name}' "
+                f"and {'keep' if args.dry_run else 'kept'} {len(result['kept'])}, "
+                f"freeing {format_size(result['freed'])}."
+            )
+            if args.dry_run:
+                for name in result["deleted"]:
+                    print(f"    {name}")
+        if failed:
+            sys.exit(1)
+
+    elif args.cmd:
+        # Check if the server given exists.
+        if not os.path.exists(args.server_name):
+            print(f"A server with the name '{args.server_name}' does not exist.")
+            print("Please check the spelling and try again.")
+            sys.exit(1)
+
+        supervised = not rcon_enabled(args.server_name) and supervisor_status(args.server_name)
+        if not rcon_enabled(args.server_name) and not supervised:
+            print(f"RCON is not enabled for '{args.server_name}' and it isn't supervised.")
+            print("Set 'enable-rcon=true' and 'rcon.password' in its server.properties and restart it.")
+            sys.exit(1)
+        try:
+            if supervised:
+                # The console has no end of output marker, so show what the server prints in the next second.
+                print(supervisor_command(args.server_name, args.cmd.lstrip("/")), end="")
+            else:
+                print(rcon_command(args.server_name, args.cmd.lstrip("/")))
+        except OSError as e:
+            print(f"Could not run the command on '{args.server_name}': {e}")
+            sys.exit(1)
+
+    elif not is_windows() and (args.supervise or args.attach):
+        # Check if the server given exists.
+        if not os.path.exists(os.path.join(args.server_name, "start.py")):
+            print(f"A server with the name '{args.server_name}' does not exist.")
+            print("Please check the spelling and try again.")
+            sys.exit(1)
+
+        if args.attach:
+            if not supervisor_status(args.server_name):
+                print(f"'{args.server_name}' isn't running under '--supervise'.")
+                sys.exit(1)
+            attach_supervisor(args.server_name)
+            sys.exit()
+
+        socket_path = os.path.join(args.server_name, SUPERVISOR_SOCKET)
+        if supervisor_status(args.server_name):
+            print(f"'{args.server_name}' is already supervised. Use '--attach' to see its console.")
+            sys.exit(1)
+        if os.path.exists(socket_path):
+            # Left behind by a supervisor that was killed.
+            os.remove(socket_path)
+        supervisor = Supervisor(args.server_name)
+        if sys.version_info >= (3, 7):
+            asyncio.run(supervisor.run())
+        else:
+            # 'asyncio.run()' was added in Python 3.7.
+            asyncio.get_event_loop().run_until_complete(supervisor.run())
+        sys.exit()
+
+    elif args.analyze_logs:
+        # Check if the server given exists.
+        if not os.path.exists(args.server_name):
+            print(f"A server with the name '{args.server_name}' does not exist.")
+            print("Please check the spelling and try again.")
+            sys.exit(1)
+
+        with tracer.span("analyze logs", server=args.server_name):
+            events = analyze_logs(args.server_name)
+        if args.json:
+            print(json.dumps(events, indent=4))
+        else:
+            print_log_report(events)
+
+    elif args.prune:
+        # Check if the server given exists.
+        if not os.path.exists(args.server_name):
+            print(f"A server with the name '{args.server_name}' does not exist.")
+            print("Please check the spelling and try again.")
+            sys.exit(1)
+
+        if not args.dry_run:
+            # The server keeps region files open and would write the pruned chunks back.
+            if supervisor_status(args.server_name) or (
+                is_linux() and shutil.which("tmux") and session_running(f"mc-{args.server_name}")
+            ):
+                print(f"Stop '{args.server_name}' before pruning its worlds.")
+                sys.exit(1)
+            try:
+                prune_confirmation = args.y or input(
+                    f"Chunks of '{args.server_name}' that were visited for less than {args.min_inhabited:g} seconds "
+                    "will be deleted. Make sure there is a backup. Continue? (y/N): "
+                )
+            except KeyboardInterrupt:
+                sys.exit()
+            if not args.y and prune_confirmation.lower() not in ["y", "yes"]:
+                sys.exit()
+
+        with tracer.span("prune", server=args.server_name, jobs=args.jobs):
+            results = prune_world(
+                args.server_name,
+                args.world_name,
+                int(args.min_inhabited * 20),
+                args.protect,
+                args.spawn_radius,
+                args.dry_run,
+                args.jobs,
+            )
+        print_prune_report(results, args.dry_run)
+
+    elif args.scan:
+        # Check if the server given exists.
+        if not os.path.exists(args.server_name):
+            print(f"A server with the name '{args.server_name}' does not exist.")
+            print("Please check the spelling and try again.")
+            sys.exit(1)
+
+        # The server moves chunks around in region files it has open.
+        if args.defrag and (
+            supervisor_status(args.server_name)
+            or (is_linux() and shutil.which("tmux") and session_running(f"mc-{args.server_name}"))
+        ):
+            print(f"Stop '{args.server_name}' before defragmenting its region files.")
+            sys.exit(1)
+
+        with tracer.span("scan", server=args.server_name, jobs=args.jobs):
+            results = scan_world(args.server_name, args.world_name, args.defrag, args.jobs)
+        if args.json:
+            print(json.dumps(results, indent=4))
+        else:
+            print_scan_report(results)
+        if any(result["problems"] for result in results.values()):
+            sys.exit(1)
+
+    elif args.restore:
+        # Check if the server given exists.
+        if not os.path.exists(args.server_name):
+            print(f"A server with the name '{args.server_name}' does not exist.")
+            print("Please check the spelling and try again.")
+            sys.exit(1)
+
+        # The server would keep running on the worlds being replaced and save over them.
+        if supervisor_status(args.server_name) or (
+            is_linux() and shutil.which("tmux") and session_running(f"mc-{args.server_name}")
+        ):
+            print(f"Stop '{args.server_name}' before restoring a backup.")
+            sys.exit(1)
+
+        with tracer.span("restore", server=args.server_name, backup=args.restore):
+            restore_backup(args.server_name, args.restore, args.path, args.y)
+
+    elif args.delete:
+        # Check if the server given exists.
+        if not os.path.exists(args.server_name):
+            print(f"A server with the name '{args.server_name}' does not exist.")
+            print("Please check the spelling and try again.")
+            sys.exit(1)
+
+        try:
+            delete_confirmation = input(
+                f"Are you sure you want to delete '{args.server_name}'? This will delete the server backups as well. (y/N): "
+            )
+        except KeyboardInterrupt:
+            sys.exit()
+        if not args.y and delete_confirmation.lower() not in ["y", "yes"]:
+            sys.exit()
+
+        # Delete the server directory.
+        shutil.rmtree(args.server_name)
+
+        sys.exit()
+
+    if is_linux() and args.session:
+        # The tmux id should not contain any slashes.
+        if args.server_name[-1] in ["/", "\\"]:
+            args.server_name = args.server_name[:-1]
+        tmux_id = f"mc-{args.server_name}"
+
+        # Check if the server name given exists.
+        if not os.path.exists(args.server_name):
+            print(f"A server with the name '{args.server_name}' does not exist.")
+            if args.server_name.startswith("mc-"):
+                print(f"Did you mean './server.py -s {args.server_name[3:]}'?")
+            sys.exit(1)
+
+        # Check if the server is already running.
+        if supervisor_status(args.server_name):
+            attach_supervisor(args.server_name)
+        elif session_running(tmux_id):
+            subprocess.run(["tmux", "attach", "-t", f"={tmux_id}"])
+        else:
+            os.chdir(args.server_name)
+
+            # Use systemd-run to run tmux as a user process to prevent it from being killed when the user logs out.
+            # If this is a new server, run 'loginctl enable-linger' to allow the process to stay active even if all users log off.
+            subprocess.run(["systemd-run", "--scope", "--user", "tmux", "new", "-s", tmux_id])
 
-    # Check if the server is already running.
-    tmux_sessions = subprocess.run(["tmux", "ls"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if tmux_id in tmux_sessions.stdout.decode():
-        subprocess.run(["tmux", "attach", "-t", tmux_id])
-    else:
-        os.chdir(args.server_name)
 
-        # Use systemd-run to run tmux as a user process to prevent it from being killed when the user logs out.
-        # If this is a new server, run 'loginctl enable-linger' to allow the process to stay active even if all users log off.
-        subprocess.run(["systemd-run", "--scope", "--user", "tmux", "new", "-s", tmux_id])
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+A stand-in for the PaperMC API and plugin hosts, so the generated update.py can be tested without a network.
+"""
+
+import hashlib
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+MC_VERSION = "1.21"
+BUILD = 100
+JAR_NAME = f"paper-{MC_VERSION}-{BUILD}.jar"
+
+
+class FakePaperMC:
+    """
+    Serves the PaperMC API endpoints update.py uses and plugin JARs at '/plugins/<name>' on a free local port.
+
+    JSON responses and plugins have an ETag and are answered with 304 when 'If-None-Match' matches. The JAR download
+    honours Range requests unless 'ignore_range' is set. Every request is recorded in 'requests' as a (path, headers, status) tuple.
+    """
+
+    def __init__(self, jar=None, delay=0):
+        self.jar = jar if jar is not None else bytes(range(256)) * 4099
+        self.plugins = {}
+        # Seconds every response is held back, so concurrent requests overlap.
+        self.delay = delay
+        self.ignore_range = False
+        self.requests = []
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        self.sockets = []
+        self.lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with fake.lock:
+                    fake.connections += 1
+                    fake.sockets.append(self.request)
+
+            def do_GET(self):
+                fake.respond(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # Clients dropping their connections is expected.
+                pass
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.api_url = f"{self.url}/v2/projects/paper"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def stop(self):
+        """
+        Stop listening and drop the kept-alive connections, as if the host went offline.
+        """
+
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            for connection in self.sockets:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def requests_for(self, path):
+        """
+        Get the recorded requests for a path.
+
+        Args:
+            path (str): The path, like '/v2/projects/paper'.
+
+        Returns:
+            A list of (path, headers, status) tuples.
+        """
+
+        return [request for request in self.requests if request[0] == path]
+
+    def route(self, path, headers):
+        """
+        Build the response to a request.
+
+        Args:
+            path (str): The requested path.
+            headers (Message): The request headers.
+
+        Returns:
+            A tuple of the status, the response headers and the body.
+        """
+
+        api = "/v2/projects/paper"
+        builds = f"{api}/versions/{MC_VERSION}/builds"
+        documents = {
+            api: {"versions": ["1.20.4", MC_VERSION]},
+            builds: {"builds": [{"build": BUILD - 1}, {"build": BUILD}]},
+            f"{builds}/{BUILD}": {
+                "downloads": {"application": {"name": JAR_NAME, "sha256": hashlib.sha256(self.jar).hexdigest()}}
+            },
+        }
+        if path in documents:
+            return self.cacheable(json.dumps(documents[path]).encode(), headers)
+        if path == f"{builds}/{BUILD}/downloads/{JAR_NAME}":
+            start = 0
+            if headers.get("Range") and not self.ignore_range:
+                start = int(headers["Range"].split("=")[1].split("-")[0])
+            if start >= len(self.jar) > 0:
+                return 416, {}, b""
+            return (206 if start else 200), {}, self.jar[start:]
+        if path.startswith("/plugins/") and path[len("/plugins/") :] in self.plugins:
+            return self.cacheable(self.plugins[path[len("/plugins/") :]], headers)
+        return 404, {}, b""
+
+    def cacheable(self, body, headers):
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        return 200, {"ETag": etag}, body
+
+    def respond(self, handler):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            status, headers, body = self.route(handler.path, handler.headers)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+        # Recorded before answering, so the client can't see the response before the request is recorded.
+        with self.lock:
+            self.requests.append((handler.path, dict(handler.headers), status))
+        handler.send_response(status)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
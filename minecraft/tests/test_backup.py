@@ -0,0 +1,686 @@
+"""
+Tests for reading region files and for backing up and restoring worlds.
+
+Run from the repository root with 'python -m unittest discover minecraft/tests'.
+"""
+
+import bz2
+import contextlib
+import gzip
+import io
+import lzma
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+from argparse import Namespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server  # noqa: E402
+import worlds  # noqa: E402
+
+
+@contextlib.contextmanager
+def silence_stderr():
+    """
+    Send what this process and the programs it starts write to stderr to /dev/null.
+    """
+
+    saved = os.dup(2)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 2)
+    try:
+        yield
+    finally:
+        os.dup2(saved, 2)
+        os.close(saved)
+
+
+class BackupTestCase(unittest.TestCase):
+    """
+    Creates a server directory with a world in a temporary directory.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="mc-backup-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.server_path = os.path.join(self.directory, "survival")
+        self.world_saves = worlds.make_world(self.server_path)
+        self.region_path = os.path.join(self.server_path, "world", "region", "r.0.0.mca")
+
+    def read_regions(self, server_path):
+        """
+        Read every chunk of every region file under a server directory.
+
+        Returns:
+            (timestamp, record) tuples keyed by (region path, chunk index).
+        """
+
+        chunks = {}
+        for root, _, files in os.walk(server_path):
+            for file in files:
+                if not file.endswith(".mca"):
+                    continue
+                with open(os.path.join(root, file), "rb") as f:
+                    for index, (offset, sector_count, timestamp) in enumerate(server.read_region_header(f)):
+                        if offset:
+                            record = server.read_region_chunk(f, offset, sector_count)
+                            chunks[os.path.relpath(os.path.join(root, file), server_path), index] = (timestamp, record)
+        return chunks
+
+
+class RegionTest(BackupTestCase):
+    def test_header_and_chunks(self):
+        chunks = worlds.region_chunks(0, 0, {0: 5, 33: 6, 1023: 7}, timestamp=1234)
+        worlds.write_region_file(self.region_path, chunks, gap=2)
+
+        with open(self.region_path, "rb") as f:
+            header = server.read_region_header(f)
+            self.assertEqual(len(header), 1024)
+            self.assertEqual([index for index, location in enumerate(header) if location[0]], [0, 33, 1023])
+            for index, (timestamp, record) in chunks.items():
+                offset, sector_count, chunk_timestamp = header[index]
+                self.assertEqual(chunk_timestamp, timestamp)
+                self.assertEqual(server.read_region_chunk(f, offset, sector_count), record)
+
+    def test_write_region_packs_chunks(self):
+        chunks = worlds.region_chunks(0, 0, {3: 1, 700: 2}, filler=1000)
+        gapped_path = os.path.join(self.directory, "gapped", "r.0.0.mca")
+        worlds.write_region_file(gapped_path, chunks, gap=3)
+        packed_path = os.path.join(self.directory, "packed", "r.0.0.mca")
+        os.makedirs(os.path.dirname(packed_path))
+
+        server.write_region(packed_path, chunks)
+
+        self.assertEqual(
+            self.read_regions(os.path.dirname(packed_path)), self.read_regions(os.path.dirname(gapped_path))
+        )
+        self.assertLess(os.path.getsize(packed_path), os.path.getsize(gapped_path))
+
+    def test_invalid_chunks(self):
+        record = worlds.chunk_record(worlds.chunk_nbt(0, 0, 0))
+        f = io.BytesIO(bytes(2 * worlds.SECTOR_SIZE) + record + bytes(-len(record) % worlds.SECTOR_SIZE))
+
+        with self.assertRaises(ValueError):
+            server.read_region_chunk(f, 3, 1)
+        with self.assertRaises(ValueError):
+            server.read_region_chunk(f, 1, 1)
+        with self.assertRaises(ValueError):
+            server.read_region_chunk(io.BytesIO(f.getvalue()[: 2 * worlds.SECTOR_SIZE + 10]), 2, 1)
+        with self.assertRaises(ValueError):
+            server.read_region_chunk(io.BytesIO(bytes(2 * worlds.SECTOR_SIZE) + struct.pack(">I", 5000)), 2, 1)
+        with self.assertRaises(ValueError):
+            server.read_region_header(io.BytesIO(bytes(100)))
+
+    def test_read_nbt_numbers(self):
+        paths = [("InhabitedTime",), ("xPos",), ("Level", "InhabitedTime"), ("Heightmaps", "WORLD_SURFACE")]
+
+        self.assertEqual(
+            server.read_nbt_numbers(worlds.chunk_nbt(-3, 4, 1200), paths), {("InhabitedTime",): 1200, ("xPos",): -3}
+        )
+        self.assertEqual(
+            server.read_nbt_numbers(worlds.chunk_nbt(0, 0, 77, legacy=True), paths), {("Level", "InhabitedTime"): 77}
+        )
+
+    def test_invalid_nbt(self):
+        data = worlds.chunk_nbt(0, 0, 1200)
+
+        with self.assertRaises(ValueError):
+            server.read_nbt_numbers(data[:-20], [("InhabitedTime",)])
+        with self.assertRaises(ValueError):
+            server.read_nbt_numbers(data[1:], [("InhabitedTime",)])
+        with self.assertRaises(ValueError):
+            server.read_nbt_numbers(b"", [("InhabitedTime",)])
+
+    def test_decompress_chunk(self):
+        data = worlds.chunk_nbt(0, 0, 0)
+
+        for compression in [1, 2, 3]:
+            self.assertEqual(server.decompress_chunk(worlds.chunk_record(data, compression)), data)
+        self.assertIsNone(server.decompress_chunk(struct.pack(">I", 1) + bytes([130])))
+
+
+class IncrementalBackupTest(BackupTestCase):
+    def setUp(self):
+        super().setUp()
+        self.repository = os.path.join(self.server_path, "backup", "repository")
+
+    def backup(self, snapshot):
+        return server.backup_incremental(self.server_path, self.world_saves, self.repository, snapshot)
+
+    def restore(self, snapshot, paths=None):
+        target_path = os.path.join(self.directory, snapshot)
+        server.restore_snapshot(self.repository, snapshot, target_path, paths)
+        return target_path
+
+    def rewrite_region(self, chunks, gap=0):
+        # Make sure the file's modification time changes even on file systems with coarse timestamps.
+        mtime_ns = os.stat(self.region_path).st_mtime_ns
+        worlds.write_region_file(self.region_path, chunks, gap)
+        os.utime(self.region_path, ns=(mtime_ns + 10 ** 9, mtime_ns + 10 ** 9))
+
+    def assertSameFiles(self, first_path, second_path, directories):
+        """
+        Check that two server directories have the same files with the same contents and times in some directories.
+        """
+
+        for directory in directories:
+            for root, _, files in os.walk(os.path.join(first_path, directory)):
+                for file in files:
+                    relative_path = os.path.relpath(os.path.join(root, file), first_path)
+                    with open(os.path.join(first_path, relative_path), "rb") as f:
+                        with open(os.path.join(second_path, relative_path), "rb") as g:
+                            self.assertEqual(f.read(), g.read(), relative_path)
+                    self.assertEqual(
+                        os.stat(os.path.join(first_path, relative_path)).st_mtime_ns,
+                        os.stat(os.path.join(second_path, relative_path)).st_mtime_ns,
+                    )
+
+    def test_restore_is_identical(self):
+        self.backup("1")
+
+        target_path = self.restore("1")
+
+        for world_save in self.world_saves:
+            self.assertTrue(os.path.isdir(os.path.join(target_path, world_save)))
+        self.assertTrue(os.path.isdir(os.path.join(target_path, "world_the_end", "DIM1", "region")))
+        self.assertSameFiles(self.server_path, target_path, self.world_saves)
+        snapshot = server.load_snapshot(self.repository, "1")
+        self.assertIn("region", snapshot["files"][os.path.join("world", "region", "r.0.0.mca")])
+        self.assertIn("chunks", snapshot["files"][os.path.join("world", "level.dat")])
+
+    def test_unchanged_world_is_not_read_again(self):
+        self.backup("1")
+
+        stats = self.backup("2")
+
+        self.assertEqual(stats["files_read"], 0)
+        self.assertEqual(stats["chunks_written"], 0)
+        self.assertEqual(server.list_snapshots(self.repository), ["1", "2"])
+
+    def test_only_changed_chunks_are_read(self):
+        chunks = worlds.region_chunks(0, 0, {index: index * 100 for index in range(0, 1024, 37)}, filler=300)
+        self.backup("1")
+        chunks[37] = (chunks[37][0] + 60, worlds.chunk_record(worlds.chunk_nbt(5, 1, 99999, filler=300)))
+        self.rewrite_region(chunks)
+
+        stats = self.backup("2")
+
+        self.assertEqual(stats["files_read"], 1)
+        self.assertEqual(stats["chunks_written"], 1)
+        self.assertEqual(stats["bytes_read"], 2 * worlds.SECTOR_SIZE + len(chunks[37][1]))
+        self.assertEqual(self.read_regions(self.restore("2")), self.read_regions(self.server_path))
+
+    def test_chunk_saved_again_within_the_same_second(self):
+        chunks = worlds.region_chunks(0, 0, {0: 10, 1: 20}, timestamp=1700000000)
+        worlds.write_region_file(self.region_path, chunks)
+        self.backup("1")
+        # The server saved chunk 0 again before its timestamp moved on, so only its data, length and place differ.
+        chunks[0] = (chunks[0][0], worlds.chunk_record(worlds.chunk_nbt(0, 0, 500, filler=2000)))
+        self.rewrite_region(chunks)
+
+        stats = self.backup("2")
+
+        self.assertEqual(stats["chunks_written"], 1)
+        self.assertEqual(self.read_regions(self.restore("2")), self.read_regions(self.server_path))
+        self.assertNotEqual(self.read_regions(self.restore("1")), self.read_regions(self.server_path))
+
+    def test_moved_chunk_is_read_again(self):
+        chunks = worlds.region_chunks(0, 0, {0: 10, 1: 20})
+        worlds.write_region_file(self.region_path, chunks)
+        self.backup("1")
+        self.rewrite_region(chunks, gap=1)
+
+        stats = self.backup("2")
+
+        records_size = sum(len(record) for _, record in chunks.values())
+        self.assertEqual(stats["bytes_read"], 2 * worlds.SECTOR_SIZE + records_size)
+        self.assertEqual(stats["chunks_written"], 0)
+
+    def test_corrupt_region_is_backed_up_as_a_file(self):
+        with open(self.region_path, "wb") as f:
+            f.write(b"\x00\x00\x02\x01" + os.urandom(100))
+
+        self.backup("1")
+
+        entry = server.load_snapshot(self.repository, "1")["files"][os.path.join("world", "region", "r.0.0.mca")]
+        self.assertIn("chunks", entry)
+        self.assertSameFiles(self.server_path, self.restore("1"), self.world_saves)
+
+    def test_restore_selected_paths(self):
+        self.backup("1")
+
+        target_path = self.restore("1", [os.path.join("world", "region")])
+
+        self.assertEqual(sorted(os.listdir(target_path)), ["world"])
+        self.assertEqual(os.listdir(os.path.join(target_path, "world")), ["region"])
+        self.assertSameFiles(target_path, self.server_path, self.world_saves)
+
+
+class ArchiveTest(BackupTestCase):
+    def setUp(self):
+        super().setUp()
+        self.backup_path = os.path.join(self.directory, "backup.tar")
+
+    def assertArchived(self, archive_path):
+        target_path = os.path.join(self.directory, "extracted")
+        with tarfile.open(archive_path) as tar:
+            tar.extractall(target_path)
+        self.assertEqual(sorted(os.listdir(target_path)), sorted(self.world_saves))
+        for root, _, files in os.walk(self.server_path):
+            for file in files:
+                relative_path = os.path.relpath(os.path.join(root, file), self.server_path)
+                with open(os.path.join(root, file), "rb") as f:
+                    with open(os.path.join(target_path, relative_path), "rb") as g:
+                        self.assertEqual(f.read(), g.read(), relative_path)
+        self.assertFalse(os.path.exists(f"{archive_path}.part"))
+
+    def test_blocks_are_compressed_as_separate_streams(self):
+        data = os.urandom(5000) * 7
+        decompress = {"gzip": gzip.decompress, "bzip2": bz2.decompress, "xz": lzma.decompress}
+        for compression in ["gzip", "bzip2", "xz"]:
+            with self.subTest(compression=compression):
+                output = io.BytesIO()
+                with mock.patch.object(server, "ARCHIVE_BLOCK_SIZE", 10000):
+                    compressor = server.ParallelCompressor(output, compression, 2)
+                    for start in range(0, len(data), 3000):
+                        compressor.write(data[start : start + 3000])
+                    compressor.close()
+
+                # Every block repeats the same data, so it only compresses well when compressed in one go.
+                self.assertGreater(len(output.getvalue()), 3 * 5000)
+                self.assertEqual(decompress[compression](output.getvalue()), data)
+
+    def test_archive_compressed_in_a_process_pool(self):
+        for compression in ["gzip", "bzip2", "xz"]:
+            with self.subTest(compression=compression), mock.patch.dict(server.tar_compressors, {compression: [None]}):
+                server.create_archive(self.server_path, self.world_saves, self.backup_path, compression, 2)
+                self.assertArchived(self.backup_path)
+                shutil.rmtree(os.path.join(self.directory, "extracted"))
+
+    @unittest.skipUnless(shutil.which("gzip"), "gzip is not installed")
+    def test_archive_compressed_by_a_command(self):
+        with mock.patch.dict(server.tar_compressors, {"gzip": [["not-a-compressor"], ["gzip"], None]}):
+            self.assertEqual(server.find_tar_compressor("gzip", 2), ["gzip", "-c"])
+            server.create_archive(self.server_path, self.world_saves, self.backup_path, "gzip", 2)
+
+        self.assertArchived(self.backup_path)
+
+    def test_missing_compressor(self):
+        stdout = io.StringIO()
+        with mock.patch.dict(server.tar_compressors, {"lzop": [["not-a-compressor"]]}):
+            with self.assertRaises(SystemExit), contextlib.redirect_stdout(stdout):
+                server.find_tar_compressor("lzop", 2)
+        self.assertIn("lzop", stdout.getvalue())
+
+
+class SeekableArchiveTest(BackupTestCase):
+    def setUp(self):
+        super().setUp()
+        self.archive_path = os.path.join(self.directory, "backup.mcbk")
+        # Small frames so region files are split over several of them.
+        with mock.patch.object(server, "SEEKABLE_FRAME_SIZE", 5000):
+            server.create_seekable_archive(self.server_path, self.world_saves, self.archive_path, 2)
+        self.target_path = os.path.join(self.directory, "extracted")
+
+    def assertExtracted(self, relative_path):
+        with open(os.path.join(self.server_path, relative_path), "rb") as f:
+            with open(os.path.join(self.target_path, relative_path), "rb") as g:
+                self.assertEqual(f.read(), g.read(), relative_path)
+        self.assertEqual(
+            os.stat(os.path.join(self.server_path, relative_path)).st_mtime_ns,
+            os.stat(os.path.join(self.target_path, relative_path)).st_mtime_ns,
+        )
+
+    def test_index(self):
+        with open(self.archive_path, "rb") as f:
+            index = server.read_seekable_index(f)
+
+        self.assertEqual(index["world_saves"], self.world_saves)
+        self.assertIn("world_the_end/DIM1/region", index["directories"])
+        files = {entry["path"]: entry for entry in index["files"]}
+        self.assertEqual(len(files["world/level.dat"]["frames"]), 1)
+        region_size = os.path.getsize(self.region_path)
+        self.assertEqual(len(files["world/region/r.0.0.mca"]["frames"]), -(-region_size // 5000))
+        self.assertEqual(sum(frame[2] for frame in files["world/region/r.0.0.mca"]["frames"]), region_size)
+
+    def test_extract_everything(self):
+        server.extract_seekable_archive(self.archive_path, self.target_path)
+
+        self.assertEqual(sorted(os.listdir(self.target_path)), sorted(self.world_saves))
+        self.assertTrue(os.path.isdir(os.path.join(self.target_path, "world_the_end", "DIM1", "region")))
+        for root, _, files in os.walk(self.server_path):
+            for file in files:
+                self.assertExtracted(os.path.relpath(os.path.join(root, file), self.server_path))
+
+    def test_extract_selected_paths(self):
+        paths = [os.path.join("world", "region", "r.0.0.mca"), "world_nether"]
+
+        server.extract_seekable_archive(self.archive_path, self.target_path, paths)
+
+        self.assertEqual(sorted(os.listdir(self.target_path)), ["world", "world_nether"])
+        self.assertEqual(os.listdir(os.path.join(self.target_path, "world", "region")), ["r.0.0.mca"])
+        self.assertExtracted(paths[0])
+        self.assertExtracted(os.path.join("world_nether", "DIM-1", "region", "r.0.0.mca"))
+
+    def test_incomplete_archive(self):
+        with open(self.archive_path, "r+b") as f:
+            f.truncate(os.path.getsize(self.archive_path) - 10)
+
+        with self.assertRaises(ValueError):
+            server.extract_seekable_archive(self.archive_path, self.target_path)
+
+
+class RestoreTest(BackupTestCase):
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join(self.server_path, "backup"))
+        with open(self.region_path, "rb") as f:
+            self.region = f.read()
+        self.level_path = os.path.join(self.server_path, "world", "level.dat")
+        with open(self.level_path, "rb") as f:
+            self.level = f.read()
+
+    def damage_world(self):
+        os.remove(self.region_path)
+        with open(self.level_path, "wb") as f:
+            f.write(b"damaged")
+
+    def restore(self, backup, paths=None):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            server.restore_backup(self.server_path, backup, paths, y=True)
+        return stdout.getvalue()
+
+    def assertRestored(self, region=True, level=True):
+        for path, data, restored in [(self.region_path, self.region, region), (self.level_path, self.level, level)]:
+            current = None
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    current = f.read()
+            self.assertEqual(current == data, restored, path)
+        self.assertFalse(os.path.exists(os.path.join(self.server_path, ".restore")))
+
+    def test_restore_snapshot(self):
+        repository = os.path.join(self.server_path, "backup", "repository")
+        server.backup_incremental(self.server_path, self.world_saves, repository, "2024-01-01_00-00-00")
+        self.damage_world()
+
+        output = self.restore("2024-01-01_00-00-00", [os.path.join("world", "region")])
+
+        self.assertIn(f"Restored '{os.path.join('world', 'region')}'.", output)
+        self.assertRestored(level=False)
+
+    def test_restore_seekable_archive(self):
+        archive_path = os.path.join(self.server_path, "backup", "2024-01-01_00-00-00.mcbk")
+        server.create_seekable_archive(self.server_path, self.world_saves, archive_path, 2)
+        self.damage_world()
+
+        self.restore("2024-01-01_00-00-00.mcbk", [os.path.join("world", "level.dat")])
+        self.assertRestored(region=False)
+        self.restore(archive_path)
+        self.assertRestored()
+
+    def test_restore_tar_archive_with_missing_paths(self):
+        archive_path = os.path.join(self.server_path, "backup", "2024-01-01_00-00-00.tar.gz")
+        with mock.patch.dict(server.tar_compressors, {"gzip": [None]}):
+            server.create_archive(self.server_path, self.world_saves, archive_path, "gzip", 2)
+        self.damage_world()
+
+        output = self.restore("2024-01-01_00-00-00.tar.gz", ["world/region", "world/missing"])
+
+        self.assertIn("'world/missing' is not in '2024-01-01_00-00-00.tar.gz'.", output)
+        self.assertRestored(level=False)
+        output = self.restore("2024-01-01_00-00-00.tar.gz", ["world/missing"])
+        self.assertNotIn("Restored", output)
+
+    def test_corrupt_archive(self):
+        with open(os.path.join(self.server_path, "backup", "2024-01-01_00-00-00.tar.gz"), "wb") as f:
+            f.write(b"not an archive")
+
+        stdout = io.StringIO()
+        with silence_stderr(), contextlib.redirect_stdout(stdout):
+            with self.assertRaises(SystemExit):
+                server.restore_backup(self.server_path, "2024-01-01_00-00-00.tar.gz", ["world"], y=True)
+            with self.assertRaises(SystemExit):
+                server.restore_backup(self.server_path, "2024-01-01_00-00-00.tar.gz", y=True)
+
+        self.assertEqual(stdout.getvalue().count("Could not extract '2024-01-01_00-00-00.tar.gz'."), 2)
+        self.assertRestored()
+
+    def test_missing_backup(self):
+        with self.assertRaises(SystemExit), contextlib.redirect_stdout(io.StringIO()):
+            server.restore_backup(self.server_path, "2024-01-01_00-00-00", y=True)
+
+
+class FleetBackupTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="mc-fleet-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.servers = []
+        for server_name in ["survival", "creative", "skyblock"]:
+            server_path = os.path.join(self.directory, server_name)
+            worlds.make_world(server_path)
+            self.servers.append(server_path)
+        self.args = Namespace(
+            world_name="world",
+            compression="gzip",
+            jobs=4,
+            incremental=False,
+            live=False,
+            min_tps=None,
+            parallel=3,
+            per_disk=3,
+            stagger=0.0,
+        )
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+        self.jobs = []
+
+    def backup_fleet(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return server.backup_fleet(self.servers, self.args)
+
+    def fake_backup_server(self, server_name, args):
+        """
+        Stand in for 'backup_server()', counting how many backups run at the same time.
+        """
+
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+            self.jobs.append(args.jobs)
+        time.sleep(0.1)
+        with self.lock:
+            self.running -= 1
+        server.save_catalog(server_name, {"backup": {"size": 1}})
+        return "backup"
+
+    def test_backs_up_every_server(self):
+        shutil.rmtree(os.path.join(self.servers[1], "world_nether"))
+
+        results = self.backup_fleet()
+
+        self.assertEqual([result["server"] for result in results], self.servers)
+        self.assertIn("Could not find a world save at 'world_nether'", results[1]["error"])
+        for result in [results[0], results[2]]:
+            self.assertIsNone(result["error"])
+            self.assertTrue(result["backup"].endswith(".tar.gz"))
+            backup_path = os.path.join(result["server"], "backup", result["backup"])
+            self.assertEqual(result["size"], os.path.getsize(backup_path))
+            self.assertEqual(result["size"], server.load_catalog(result["server"])[result["backup"]]["size"])
+
+    def test_incremental_size_is_the_new_data(self):
+        self.args.incremental = True
+
+        results = self.backup_fleet()
+
+        for result in results:
+            self.assertIsNone(result["error"])
+            repository = os.path.join(result["server"], "backup", "repository")
+            snapshot_path = os.path.join(repository, "snapshots", f"{result['backup']}.json")
+            self.assertGreater(result["size"], os.path.getsize(snapshot_path))
+            self.assertEqual(result["size"], server.load_catalog(result["server"])[result["backup"]]["size"])
+
+    def test_limits_concurrent_backups(self):
+        for parallel, per_disk, most_running in [(3, 3, 3), (2, 3, 2), (3, 1, 1)]:
+            with self.subTest(parallel=parallel, per_disk=per_disk):
+                self.args.parallel = parallel
+                self.args.per_disk = per_disk
+                self.most_running = 0
+                self.jobs = []
+                with mock.patch.object(server, "backup_server", self.fake_backup_server):
+                    results = self.backup_fleet()
+
+                self.assertEqual([result["backup"] for result in results], ["backup"] * 3)
+                self.assertEqual(self.most_running, most_running)
+                self.assertEqual(self.jobs, [4 // parallel] * 3)
+
+    def test_staggers_starts(self):
+        self.args.stagger = 0.2
+        starts = []
+
+        def fake_backup_server(server_name, args):
+            starts.append(time.monotonic())
+            return self.fake_backup_server(server_name, args)
+
+        with mock.patch.object(server, "backup_server", fake_backup_server):
+            self.backup_fleet()
+
+        starts.sort()
+        for first, second in zip(starts, starts[1:]):
+            self.assertGreaterEqual(second - first, 0.19)
+
+
+class FakeClock:
+    """
+    Stands in for 'time.monotonic()' and 'time.sleep()', with sleeping moving the clock forward.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class ThrottleTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        for name in ["monotonic", "sleep"]:
+            patcher = mock.patch.object(server.time, name, getattr(self.clock, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_reads_are_limited_to_the_rate(self):
+        bucket = server.TokenBucket(1000)
+
+        bucket.consume(1000)
+        self.assertEqual(self.clock.slept, [])
+        bucket.consume(500)
+        self.assertEqual(self.clock.slept, [0.5])
+        self.clock.now += 2
+        bucket.consume(1500)
+        # A pause only ever earns one second's worth of reads.
+        self.assertEqual(self.clock.slept, [0.5, 0.5])
+        self.assertEqual(bucket.waited(), 1.0)
+
+    def test_waits_are_counted_per_thread(self):
+        bucket = server.TokenBucket(1000)
+        bucket.consume(3000)
+        waited = []
+
+        thread = threading.Thread(target=lambda: waited.append(bucket.waited()))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(bucket.waited(), 2.0)
+        self.assertEqual(waited, [0.0])
+
+    def test_rate_follows_the_tps(self):
+        bucket = server.TokenBucket(1000)
+        tps = iter([12.0, 12.0, None, 12.0, 12.0, 12.0, 12.0, 20.0])
+        factors = []
+        checked = threading.Event()
+
+        def read_tps():
+            factors.append(bucket.factor)
+            if len(factors) == 9:
+                checked.set()
+            return next(tps, None)
+
+        stop = bucket.adapt_to_tps(read_tps, 18.0, interval=0.001)
+        self.assertTrue(checked.wait(5))
+        stop.set()
+
+        self.assertEqual(factors[:9], [1.0, 0.5, 0.25, 0.25, 0.125, 1 / 16, 1 / 16, 1 / 16, 0.125])
+        # The full rate is restored once the backup is done. time.sleep() is faked, so wait on an event instead.
+        for _ in range(500):
+            if bucket.factor == 1.0:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(bucket.factor, 1.0)
+
+    def test_throttled_writer(self):
+        self.addCleanup(setattr, server, "read_throttle", None)
+        server.limit_reads(1000)
+        output = io.BytesIO()
+
+        server.ThrottledWriter(output).write(b"x" * 3000)
+
+        self.assertEqual(output.getvalue(), b"x" * 3000)
+        self.assertEqual(self.clock.slept, [2.0])
+
+
+class ThrottledBackupTest(unittest.TestCase):
+    def test_throttled_backup(self):
+        directory = tempfile.mkdtemp(prefix="mc-throttle-test-")
+        self.addCleanup(shutil.rmtree, directory)
+        server_path = os.path.join(directory, "survival")
+        world_saves = worlds.make_world(server_path)
+        consumed = []
+        self.addCleanup(setattr, server, "read_throttle", None)
+        server.limit_reads(10000)
+
+        with mock.patch.object(server.read_throttle, "consume", side_effect=consumed.append):
+            stats = server.backup_incremental(server_path, world_saves, os.path.join(directory, "repository"), "1")
+            server.create_archive(server_path, world_saves, os.path.join(directory, "backup.mcbk"), "seekable", 2)
+
+        world_size = server.world_saves_stats(server_path, world_saves)[1]
+        self.assertEqual(sum(consumed), stats["bytes_read"] + world_size)
+
+    @unittest.skipUnless(os.path.exists("/proc/self/io"), "'/proc/<pid>/io' is only available on Linux")
+    def test_throttled_process(self):
+        directory = tempfile.mkdtemp(prefix="mc-throttle-test-")
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "data")
+        with open(path, "wb") as f:
+            f.write(os.urandom(300000))
+        self.addCleanup(setattr, server, "read_throttle", None)
+        server.limit_reads(200000)
+
+        # Read in small pieces so the process is still running when it is first checked.
+        reader = f"import time\nwith open({path!r}, 'rb') as f:\n    while f.read(4096):\n        time.sleep(0.001)\n"
+        started = time.monotonic()
+        process = subprocess.Popen([sys.executable, "-c", reader])
+        self.assertEqual(server.throttle_process(process, interval=0.01), 0)
+
+        # The first 200000 bytes are a burst, the rest take half a second.
+        self.assertGreater(time.monotonic() - started, 0.4)
+
+
+if __name__ == "__main__":
+    unittest.main()
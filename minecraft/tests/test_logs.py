@@ -0,0 +1,189 @@
+"""
+Tests for finding lag, stalls, crashes and restarts in server logs.
+
+Run from the repository root with 'python -m unittest discover minecraft/tests'.
+"""
+
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server  # noqa: E402
+
+
+def log_line(clock, message, thread="Server thread", level="INFO"):
+    return f"[{clock}] [{thread}/{level}]: {message}\n"
+
+
+# Startup noise, so every log is long enough to be told apart by its first kilobyte.
+STARTUP = "".join(log_line("00:00:00", f"Loading plugin {i} of 40") for i in range(40))
+
+
+class LogAnalysisTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="mc-logs-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.server_name = os.path.join(self.directory, "survival")
+        self.logs_directory = os.path.join(self.server_name, "logs")
+        os.makedirs(self.logs_directory)
+        self.latest_path = os.path.join(self.logs_directory, "latest.log")
+
+    def write_latest(self, text, date="2024-01-02", mode="w"):
+        """
+        Write 'latest.log', last modified at noon on the given date.
+        """
+
+        with open(self.latest_path, mode) as f:
+            f.write(text)
+        mtime = time.mktime(datetime.strptime(f"{date} 12:00", "%Y-%m-%d %H:%M").timetuple())
+        os.utime(self.latest_path, (mtime, mtime))
+
+    def write_rotated(self, name, text):
+        with gzip.open(os.path.join(self.logs_directory, name), "wt") as f:
+            f.write(text)
+
+    def summarize(self, events):
+        return [(event["time"], event["type"]) for event in events]
+
+    def test_events_in_rotated_and_latest_logs(self):
+        self.write_rotated(
+            "2024-01-01-1.log.gz",
+            STARTUP
+            + log_line("08:00:00", "Done (12.345s)! For help, type \"help\"")
+            + log_line("08:10:00", "Alex joined the game")
+            + log_line("08:10:05", "Steve joined the game")
+            + log_line("08:20:00", "Can't keep up! Is the server overloaded? Running 2500ms or 50 ticks behind")
+            + log_line("08:30:00", "Automatic saving is now disabled")
+            + log_line("08:30:30", "Can't keep up! Is the server overloaded? Running 5000ms or 100 ticks behind")
+            + log_line("08:31:00", "Automatic saving is now enabled")
+            + log_line("08:40:00", "Steve left the game")
+            + log_line("09:00:00", "Stopping server"),
+        )
+        self.write_latest(
+            STARTUP
+            + log_line("10:00:00", "Done (8,5s)! For help, type \"help\"")
+            + log_line("10:05:00", "The server has not responded for 10 seconds! Creating thread dump", "Watchdog")
+            + log_line("10:05:10", "The server has not responded for 20 seconds! Creating thread dump", "Watchdog")
+            + log_line("10:05:20", "The server has stopped responding! This is (probably) not a Paper bug.", "Watchdog")
+            + log_line("10:06:00", "Done (9.0s)! For help, type \"help\"")
+            + log_line("11:00:00", "Done (9.0s)! For help, type \"help\"")
+        )
+
+        events = server.analyze_logs(self.server_name)
+
+        self.assertEqual(
+            self.summarize(events),
+            [
+                ("2024-01-01T08:00:00", "start"),
+                ("2024-01-01T08:20:00", "lag"),
+                ("2024-01-01T08:30:00", "save-off"),
+                ("2024-01-01T08:30:30", "lag"),
+                ("2024-01-01T08:31:00", "save-on"),
+                ("2024-01-01T09:00:00", "stop"),
+                ("2024-01-02T10:00:00", "start"),
+                ("2024-01-02T10:05:00", "stall"),
+                ("2024-01-02T10:05:20", "crash"),
+                ("2024-01-02T10:06:00", "start"),
+                ("2024-01-02T11:00:00", "crash"),
+                ("2024-01-02T11:00:00", "start"),
+            ],
+        )
+        self.assertEqual((events[1]["ms"], events[1]["ticks"], events[1]["players"]), (2500, 50, 2))
+        self.assertEqual(events[0]["seconds"], 12.345)
+        self.assertEqual(events[6]["seconds"], 8.5)
+        # The watchdog's repeated warnings are one stall.
+        self.assertEqual(events[7]["seconds"], 20)
+        self.assertEqual(events[10]["detail"], "no clean shutdown before start")
+
+    def test_days_are_counted_across_midnight(self):
+        self.write_latest(
+            STARTUP
+            + log_line("23:59:00", "Can't keep up! Is the server overloaded? Running 2000ms or 40 ticks behind")
+            + log_line("00:01:00", "Can't keep up! Is the server overloaded? Running 2000ms or 40 ticks behind")
+            + log_line("12:00:00", "Stopping server"),
+            date="2024-03-01",
+        )
+
+        events = server.analyze_logs(self.server_name)
+
+        self.assertEqual(
+            [event["time"] for event in events], ["2024-02-29T23:59:00", "2024-03-01T00:01:00", "2024-03-01T12:00:00"]
+        )
+
+    def test_colored_lines(self):
+        self.write_latest(STARTUP + log_line("10:00:00", "\x1b[32mDone (3.0s)! For help, type \"help\"\x1b[0m"))
+
+        self.assertEqual(self.summarize(server.analyze_logs(self.server_name)), [("2024-01-02T10:00:00", "start")])
+
+    def test_only_new_lines_are_read(self):
+        self.write_latest(STARTUP + log_line("10:00:00", "Done (3.0s)! For help, type \"help\""))
+        server.analyze_logs(self.server_name)
+        # The server is still writing the last line.
+        self.write_latest(log_line("10:30:00", "Saving chunks") + "[10:31:00] [Server thread/INFO]: Stop", mode="a")
+
+        events = server.analyze_logs(self.server_name)
+
+        self.assertEqual(self.summarize(events), [("2024-01-02T10:00:00", "start")])
+        # The rest of the line turns it into 'Stopping server'.
+        self.write_latest("ping server\n", mode="a")
+        self.assertEqual(
+            self.summarize(server.analyze_logs(self.server_name)),
+            [("2024-01-02T10:00:00", "start"), ("2024-01-02T10:31:00", "stop")],
+        )
+
+    def test_rotated_latest_log_is_not_read_again(self):
+        text = STARTUP + log_line("10:00:00", "Done (3.0s)! For help, type \"help\"")
+        text += log_line("11:00:00", "Stopping server")
+        self.write_latest(text)
+        server.analyze_logs(self.server_name)
+
+        # The server restarted the next day and rotated the log.
+        self.write_rotated("2024-01-02-1.log.gz", text)
+        next_text = STARTUP.replace("Loading", "Enabling") + log_line("09:00:00", "Stopping server")
+        self.write_latest(next_text, "2024-01-03")
+        events = server.analyze_logs(self.server_name)
+
+        self.assertEqual(
+            self.summarize(events),
+            [("2024-01-02T10:00:00", "start"), ("2024-01-02T11:00:00", "stop"), ("2024-01-03T09:00:00", "stop")],
+        )
+        self.assertEqual(server.analyze_logs(self.server_name), events)
+
+    def test_short_latest_log_waits(self):
+        self.write_latest(log_line("10:00:00", "Done (3.0s)! For help, type \"help\""))
+
+        self.assertEqual(server.analyze_logs(self.server_name), [])
+
+    def test_report(self):
+        events = [
+            {"time": "2024-01-01T08:00:00", "type": "start", "seconds": 12.0},
+            {"time": "2024-01-01T08:20:00", "type": "lag", "ms": 2500, "ticks": 50, "players": 2},
+            {"time": "2024-01-01T08:30:00", "type": "save-off"},
+            {"time": "2024-01-01T08:30:30", "type": "lag", "ms": 5000, "ticks": 100, "players": 1},
+            {"time": "2024-01-01T08:31:00", "type": "save-on"},
+            {"time": "2024-01-01T08:40:00", "type": "crash"},
+        ]
+        stdout = io.StringIO()
+
+        with contextlib.redirect_stdout(stdout):
+            server.print_log_report(events)
+
+        report = stdout.getvalue()
+        self.assertIn("5000 ms / 100 ticks behind with 1 player(s)", report)
+        self.assertIn("Lag events: 2 (1 during backups)", report)
+        self.assertIn("Ticks skipped: 150", report)
+        self.assertIn("Time behind: 7.5 s", report)
+        self.assertIn("Average players during lag: 1.5", report)
+        self.assertIn("Crashes: 1", report)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,188 @@
+"""
+Tests for the RCON client, run against a local fake of a Minecraft server's RCON port.
+
+Run from the repository root with 'python -m unittest discover minecraft/tests'.
+"""
+
+import os
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server  # noqa: E402
+
+PASSWORD = "secret"
+
+
+class FakeRconServer:
+    """
+    Answers RCON logins and commands like Minecraft does, on a free local port.
+
+    A command is answered with 'ran <command>', except 'big', whose output is split over several packets, 'hang',
+    after which nothing is answered, and 'drop', which closes the connection without an answer. Packets of an
+    unknown type get a single 'Unknown request' packet.
+    """
+
+    def __init__(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+        self.connections = []
+        self.commands = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            with self.lock:
+                self.connections.append(connection)
+            threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+    def drop_connections(self):
+        """
+        Close every connection, as a server restart would.
+        """
+
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                connection.close()
+
+    def stop(self):
+        self.listener.close()
+        self.drop_connections()
+
+    def receive_exactly(self, connection, size):
+        data = b""
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def send(self, connection, request_id, packet_type, body):
+        payload = struct.pack("<ii", request_id, packet_type) + body.encode() + b"\x00\x00"
+        connection.sendall(struct.pack("<i", len(payload)) + payload)
+
+    def handle(self, connection):
+        try:
+            while True:
+                (length,) = struct.unpack("<i", self.receive_exactly(connection, 4))
+                payload = self.receive_exactly(connection, length)
+                request_id, packet_type = struct.unpack("<ii", payload[:8])
+                body = payload[8:-2].decode()
+                if packet_type == server.RCON_LOGIN:
+                    self.send(connection, request_id if body == PASSWORD else -1, server.RCON_COMMAND, "")
+                elif packet_type == server.RCON_COMMAND:
+                    with self.lock:
+                        self.commands.append(body)
+                    if body == "hang":
+                        # Stop answering, but keep the connection open.
+                        return
+                    if body == "drop":
+                        connection.shutdown(socket.SHUT_RDWR)
+                        return
+                    output = "x" * 10000 if body == "big" else f"ran {body}"
+                    for start in range(0, len(output), 4096):
+                        self.send(connection, request_id, 0, output[start : start + 4096])
+                else:
+                    self.send(connection, request_id, 0, f"Unknown request {packet_type:x}")
+        except (ConnectionError, OSError):
+            pass
+
+
+class RconClientTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeRconServer()
+        self.addCleanup(self.fake.stop)
+
+    def client(self, password=PASSWORD):
+        client = server.RconClient("127.0.0.1", self.fake.port, password, timeout=5)
+        self.addCleanup(client.close)
+        return client
+
+    def test_command_output(self):
+        self.assertEqual(self.client().command("list"), "ran list")
+
+    def test_split_response_is_joined(self):
+        self.assertEqual(self.client().command("big"), "x" * 10000)
+
+    def test_wrong_password(self):
+        with self.assertRaises(PermissionError):
+            self.client("wrong").command("list")
+        self.assertEqual(self.fake.commands, [])
+
+    def test_reconnects_after_the_connection_is_dropped(self):
+        client = self.client()
+        client.command("list")
+        self.fake.drop_connections()
+
+        self.assertEqual(client.command("save-all"), "ran save-all")
+        self.assertEqual(len(self.fake.connections), 2)
+
+    def test_command_is_not_sent_again_when_the_connection_drops(self):
+        client = self.client()
+        with self.assertRaises(ConnectionError):
+            client.command("drop")
+
+        self.assertEqual(self.fake.commands, ["drop"])
+        self.assertEqual(client.command("list"), "ran list")
+
+    def test_command_is_not_sent_again_after_a_timeout(self):
+        client = self.client()
+        client.timeout = 0.2
+        with self.assertRaises(socket.timeout):
+            client.command("hang")
+
+        self.assertEqual(self.fake.commands, ["hang"])
+
+
+class RconCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeRconServer()
+        self.addCleanup(self.fake.stop)
+        self.directory = tempfile.mkdtemp(prefix="mc-rcon-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.server_name = os.path.join(self.directory, "survival")
+        os.makedirs(self.server_name)
+        with open(os.path.join(self.server_name, "server.properties"), "w") as f:
+            f.write(f"enable-rcon=true\nrcon.port={self.fake.port}\nrcon.password={PASSWORD}\nserver-ip=\n")
+        self.addCleanup(self.close_clients)
+
+    def close_clients(self):
+        for client in server.rcon_clients.values():
+            client.close()
+        server.rcon_clients.clear()
+
+    def test_commands_reuse_one_connection(self):
+        self.assertTrue(server.rcon_reachable(self.server_name))
+        self.assertEqual(server.rcon_command(self.server_name, "save-off"), "ran save-off")
+        self.assertEqual(server.rcon_command(self.server_name, "save-on"), "ran save-on")
+
+        self.assertEqual(self.fake.commands, ["list", "save-off", "save-on"])
+        self.assertEqual(len(self.fake.connections), 1)
+
+    def test_disabled_rcon_is_not_reachable(self):
+        with open(os.path.join(self.server_name, "server.properties"), "w") as f:
+            f.write(f"enable-rcon=false\nrcon.port={self.fake.port}\nrcon.password={PASSWORD}\n")
+
+        self.assertFalse(server.rcon_reachable(self.server_name))
+        self.assertEqual(self.fake.connections, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,371 @@
+"""
+Tests for pruning unvisited chunks from region files and for checking region files for damage.
+
+Run from the repository root with 'python -m unittest discover minecraft/tests'.
+"""
+
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server  # noqa: E402
+import worlds  # noqa: E402
+
+
+class RegionTestCase(unittest.TestCase):
+    """
+    Creates a server directory in a temporary directory.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="mc-regions-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.server_name = os.path.join(self.directory, "survival")
+
+    def region_path(self, name="r.0.0.mca", dimension="world", kind="region"):
+        return os.path.join(self.server_name, dimension, kind, name)
+
+    def write_region(self, chunks, name="r.0.0.mca", dimension="world", kind="region", gap=1):
+        path = self.region_path(name, dimension, kind)
+        worlds.write_region_file(path, chunks, gap)
+        return path
+
+
+class PruneRegionTest(RegionTestCase):
+    def setUp(self):
+        super().setUp()
+        # Chunk 33 is at chunk coordinates (1, 1), so its center is at block (24, 24).
+        self.chunks = worlds.region_chunks(0, 0, {0: 0, 1: 5000, 2: 100, 33: 999, 40: 20000})
+        self.path = self.write_region(self.chunks)
+
+    def prune(self, protected=(), dry_run=False, related_paths=(), path=None):
+        return server.prune_region(path or self.path, list(related_paths), 1000, list(protected), dry_run)
+
+    def test_unvisited_chunks_are_dropped(self):
+        before = os.path.getsize(self.path)
+
+        stats = self.prune()
+
+        kept = {index: self.chunks[index] for index in [1, 40]}
+        self.assertEqual(server.read_region_chunks(self.path), kept)
+        self.assertEqual(
+            stats, {"chunks": 5, "pruned": 3, "before": before, "after": server.region_size(kept), "error": None}
+        )
+        # The file is compacted, without the sectors the dropped chunks and the gaps between chunks took up.
+        self.assertEqual(os.path.getsize(self.path), stats["after"])
+
+    def test_protected_chunks_are_kept(self):
+        stats = self.prune(protected=[(24, 24, 0), (-50, -50, 90)])
+
+        self.assertEqual(sorted(server.read_region_chunks(self.path)), [0, 1, 33, 40])
+        self.assertEqual(stats["pruned"], 1)
+
+    def test_negative_region_coordinates(self):
+        # Chunk 1023 of region (-1, -1) is chunk (-1, -1), with its center at block (-8, -8).
+        path = self.write_region(worlds.region_chunks(-1, -1, {1022: 0, 1023: 0}), "r.-1.-1.mca")
+
+        self.prune(protected=[(-8, -8, 1)], path=path)
+
+        self.assertEqual(list(server.read_region_chunks(path)), [1023])
+
+    def test_chunks_from_before_1_18(self):
+        record = worlds.chunk_record(worlds.chunk_nbt(0, 0, 0, legacy=True))
+        self.write_region({0: (1, record), 1: (1, worlds.chunk_record(worlds.chunk_nbt(1, 0, 5000, legacy=True)))})
+
+        self.assertEqual(self.prune()["pruned"], 1)
+        self.assertEqual(list(server.read_region_chunks(self.path)), [1])
+
+    def test_unreadable_chunks_are_kept(self):
+        # An LZ4 compressed chunk and one stored in an '.mcc' file.
+        lz4 = struct.pack(">I", 11) + bytes([4]) + os.urandom(10)
+        external = struct.pack(">I", 1) + bytes([130])
+        self.write_region({0: (1, lz4), 1: (1, external), 2: self.chunks[0]})
+
+        self.assertEqual(self.prune()["pruned"], 1)
+        self.assertEqual(sorted(server.read_region_chunks(self.path)), [0, 1])
+
+    def test_related_files_lose_the_same_chunks(self):
+        entities_path = self.write_region(worlds.region_chunks(0, 0, {0: 0, 1: 0, 7: 0}), kind="entities")
+        poi_path = self.write_region(worlds.region_chunks(0, 0, {2: 0}), kind="poi")
+
+        stats = self.prune(related_paths=[entities_path, poi_path, self.region_path(kind="missing")])
+
+        self.assertEqual(sorted(server.read_region_chunks(entities_path)), [1, 7])
+        # A file left without chunks is deleted.
+        self.assertFalse(os.path.exists(poi_path))
+        self.assertEqual(stats["after"], os.path.getsize(self.path) + os.path.getsize(entities_path))
+
+    def test_dry_run_changes_nothing(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        dry_run_stats = self.prune(dry_run=True)
+
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(dry_run_stats, self.prune())
+
+    def test_files_that_would_grow_are_left_alone(self):
+        path = self.write_region(worlds.region_chunks(0, 0, {0: 5000, 1: 5000}), gap=0)
+        mtime_ns = os.stat(path).st_mtime_ns
+
+        stats = self.prune()
+
+        self.assertEqual(stats["pruned"], 0)
+        self.assertEqual(stats["after"], stats["before"])
+        self.assertEqual(os.stat(path).st_mtime_ns, mtime_ns)
+
+    def test_damaged_file_is_reported(self):
+        with open(self.path, "r+b") as f:
+            f.truncate(3 * worlds.SECTOR_SIZE)
+
+        stats = self.prune()
+
+        self.assertIn(self.path, stats["error"])
+        self.assertEqual(os.path.getsize(self.path), 3 * worlds.SECTOR_SIZE)
+
+
+class PruneWorldTest(RegionTestCase):
+    def setUp(self):
+        super().setUp()
+        worlds.write_level_dat(os.path.join(self.server_name, "world", "level.dat"), 40, 10)
+        # Chunk 2 has its center at block (40, 8), next to the world spawn.
+        self.write_region(worlds.region_chunks(0, 0, {0: 0, 2: 0, 3: 5000}))
+        self.write_region(worlds.region_chunks(0, 0, {2: 0, 3: 0}), dimension=os.path.join("world_nether", "DIM-1"))
+        self.write_region(worlds.region_chunks(1, 0, {0: 0}), "r.1.0.mca")
+        with open(self.region_path("r.2.0.mca"), "wb") as f:
+            f.write(b"damaged")
+        with open(self.region_path("r.0.0.mca.part"), "wb") as f:
+            f.write(b"left over")
+
+    def prune_world(self, **options):
+        arguments = {"min_inhabited_time": 1000, "protected": [], "spawn_radius": 0, "dry_run": False, "jobs": 2}
+        arguments.update(options)
+        return server.prune_world(self.server_name, "world", **arguments)
+
+    def test_every_dimension_is_pruned(self):
+        results = self.prune_world()
+
+        self.assertEqual(list(results), ["world", os.path.join("world_nether", "DIM-1")])
+        overworld = results["world"]
+        self.assertEqual((overworld["regions"], overworld["chunks"], overworld["pruned"]), (3, 4, 3))
+        self.assertEqual(len(overworld["errors"]), 1)
+        self.assertIn("r.2.0.mca", overworld["errors"][0])
+        self.assertEqual(list(server.read_region_chunks(self.region_path())), [3])
+        self.assertFalse(os.path.exists(self.region_path("r.1.0.mca")))
+        # Only the overworld has a spawn.
+        self.assertFalse(os.path.exists(self.region_path(dimension=os.path.join("world_nether", "DIM-1"))))
+
+    def test_spawn_radius(self):
+        self.prune_world(spawn_radius=16)
+
+        self.assertEqual(sorted(server.read_region_chunks(self.region_path())), [2, 3])
+
+    def test_protected_areas_apply_to_every_dimension(self):
+        self.prune_world(protected=[(56, 8, 0)])
+
+        nether_path = self.region_path(dimension=os.path.join("world_nether", "DIM-1"))
+        self.assertEqual(list(server.read_region_chunks(nether_path)), [3])
+
+    def test_dry_run(self):
+        results = self.prune_world(dry_run=True)
+
+        self.assertEqual(results["world"]["pruned"], 3)
+        self.assertLess(results["world"]["after"], results["world"]["before"])
+        self.assertEqual(sorted(server.read_region_chunks(self.region_path())), [0, 2, 3])
+
+    def test_missing_level_dat_has_the_spawn_at_the_origin(self):
+        os.remove(os.path.join(self.server_name, "world", "level.dat"))
+
+        self.assertEqual(server.world_spawn(os.path.join(self.server_name, "world", "level.dat")), (0, 0))
+
+
+class ScanRegionTest(RegionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.chunks = worlds.region_chunks(0, 0, {0: 0, 1: 0, 33: 0})
+        self.path = self.write_region(self.chunks)
+
+    def set_location(self, index, offset, sector_count):
+        with open(self.path, "r+b") as f:
+            f.seek(index * 4)
+            f.write(struct.pack(">I", (offset << 8) | sector_count))
+
+    def location(self, index):
+        with open(self.path, "rb") as f:
+            return server.read_region_header(f)[index]
+
+    def scan(self, compact=False):
+        return server.scan_region(self.path, compact)
+
+    def test_healthy_file(self):
+        result = self.scan()
+
+        self.assertEqual(result["problems"], [])
+        self.assertEqual(result["chunks"], 3)
+        # Every chunk is preceded by a gap of one sector.
+        self.assertEqual(result["wasted"], 3 * worlds.SECTOR_SIZE)
+        self.assertFalse(result["compacted"])
+
+    def test_compacting(self):
+        size = os.path.getsize(self.path)
+
+        result = self.scan(compact=True)
+
+        self.assertTrue(result["compacted"])
+        self.assertEqual(result["size"], size)
+        self.assertEqual(os.path.getsize(self.path), size - 3 * worlds.SECTOR_SIZE)
+        self.assertEqual(server.read_region_chunks(self.path), self.chunks)
+        self.assertEqual(self.scan()["wasted"], 0)
+
+    def test_empty_file(self):
+        open(self.path, "w").close()
+
+        self.assertEqual(self.scan(), {"chunks": 0, "size": 0, "wasted": 0, "problems": [], "compacted": False})
+
+    def test_short_file(self):
+        with open(self.path, "r+b") as f:
+            f.truncate(100)
+
+        self.assertEqual(self.scan()["problems"], ["the file is too short to have a header"])
+
+    def test_damaged_files_are_not_compacted(self):
+        with open(self.path, "ab") as f:
+            f.write(b"x" * 10)
+
+        result = self.scan(compact=True)
+
+        self.assertEqual(result["problems"], [f"the size isn't a multiple of {worlds.SECTOR_SIZE} bytes"])
+        self.assertFalse(result["compacted"])
+        self.assertEqual(os.path.getsize(self.path), result["size"])
+
+    def test_bad_locations(self):
+        self.set_location(1, 1, 1)
+        self.set_location(33, 100, 1)
+
+        self.assertEqual(
+            self.scan()["problems"],
+            [
+                "chunk (1, 0) has an invalid location (sector 1, 1 sectors)",
+                "chunk (1, 1) ends past the end of the file",
+            ],
+        )
+
+    def test_overlapping_chunks(self):
+        self.set_location(1, *self.location(0)[:2])
+
+        self.assertEqual(self.scan()["problems"], ["chunk (1, 0) overlaps chunk (0, 0)"])
+
+    def test_bad_chunks(self):
+        offsets = [self.location(index)[0] * worlds.SECTOR_SIZE for index in [0, 1, 33]]
+        with open(self.path, "r+b") as f:
+            # Corrupt compressed data, an unknown compression type and a length past the chunk's sectors.
+            f.seek(offsets[0] + 10)
+            f.write(b"\xff" * 20)
+            f.seek(offsets[1] + 4)
+            f.write(bytes([7]))
+            f.seek(offsets[2])
+            f.write(struct.pack(">I", 5000))
+
+        problems = self.scan()["problems"]
+
+        self.assertEqual(len(problems), 3)
+        self.assertTrue(problems[0].startswith("chunk (0, 0): "))
+        self.assertEqual(problems[1], "chunk (1, 0): uses unknown compression type 7")
+        sector = offsets[2] // worlds.SECTOR_SIZE
+        self.assertEqual(problems[2], f"chunk (1, 1): the chunk at sector {sector} has an invalid length of 5000.")
+
+    def test_truncated_nbt(self):
+        data = worlds.chunk_nbt(0, 0, 0)
+        self.write_region({0: (1, worlds.chunk_record(data[:-30], compression=3))})
+
+        self.assertEqual(len(self.scan()["problems"]), 1)
+
+    def test_external_chunks(self):
+        self.write_region({0: (1, struct.pack(">I", 1) + bytes([130]))})
+
+        self.assertEqual(self.scan()["problems"], ["chunk (0, 0): is stored in a '.mcc' file that is missing"])
+        open(self.region_path("c.0.0.mcc"), "w").close()
+        self.assertEqual(self.scan()["problems"], [])
+
+
+class ScanWorldTest(RegionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.nether = os.path.join("world_nether", "DIM-1")
+        self.write_region(worlds.region_chunks(0, 0, {0: 0, 1: 0}))
+        self.write_region(worlds.region_chunks(-1, 0, {5: 0}), "r.-1.0.mca", gap=0)
+        self.write_region(worlds.region_chunks(0, 0, {0: 0}), kind="entities")
+        self.write_region(worlds.region_chunks(0, 0, {0: 0}), dimension=self.nether, kind="poi", gap=0)
+        open(self.region_path("r.0.0.mca.part"), "w").close()
+
+    def scan_world(self, compact=False):
+        return server.scan_world(self.server_name, "world", compact, 2)
+
+    def test_every_region_file_is_scanned(self):
+        results = self.scan_world()
+
+        self.assertEqual(
+            sorted(results),
+            sorted(
+                [
+                    os.path.join("world", "region", "r.0.0.mca"),
+                    os.path.join("world", "region", "r.-1.0.mca"),
+                    os.path.join("world", "entities", "r.0.0.mca"),
+                    os.path.join(self.nether, "poi", "r.0.0.mca"),
+                ]
+            ),
+        )
+        self.assertFalse(any(result["cached"] or result["problems"] for result in results.values()))
+        self.assertEqual(results[os.path.join("world", "region", "r.0.0.mca")]["wasted"], 2 * worlds.SECTOR_SIZE)
+
+    def test_unchanged_files_are_not_scanned_again(self):
+        self.scan_world()
+        # Damage a file without the scan noticing, to tell whether it is read again.
+        path = self.region_path("r.-1.0.mca")
+        file_stat = os.stat(path)
+        with open(path, "r+b") as f:
+            f.seek(5 * 4)
+            f.write(struct.pack(">I", (1 << 8) | 1))
+        os.utime(path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+        os.utime(self.region_path(kind="entities"), ns=(0, 0))
+
+        results = self.scan_world()
+
+        self.assertEqual(
+            {path for path, result in results.items() if not result["cached"]},
+            {os.path.join("world", "entities", "r.0.0.mca")},
+        )
+        self.assertEqual(results[os.path.join("world", "region", "r.-1.0.mca")]["problems"], [])
+
+    def test_compacting_scans_files_with_unused_sectors_again(self):
+        self.scan_world()
+
+        results = self.scan_world(compact=True)
+
+        compacted = {path for path, result in results.items() if result["compacted"]}
+        self.assertEqual(
+            compacted, {os.path.join("world", "region", "r.0.0.mca"), os.path.join("world", "entities", "r.0.0.mca")}
+        )
+        self.assertEqual({path for path, result in results.items() if not result["cached"]}, compacted)
+        # The cache remembers the files as they are after compacting.
+        results = self.scan_world(compact=True)
+        self.assertTrue(all(result["cached"] and result["wasted"] == 0 for result in results.values()))
+
+    def test_deleted_files_are_dropped_from_the_cache(self):
+        self.scan_world()
+        os.remove(self.region_path(kind="entities"))
+
+        self.scan_world()
+
+        with open(os.path.join(self.server_name, server.REGION_SCAN_PATH)) as f:
+            self.assertNotIn(os.path.join("world", "entities", "r.0.0.mca"), json.load(f))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+"""
+Tests for replicating backups to a target directory, locally and through a stand-in for ssh.
+
+Run from the repository root with 'python -m unittest discover minecraft/tests'.
+"""
+
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server  # noqa: E402
+
+# Runs the agent's command the way ssh would on the host, without the host.
+SSH_SHIM = """
+import subprocess
+import sys
+
+sys.exit(subprocess.call(["sh", "-c", sys.argv[2]]))
+"""
+
+
+class ReplicationTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="mc-replication-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.server_name = os.path.join(self.directory, "survival")
+        self.backup_directory = os.path.join(self.server_name, "backup")
+        os.makedirs(self.backup_directory)
+        self.target = os.path.join(self.directory, "target")
+        os.makedirs(self.target)
+        self.random = random.Random(0)
+
+    def replicate(self, target=None, ssh_command="ssh"):
+        agent = server.ReplicationAgent(target or self.target, ssh_command)
+        try:
+            return server.replicate_backups(agent, self.server_name)
+        finally:
+            agent.close()
+
+    def write_archive(self, name, data):
+        with open(os.path.join(self.backup_directory, name), "wb") as f:
+            f.write(data)
+
+    def assertReplicated(self, name):
+        with open(os.path.join(self.backup_directory, name), "rb") as f:
+            data = f.read()
+        with open(os.path.join(self.target, "survival", name), "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def edit(self, data, edits):
+        """
+        Insert, delete and overwrite bytes at random places, like the regions of a world that changed.
+        """
+
+        data = bytearray(data)
+        for _ in range(edits):
+            position = self.random.randrange(len(data))
+            length = self.random.randrange(1, 20000)
+            kind = self.random.choice(["insert", "delete", "overwrite"])
+            if kind == "insert":
+                data[position:position] = os.urandom(length)
+            elif kind == "delete":
+                del data[position : position + length]
+            else:
+                data[position : position + length] = os.urandom(len(data[position : position + length]))
+        return bytes(data)
+
+    def test_changed_archive_is_sent_as_a_delta(self):
+        data = os.urandom(3 * 1024 * 1024)
+        self.write_archive("2024-01-01_00-00-00.tar.gz", data)
+        self.assertEqual(self.replicate()["sent"], len(data))
+
+        self.write_archive("2024-01-02_00-00-00.tar.gz", self.edit(data, 3))
+        stats = self.replicate()
+
+        self.assertReplicated("2024-01-02_00-00-00.tar.gz")
+        self.assertEqual(stats["files"], 1)
+        self.assertLess(stats["sent"], stats["size"] // 4)
+
+    def test_random_edits_are_reconstructed(self):
+        data = os.urandom(1024 * 1024)
+        for day in range(1, 6):
+            name = f"2024-01-0{day}_00-00-00.zip"
+            self.write_archive(name, data)
+            self.replicate()
+            self.assertReplicated(name)
+            data = self.edit(data, self.random.randrange(1, 30))
+
+    def test_interrupted_transfer_resumes(self):
+        data = os.urandom(3 * server.REPLICATION_CHECKPOINT)
+        self.write_archive("2024-01-01_00-00-00.tar.gz", data)
+        os.makedirs(os.path.join(self.target, "survival"))
+        with open(os.path.join(self.target, "survival", "2024-01-01_00-00-00.tar.gz.part"), "wb") as f:
+            f.write(data[: 2 * server.REPLICATION_CHECKPOINT + 1000])
+
+        stats = self.replicate()
+
+        self.assertReplicated("2024-01-01_00-00-00.tar.gz")
+        self.assertEqual(stats["sent"], server.REPLICATION_CHECKPOINT)
+        self.assertFalse(os.path.exists(os.path.join(self.target, "survival", "2024-01-01_00-00-00.tar.gz.part")))
+
+    def test_corrupt_partial_transfer_is_sent_again(self):
+        data = os.urandom(2 * server.REPLICATION_CHECKPOINT)
+        self.write_archive("2024-01-01_00-00-00.tar.gz", data)
+        os.makedirs(os.path.join(self.target, "survival"))
+        with open(os.path.join(self.target, "survival", "2024-01-01_00-00-00.tar.gz.part"), "wb") as f:
+            f.write(os.urandom(server.REPLICATION_CHECKPOINT))
+
+        self.assertEqual(self.replicate()["sent"], len(data))
+        self.assertReplicated("2024-01-01_00-00-00.tar.gz")
+
+    def test_repository_only_sends_missing_files(self):
+        repository = os.path.join(self.backup_directory, "repository")
+        files = {
+            "chunks/ab/abcdef": os.urandom(5000),
+            "chunks/cd/cdef01": os.urandom(7000),
+            "snapshots/2024-01-01_00-00-00.json": b'{"files": {}}',
+        }
+        for relative_path, data in files.items():
+            os.makedirs(os.path.dirname(os.path.join(repository, relative_path)), exist_ok=True)
+            with open(os.path.join(repository, relative_path), "wb") as f:
+                f.write(data)
+
+        self.assertEqual(self.replicate()["files"], len(files))
+        for relative_path, data in files.items():
+            with open(os.path.join(self.target, "survival", "repository", relative_path), "rb") as f:
+                self.assertEqual(f.read(), data)
+        self.assertEqual(self.replicate(), {"files": 0, "size": 0, "sent": 0})
+
+    def test_replicates_over_ssh(self):
+        shim_path = os.path.join(self.directory, "ssh.py")
+        with open(shim_path, "w") as f:
+            f.write(SSH_SHIM)
+        self.write_archive("2024-01-01_00-00-00.tar.gz", os.urandom(100000))
+
+        stdout = io.StringIO()
+        with mock.patch.object(server, "REPLICATION_PYTHON", sys.executable), contextlib.redirect_stdout(stdout):
+            succeeded = server.replicate_servers(
+                [self.server_name], f"backup-host:{self.target}", f"{sys.executable} {shim_path}"
+            )
+
+        self.assertTrue(succeeded, stdout.getvalue())
+        self.assertReplicated("2024-01-01_00-00-00.tar.gz")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,388 @@
+"""
+Tests for the generated start.py, with a stub 'java' that records how it was started.
+
+Run from the repository root with 'python -m unittest discover minecraft/tests'.
+"""
+
+import builtins
+import fcntl
+import importlib.util
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import warnings
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server  # noqa: E402
+from fake_papermc import BUILD, JAR_NAME, MC_VERSION, FakePaperMC  # noqa: E402
+
+# Records its arguments and answers '-version' like the Java version in $STUB_JAVA_VERSION.
+STUB_JAVA = """
+import json
+import os
+import sys
+
+with open(os.environ["STUB_JAVA_LOG"], "a") as f:
+    f.write(json.dumps(sys.argv[1:]) + "\\n")
+if sys.argv[1:] == ["-version"]:
+    sys.stderr.write('openjdk version "%s" 2024-01-16\\n' % os.environ["STUB_JAVA_VERSION"])
+"""
+
+GIB = 1024**3
+
+
+class StartTestCase(unittest.TestCase):
+    def setUp(self):
+        warnings.simplefilter("ignore", ResourceWarning)
+        self.api = FakePaperMC().start()
+        self.addCleanup(self.api.stop)
+        self.directory = tempfile.mkdtemp(prefix="mc-start-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.server_path = os.path.join(self.directory, "survival")
+        os.makedirs(self.server_path)
+
+        with mock.patch.object(server.updater, "API_URL", self.api.api_url), mock.patch.object(
+            server.updater, "cache", {}
+        ):
+            server.add_scripts(self.server_path)
+        with open(os.path.join(self.server_path, JAR_NAME), "wb") as f:
+            f.write(b"jar")
+
+        self.java_path = os.path.join(self.directory, "java")
+        with open(self.java_path, "w") as f:
+            f.write(f"#!{sys.executable}\n{STUB_JAVA}")
+        os.chmod(self.java_path, os.stat(self.java_path).st_mode | stat.S_IEXEC)
+        self.java_log = os.path.join(self.directory, "java.log")
+        self.write_settings({})
+
+    def write_settings(self, settings):
+        with open(os.path.join(self.server_path, "start.json"), "w") as f:
+            json.dump({"java": self.java_path, "max_heap": "2G", **settings}, f)
+
+    def start(self, *arguments, java_version="21.0.2"):
+        """
+        Run start.py in the server directory.
+
+        Returns:
+            A tuple of the finished process and the argument lists java was run with.
+        """
+
+        if os.path.exists(self.java_log):
+            os.remove(self.java_log)
+        environment = dict(
+            os.environ,
+            STUB_JAVA_LOG=self.java_log,
+            STUB_JAVA_VERSION=java_version,
+            PAPERMC_API_URL=self.api.api_url,
+            PAPERMC_JAR_STORE=os.path.join(self.directory, "store"),
+        )
+        process = subprocess.run(
+            [sys.executable, "start.py", *arguments],
+            cwd=self.server_path,
+            env=environment,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        calls = []
+        if os.path.exists(self.java_log):
+            with open(self.java_log) as f:
+                calls = [json.loads(line) for line in f]
+        return process, calls
+
+    def server_command(self, calls):
+        """
+        Get the arguments java was started with to run the server, as opposed to asked for its version.
+        """
+
+        commands = [call for call in calls if call != ["-version"]]
+        self.assertEqual(len(commands), 1, calls)
+        return commands[0]
+
+    def load_start(self):
+        """
+        Import start.py, without running it.
+
+        Returns:
+            The start module.
+        """
+
+        sys.path.insert(0, self.server_path)
+        self.addCleanup(sys.path.remove, self.server_path)
+        self.addCleanup(sys.modules.pop, "update", None)
+        spec = importlib.util.spec_from_file_location("start", os.path.join(self.server_path, "start.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+
+class JavaCommandTest(StartTestCase):
+    def test_server_is_started_with_the_settings(self):
+        self.write_settings({"jvm_args": ["-Dfile.encoding=UTF-8"]})
+        process, calls = self.start("--update", "skip")
+
+        self.assertEqual(process.returncode, 0, process.stderr)
+        command = self.server_command(calls)
+        self.assertEqual(command[:2], ["-Xms1024M", "-Xmx2048M"])
+        self.assertIn("-XX:+UseG1GC", command)
+        self.assertNotIn("-XX:+AlwaysPreTouch", command)
+        self.assertEqual(command[-4:], ["-Dfile.encoding=UTF-8", "-jar", JAR_NAME, "nogui"])
+
+    def test_pretouch_commits_the_whole_heap(self):
+        self.write_settings({"pretouch": True})
+        command = self.server_command(self.start("--update", "skip")[1])
+
+        self.assertEqual(command[:2], ["-Xms2048M", "-Xmx2048M"])
+        self.assertIn("-XX:+AlwaysPreTouch", command)
+
+    def test_gc_flags_can_be_turned_off(self):
+        self.write_settings({"gc_flags": False, "cds": False})
+        command = self.server_command(self.start("--update", "skip")[1])
+
+        self.assertEqual(command, ["-Xms1024M", "-Xmx2048M", "-jar", JAR_NAME, "nogui"])
+
+    def test_timings_are_recorded(self):
+        process, _ = self.start("--update", "skip", "--timings")
+
+        self.assertEqual(process.returncode, 0, process.stderr)
+        with open(os.path.join(self.server_path, server.updater.TIMINGS_HISTORY_PATH)) as f:
+            (run,) = [json.loads(line) for line in f]
+        self.assertEqual(run["command"][1:], ["--update", "skip", "--timings"])
+        self.assertEqual([span["name"] for span in run["spans"]][:2], ["apply staged", "java command"])
+        self.assertIn("java command", process.stderr)
+
+    def test_no_jar_and_no_api_exits_with_a_message(self):
+        os.remove(os.path.join(self.server_path, JAR_NAME))
+        self.api.stop()
+        process, calls = self.start("--update", "skip")
+
+        self.assertEqual(process.returncode, 1)
+        self.assertIn("Could not download PaperMC", process.stderr)
+        self.assertNotIn("Traceback", process.stderr)
+        self.assertEqual(calls, [])
+
+
+class StagedUpdateTest(StartTestCase):
+    OLD_JAR = f"paper-{MC_VERSION}-{BUILD - 1}.jar"
+
+    def setUp(self):
+        super().setUp()
+        os.replace(os.path.join(self.server_path, JAR_NAME), os.path.join(self.server_path, self.OLD_JAR))
+        self.staging_directory = os.path.join(self.server_path, server.updater.STAGING_DIR)
+
+    def jars(self):
+        return sorted(name for name in os.listdir(self.server_path) if name.endswith(".jar"))
+
+    def wait_for_background_update(self):
+        """
+        Wait until the background update has staged the new JAR and exited.
+        """
+
+        deadline = time.monotonic() + 30
+        while not os.path.isfile(os.path.join(self.staging_directory, JAR_NAME)):
+            self.assertLess(time.monotonic(), deadline, "The update was not staged.")
+            time.sleep(0.05)
+        # The update holds the staging lock until it exits.
+        with open(os.path.join(self.staging_directory, "lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+    def test_staged_update_is_applied_before_starting(self):
+        os.makedirs(self.staging_directory)
+        with open(os.path.join(self.staging_directory, JAR_NAME), "wb") as f:
+            f.write(b"new jar")
+
+        process, calls = self.start("--update", "skip")
+
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertEqual(self.server_command(calls)[-2:], [JAR_NAME, "nogui"])
+        self.assertEqual(self.jars(), [JAR_NAME])
+        self.assertEqual(os.listdir(self.staging_directory), [])
+
+    def test_background_update_is_used_on_the_next_start(self):
+        process, calls = self.start("--update", "background")
+
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertEqual(self.server_command(calls)[-2:], [self.OLD_JAR, "nogui"])
+        self.wait_for_background_update()
+        self.assertEqual(self.jars(), [self.OLD_JAR])
+
+        process, calls = self.start("--update", "skip")
+
+        self.assertEqual(self.server_command(calls)[-2:], [JAR_NAME, "nogui"])
+        self.assertEqual(self.jars(), [JAR_NAME])
+        with open(os.path.join(self.server_path, JAR_NAME), "rb") as f:
+            self.assertEqual(f.read(), self.api.jar)
+
+    def test_dry_run_doesnt_apply_the_staged_update(self):
+        os.makedirs(self.staging_directory)
+        open(os.path.join(self.staging_directory, JAR_NAME), "w").close()
+
+        process, _ = self.start("--dry-run")
+
+        self.assertIn(self.OLD_JAR, process.stdout)
+        self.assertEqual(self.jars(), [self.OLD_JAR])
+
+
+class CdsTest(StartTestCase):
+    def archive(self, version):
+        return os.path.join(".cds", f"{os.path.splitext(JAR_NAME)[0]}-java{version}.jsa")
+
+    def test_java_8_has_no_archive(self):
+        command = self.server_command(self.start("--update", "skip", java_version="1.8.0_392")[1])
+
+        self.assertFalse([argument for argument in command if "Archive" in argument])
+        self.assertFalse(os.path.exists(os.path.join(self.server_path, ".cds")))
+
+    def test_java_17_creates_the_archive_at_exit_then_uses_it(self):
+        command = self.server_command(self.start("--update", "skip", java_version="17.0.2")[1])
+        self.assertIn(f"-XX:ArchiveClassesAtExit={self.archive('17.0.2')}", command)
+
+        # The JVM would have written it when the server stopped.
+        open(os.path.join(self.server_path, self.archive("17.0.2")), "w").close()
+        command = self.server_command(self.start("--update", "skip", java_version="17.0.2")[1])
+        self.assertIn(f"-XX:SharedArchiveFile={self.archive('17.0.2')}", command)
+        self.assertFalse([argument for argument in command if "ArchiveClassesAtExit" in argument])
+
+    def test_java_21_creates_the_archive_automatically(self):
+        command = self.server_command(self.start("--update", "skip", java_version="21.0.2")[1])
+
+        self.assertIn("-XX:+AutoCreateSharedArchive", command)
+        self.assertIn(f"-XX:SharedArchiveFile={self.archive('21.0.2')}", command)
+
+    def test_archives_of_other_versions_are_deleted(self):
+        old_archive = os.path.join(self.server_path, self.archive("17.0.2"))
+        os.makedirs(os.path.dirname(old_archive))
+        open(old_archive, "w").close()
+
+        self.start("--update", "skip", java_version="21.0.2")
+        self.assertFalse(os.path.exists(old_archive))
+
+    def test_dry_run_prints_the_command_without_touching_the_disk(self):
+        old_archive = os.path.join(self.server_path, self.archive("17.0.2"))
+        os.makedirs(os.path.dirname(old_archive))
+        open(old_archive, "w").close()
+
+        process, calls = self.start("--dry-run", java_version="21.0.2")
+
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertIn(f"-XX:SharedArchiveFile={self.archive('21.0.2')}", process.stdout)
+        self.assertEqual(calls, [["-version"]])
+        self.assertTrue(os.path.exists(old_archive))
+
+    def test_dry_run_doesnt_create_the_archive_directory(self):
+        self.start("--dry-run", java_version="17.0.2")
+
+        self.assertFalse(os.path.exists(os.path.join(self.server_path, ".cds")))
+
+
+class HeapSizeTest(StartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start_module = self.load_start()
+
+    def heap_size(self, settings, total=8 * GIB, free=8 * GIB, servers=1):
+        with mock.patch.object(self.start_module, "host_memory", return_value=(total, free)), mock.patch.object(
+            self.start_module, "server_count", return_value=servers
+        ):
+            return self.start_module.heap_size(settings)
+
+    def test_budget_is_split_between_servers(self):
+        # 70% of 6 GiB is 4.2 GiB, and a third of it rounded down to 256 MiB is 1280 MiB.
+        self.assertEqual(self.heap_size({}, total=6 * GIB, free=6 * GIB, servers=3), (1024, 1280))
+
+    def test_free_memory_limits_the_heap(self):
+        self.assertEqual(self.heap_size({}, total=64 * GIB, free=4 * GIB), (1024, 2816))
+
+    def test_heap_is_clamped(self):
+        self.assertEqual(self.heap_size({}, total=GIB, free=GIB), (1024, 1024))
+        self.assertEqual(self.heap_size({}, total=256 * GIB, free=256 * GIB), (1024, 16384))
+
+    def test_unknown_memory_uses_a_default(self):
+        self.assertEqual(self.heap_size({}, total=None, free=None), (1024, 4096))
+
+    def test_settings_override_the_sizes(self):
+        self.assertEqual(self.heap_size({"max_heap": "6G"}), (1024, 6144))
+        self.assertEqual(self.heap_size({"max_heap": "6G", "min_heap": "2048M"}), (2048, 6144))
+        self.assertEqual(self.heap_size({"max_heap": "6G", "pretouch": True}), (6144, 6144))
+        self.assertEqual(self.heap_size({"heap_fraction": 0.5}, total=8 * GIB, free=8 * GIB), (1024, 4096))
+
+    def test_sizes_are_parsed_in_mib(self):
+        self.assertEqual(self.start_module.parse_size("512K"), 1)
+        self.assertEqual(self.start_module.parse_size("1536"), 1536)
+        self.assertEqual(self.start_module.parse_size("2g"), 2048)
+        for size in ["0G", "1T", "lots"]:
+            with self.assertRaises(SystemExit), mock.patch("sys.stderr"):
+                self.start_module.parse_size(size)
+
+    def test_large_heaps_get_larger_regions(self):
+        self.assertIn("-XX:G1HeapRegionSize=8M", self.start_module.g1_flags(4096))
+        self.assertIn("-XX:G1HeapRegionSize=16M", self.start_module.g1_flags(12 * 1024))
+        self.assertNotIn("-XX:+AlwaysPreTouch", self.start_module.g1_flags(12 * 1024))
+
+
+class CgroupMemoryTest(StartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start_module = self.load_start()
+        self.root = os.path.join(self.directory, "root")
+
+    def write(self, path, content):
+        path = os.path.join(self.root, path.lstrip("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+    def cgroup_memory(self):
+        def fake_open(path, *args, **kwargs):
+            if path == "/proc/self/cgroup" or path.startswith("/sys/fs/cgroup"):
+                path = os.path.join(self.root, path.lstrip("/"))
+            return builtins.open(path, *args, **kwargs)
+
+        with mock.patch.object(self.start_module, "open", fake_open, create=True):
+            return self.start_module.cgroup_memory()
+
+    def test_cgroup_v2_limit(self):
+        self.write("/proc/self/cgroup", "0::/system.slice/minecraft.service\n")
+        self.write("/sys/fs/cgroup/system.slice/minecraft.service/memory.max", f"{4 * GIB}\n")
+        self.write("/sys/fs/cgroup/system.slice/minecraft.service/memory.current", f"{GIB}\n")
+        self.write("/sys/fs/cgroup/system.slice/memory.max", "max\n")
+        self.write("/sys/fs/cgroup/system.slice/memory.current", f"{2 * GIB}\n")
+
+        self.assertEqual(self.cgroup_memory(), (4 * GIB, 3 * GIB))
+
+    def test_cgroup_v2_parent_limit_applies(self):
+        self.write("/proc/self/cgroup", "0::/machine.slice/minecraft\n")
+        self.write("/sys/fs/cgroup/machine.slice/minecraft/memory.max", "max\n")
+        self.write("/sys/fs/cgroup/machine.slice/minecraft/memory.current", f"{GIB}\n")
+        self.write("/sys/fs/cgroup/machine.slice/memory.max", f"{2 * GIB}\n")
+        self.write("/sys/fs/cgroup/machine.slice/memory.current", f"{GIB // 2 * 3}\n")
+
+        self.assertEqual(self.cgroup_memory(), (2 * GIB, GIB // 2))
+
+    def test_cgroup_v1_limit(self):
+        self.write("/proc/self/cgroup", "5:cpu,cpuacct:/docker/abc\n4:memory:/docker/abc\n")
+        self.write("/sys/fs/cgroup/memory/docker/abc/memory.limit_in_bytes", f"{3 * GIB}\n")
+        self.write("/sys/fs/cgroup/memory/docker/abc/memory.usage_in_bytes", f"{GIB}\n")
+
+        self.assertEqual(self.cgroup_memory(), (3 * GIB, 2 * GIB))
+
+    def test_unlimited_cgroups(self):
+        self.write("/proc/self/cgroup", "4:memory:/user.slice\n")
+        self.write("/sys/fs/cgroup/memory/user.slice/memory.limit_in_bytes", "9223372036854771712\n")
+        self.write("/sys/fs/cgroup/memory/user.slice/memory.usage_in_bytes", f"{GIB}\n")
+
+        self.assertIsNone(self.cgroup_memory())
+
+    def test_no_cgroups(self):
+        self.assertIsNone(self.cgroup_memory())
+
+
+if __name__ == "__main__":
+    unittest.main()
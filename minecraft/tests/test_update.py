@@ -0,0 +1,442 @@
+"""
+Tests for the generated update.py, run against a local fake of the PaperMC API.
+
+Run from the repository root with 'python -m unittest discover minecraft/tests'.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import warnings
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server  # noqa: E402
+from fake_papermc import BUILD, JAR_NAME, MC_VERSION, FakePaperMC  # noqa: E402
+
+
+class UpdateTestCase(unittest.TestCase):
+    delay = 0
+
+    def setUp(self):
+        # The updater keeps its connections open for the next request, which never comes in a test.
+        warnings.simplefilter("ignore", ResourceWarning)
+        self.api = FakePaperMC(delay=self.delay).start()
+        self.addCleanup(self.api.stop)
+        self.directory = tempfile.mkdtemp(prefix="mc-update-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+        previous = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(os.chdir, previous)
+        self.updater = self.load_updater()
+
+    def load_updater(self):
+        """
+        Load a fresh copy of update.py that talks to the fake API, as a server's next run would.
+
+        Returns:
+            The update module.
+        """
+
+        updater = server.load_updater()
+        updater.API_URL = self.api.api_url
+        updater.STORE_DIR = os.path.join(self.directory, "store")
+        updater.load_cache()
+        return updater
+
+
+class CacheTest(UpdateTestCase):
+    def test_fresh_entries_skip_the_api(self):
+        first = self.updater.fetch_json(self.api.api_url, 60)
+        second = self.updater.fetch_json(self.api.api_url, 60)
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.api.requests_for("/v2/projects/paper")), 1)
+
+    def test_stale_entries_are_revalidated_with_their_etag(self):
+        data = self.updater.fetch_json(self.api.api_url, 60)
+        self.updater.cache[self.api.api_url]["fetched"] = 0
+
+        self.assertEqual(self.updater.fetch_json(self.api.api_url, 60), data)
+        (_, first_headers, _), (_, headers, status) = self.api.requests_for("/v2/projects/paper")
+        self.assertNotIn("If-None-Match", first_headers)
+        self.assertEqual(headers["If-None-Match"], self.updater.cache[self.api.api_url]["etag"])
+        self.assertEqual(status, 304)
+        self.assertGreater(self.updater.cache[self.api.api_url]["fetched"], time.time() - 60)
+
+    def test_cache_is_kept_between_runs(self):
+        self.updater.fetch_json(self.api.api_url, 60)
+
+        self.assertTrue(os.path.isfile(self.updater.CACHE_PATH))
+        self.assertEqual(self.load_updater().fetch_json(self.api.api_url, 60)["versions"][-1], MC_VERSION)
+        self.assertEqual(len(self.api.requests_for("/v2/projects/paper")), 1)
+
+    def test_offline_only_uses_the_cache(self):
+        self.updater.fetch_json(self.api.api_url, 60)
+        self.updater.cache[self.api.api_url]["fetched"] = 0
+        self.updater.args = self.updater.parser.parse_args(["--offline"])
+
+        self.assertEqual(self.updater.latest_mc_version(60), MC_VERSION)
+        with self.assertRaises(urllib.error.URLError):
+            self.updater.latest_build(MC_VERSION, 60)
+        self.assertEqual(len(self.api.requests), 1)
+
+    def test_unreachable_api_falls_back_to_the_cache(self):
+        self.updater.fetch_json(self.api.api_url, 60)
+        self.updater.cache[self.api.api_url]["fetched"] = 0
+        self.api.stop()
+
+        self.assertEqual(self.updater.latest_mc_version(60), MC_VERSION)
+        with self.assertRaises(OSError):
+            self.updater.latest_build(MC_VERSION, 60)
+
+    def test_server_starts_with_the_current_jar_when_the_api_is_down(self):
+        self.assertEqual(self.updater.main(["--quiet"]), 0)
+        jar_name = self.updater.install(MC_VERSION, self.updater.latest_build(MC_VERSION))
+        self.api.stop()
+
+        updater = self.load_updater()
+        updater.cache.clear()
+        self.assertEqual(updater.main(["--quiet"]), 0)
+        self.assertTrue(os.path.isfile(jar_name))
+
+
+class DownloadTest(UpdateTestCase):
+    # Long enough for the downloads to overlap if they run at once.
+    delay = 0.1
+
+    def setUp(self):
+        super().setUp()
+        self.api.plugins = {f"plugin-{i}.jar": os.urandom(1000 + i) for i in range(6)}
+        self.write_plugins([{"url": f"{self.api.url}/plugins/{name}"} for name in self.api.plugins])
+
+    def write_plugins(self, plugins):
+        with open(self.updater.PLUGINS_PATH, "w") as f:
+            json.dump({"plugins": plugins}, f)
+
+    def test_downloads_run_at_once_over_reused_connections(self):
+        self.assertEqual(self.updater.main(["--jobs", "4", "--quiet"]), 0)
+
+        for name, data in self.api.plugins.items():
+            with open(os.path.join(self.updater.PLUGINS_DIR, name), "rb") as f:
+                self.assertEqual(f.read(), data)
+        with open(JAR_NAME, "rb") as f:
+            self.assertEqual(f.read(), self.api.jar)
+        self.assertGreater(self.api.max_active, 1)
+        # One connection per download thread, and one for resolving the version.
+        self.assertLessEqual(self.api.connections, 4 + 1)
+        self.assertGreater(len(self.api.requests), self.api.connections)
+
+    def test_unchanged_plugins_are_not_downloaded_again(self):
+        self.assertEqual(self.updater.main(["--quiet"]), 0)
+        count = len(self.api.requests)
+
+        self.assertEqual(self.load_updater().main(["--quiet"]), 0)
+        plugin_requests = [request for request in self.api.requests[count:] if request[0].startswith("/plugins/")]
+        self.assertEqual(len(plugin_requests), len(self.api.plugins))
+        self.assertEqual({status for _, _, status in plugin_requests}, {304})
+
+    def test_checksum_mismatch_installs_nothing(self):
+        name, data = next(iter(self.api.plugins.items()))
+        self.write_plugins([{"url": f"{self.api.url}/plugins/{name}", "sha256": hashlib.sha256(b"other").hexdigest()}])
+
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            self.assertEqual(self.updater.main(["--quiet"]), 1)
+        self.assertIn("Checksum mismatch", stderr.getvalue())
+        self.assertFalse(os.path.exists(os.path.join(self.updater.PLUGINS_DIR, name)))
+
+
+class PartialDownloadTest(UpdateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.directory, JAR_NAME)
+        self.jar_path = f"/v2/projects/paper/versions/{MC_VERSION}/builds/{BUILD}/downloads/{JAR_NAME}"
+        self.url = f"{self.api.url}{self.jar_path}"
+        self.sha256 = hashlib.sha256(self.api.jar).hexdigest()
+
+    def write_part(self, data):
+        with open(f"{self.path}.part", "wb") as f:
+            f.write(data)
+
+    def assertDownloaded(self):
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), self.api.jar)
+        self.assertFalse(os.path.exists(f"{self.path}.part"))
+
+    def test_partial_download_is_resumed(self):
+        half = len(self.api.jar) // 2
+        self.write_part(self.api.jar[:half])
+
+        self.assertTrue(self.updater.download(self.url, self.path, self.sha256))
+        self.assertDownloaded()
+        ((_, headers, status),) = self.api.requests_for(self.jar_path)
+        self.assertEqual(headers["Range"], f"bytes={half}-")
+        self.assertEqual(status, 206)
+
+    def test_complete_partial_download_is_kept(self):
+        self.write_part(self.api.jar)
+
+        self.assertTrue(self.updater.download(self.url, self.path, self.sha256))
+        self.assertDownloaded()
+        self.assertEqual([status for _, _, status in self.api.requests_for(self.jar_path)], [416])
+
+    def test_server_ignoring_the_range_sends_everything_again(self):
+        self.api.ignore_range = True
+        self.write_part(self.api.jar[:1000])
+
+        self.assertTrue(self.updater.download(self.url, self.path, self.sha256))
+        self.assertDownloaded()
+        self.assertEqual([status for _, _, status in self.api.requests_for(self.jar_path)], [200])
+
+    def test_corrupt_partial_download_is_downloaded_again(self):
+        self.write_part(os.urandom(1000))
+
+        self.assertTrue(self.updater.download(self.url, self.path, self.sha256))
+        self.assertDownloaded()
+        self.assertEqual([status for _, _, status in self.api.requests_for(self.jar_path)], [206, 200])
+
+    def test_checksum_mismatch_deletes_the_download(self):
+        self.assertFalse(self.updater.download(self.url, self.path, hashlib.sha256(b"other").hexdigest()))
+
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(f"{self.path}.part"))
+        self.assertEqual(len(self.api.requests_for(self.jar_path)), 1)
+
+
+class StoreTest(UpdateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.updater.args = self.updater.parser.parse_args(["--quiet"])
+
+    def store_path(self, data):
+        return os.path.join(self.updater.STORE_DIR, f"{hashlib.sha256(data).hexdigest()}.jar")
+
+    def add_orphan(self, data):
+        """
+        Put an object in the store that no server references, old enough to be collected.
+        """
+
+        path = self.store_path(data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        os.utime(path, (0, 0))
+        return path
+
+    def test_copied_jar_keeps_its_reference(self):
+        # Neither kind of link works, as across filesystems without symlink permissions.
+        with mock.patch("os.link", side_effect=OSError), mock.patch("os.symlink", side_effect=OSError):
+            self.assertEqual(self.updater.main(["--quiet"]), 0)
+        self.assertFalse(os.path.samefile(JAR_NAME, self.store_path(self.api.jar)))
+
+        self.updater.collect_garbage()
+        self.assertTrue(os.path.isfile(self.store_path(self.api.jar)))
+        self.assertEqual(self.updater.find_ref(JAR_NAME), hashlib.sha256(self.api.jar).hexdigest())
+
+    def test_replaced_jar_releases_the_object(self):
+        self.assertEqual(self.updater.main(["--quiet"]), 0)
+        os.remove(JAR_NAME)
+        with open(JAR_NAME, "wb") as f:
+            f.write(b"patched")
+
+        self.updater.collect_garbage()
+        self.assertFalse(os.path.exists(self.store_path(self.api.jar)))
+
+    def test_locked_object_is_not_collected(self):
+        path = self.add_orphan(b"installing")
+        with open(f"{path}.lock", "w") as lock_file:
+            # Another server's install holds the lock between finding the object and adding its reference.
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.updater.collect_garbage()
+            self.assertTrue(os.path.isfile(path))
+
+        self.updater.collect_garbage()
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.isfile(f"{path}.lock"))
+
+    def test_recent_orphans_are_kept(self):
+        path = self.add_orphan(b"downloading")
+        os.utime(path)
+
+        self.updater.collect_garbage()
+        self.assertTrue(os.path.isfile(path))
+
+
+class StageTest(UpdateTestCase):
+    OLD_JAR = f"paper-{MC_VERSION}-{BUILD - 1}.jar"
+
+    def setUp(self):
+        super().setUp()
+        with open(self.OLD_JAR, "wb") as f:
+            f.write(b"old")
+        self.staged_path = os.path.join(self.updater.STAGING_DIR, JAR_NAME)
+
+    def test_update_is_staged_without_touching_the_current_jar(self):
+        self.assertEqual(self.updater.main(["--quiet", "--stage"]), 0)
+
+        with open(self.staged_path, "rb") as f:
+            self.assertEqual(f.read(), self.api.jar)
+        self.assertEqual(sorted(name for name in os.listdir() if name.endswith(".jar")), [self.OLD_JAR])
+
+    def test_staged_update_is_applied(self):
+        self.assertEqual(self.updater.main(["--quiet", "--stage"]), 0)
+
+        self.assertEqual(self.updater.main(["--quiet", "--apply-staged"]), 0)
+
+        self.assertEqual(sorted(name for name in os.listdir() if name.endswith(".jar")), [JAR_NAME])
+        self.assertFalse(os.path.exists(self.staged_path))
+        # The JAR still comes from the store, so it isn't collected as unused.
+        self.assertEqual(self.updater.find_ref(JAR_NAME), hashlib.sha256(self.api.jar).hexdigest())
+        self.updater.collect_garbage()
+        sha256 = hashlib.sha256(self.api.jar).hexdigest()
+        self.assertTrue(os.path.isfile(os.path.join(self.updater.STORE_DIR, f"{sha256}.jar")))
+
+    def test_nothing_staged(self):
+        self.assertEqual(self.updater.main(["--quiet", "--apply-staged"]), 0)
+
+        self.assertEqual(sorted(name for name in os.listdir() if name.endswith(".jar")), [self.OLD_JAR])
+        self.assertEqual(self.api.requests, [])
+
+    def test_older_staged_update_is_replaced(self):
+        old_staged_path = os.path.join(self.updater.STAGING_DIR, self.OLD_JAR)
+        os.makedirs(self.updater.STAGING_DIR)
+        with open(old_staged_path, "wb") as f:
+            f.write(b"old")
+
+        self.assertEqual(self.updater.main(["--quiet", "--stage"]), 0)
+
+        self.assertEqual([name for name in os.listdir(self.updater.STAGING_DIR) if name.endswith(".jar")], [JAR_NAME])
+
+    def test_staged_update_is_not_downloaded_again(self):
+        self.assertEqual(self.updater.main(["--quiet", "--stage"]), 0)
+
+        self.assertEqual(self.load_updater().main(["--quiet", "--stage"]), 0)
+
+        jar_path = f"/v2/projects/paper/versions/{MC_VERSION}/builds/{BUILD}/downloads/{JAR_NAME}"
+        self.assertEqual(len(self.api.requests_for(jar_path)), 1)
+
+    def test_only_one_update_is_staged_at_a_time(self):
+        os.makedirs(self.updater.STAGING_DIR)
+        with open(os.path.join(self.updater.STAGING_DIR, "lock"), "w") as lock_file:
+            # Another background update is still downloading.
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.assertEqual(self.updater.main(["--quiet", "--stage"]), 0)
+
+        self.assertFalse(os.path.exists(self.staged_path))
+        self.assertEqual(self.api.requests, [])
+
+
+class TracerTest(UpdateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tracer = self.updater.Tracer()
+        self.tracer.enabled = True
+
+    def history(self):
+        with open(self.updater.TIMINGS_HISTORY_PATH) as f:
+            return [json.loads(line) for line in f]
+
+    def test_disabled_tracer_records_nothing(self):
+        self.tracer.enabled = False
+
+        with self.tracer.span("download", url="x") as span:
+            span["bytes"] = 10
+
+        self.assertEqual(span, {"url": "x", "bytes": 10})
+        self.assertEqual(self.tracer.spans, [])
+
+    def test_spans_nest_within_a_thread(self):
+        with self.tracer.span("downloads", plugins=2):
+            with self.tracer.span("plugin", plugin="a.jar") as span:
+                span["bytes"] = 1000
+            worker = threading.Thread(target=self.run_span, args=("plugin",), name="worker")
+            worker.start()
+            worker.join()
+
+        spans = {(span["name"], span["thread"], span["attributes"].get("plugin")): span for span in self.tracer.spans}
+        main_thread = threading.current_thread().name
+        self.assertEqual(spans["downloads", main_thread, None]["parent"], None)
+        self.assertEqual(spans["plugin", main_thread, "a.jar"]["parent"], "downloads")
+        self.assertEqual(spans["plugin", main_thread, "a.jar"]["depth"], 1)
+        self.assertEqual(spans["plugin", main_thread, "a.jar"]["attributes"], {"plugin": "a.jar", "bytes": 1000})
+        # Spans in other threads don't nest in the spans open in this one.
+        self.assertEqual(spans["plugin", "worker", None]["parent"], None)
+        for span in self.tracer.spans:
+            for key in ["start", "duration", "cpu", "children_cpu", "disk_read", "disk_written", "peak_rss"]:
+                self.assertIn(key, span)
+
+    def run_span(self, name):
+        with self.tracer.span(name):
+            pass
+
+    def test_runs_are_added_to_the_history(self):
+        with self.tracer.span("resolve version"):
+            pass
+        self.tracer.finish(["update.py", "--timings"], False, None)
+        self.tracer.finish(["update.py"], False, None)
+
+        first, second = self.history()
+        self.assertEqual(first["command"], ["update.py", "--timings"])
+        self.assertEqual([span["name"] for span in first["spans"]], ["resolve version"])
+        self.assertGreaterEqual(first["duration"], first["spans"][0]["duration"])
+        self.assertEqual(second["command"], ["update.py"])
+
+    def test_trace_file(self):
+        with self.tracer.span("downloads"):
+            with self.tracer.span("install", build=BUILD):
+                pass
+        self.tracer.finish(["update.py"], False, "trace.json")
+
+        with open("trace.json") as f:
+            events = json.load(f)["traceEvents"]
+        spans = [event for event in events if event["ph"] == "X"]
+        self.assertEqual([event["name"] for event in spans], ["downloads", "install"])
+        self.assertEqual(spans[1]["args"]["build"], BUILD)
+        self.assertEqual(spans[1]["args"]["parent"], "downloads")
+        self.assertLessEqual(spans[0]["ts"], spans[1]["ts"])
+        self.assertEqual(
+            [event["args"]["name"] for event in events if event["ph"] == "M"], [threading.current_thread().name]
+        )
+
+    def test_timings_table(self):
+        with self.tracer.span("downloads"):
+            with self.tracer.span("install", build=BUILD):
+                pass
+        stderr = io.StringIO()
+
+        with contextlib.redirect_stderr(stderr):
+            self.tracer.finish(["update.py"], True, None)
+
+        lines = stderr.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith("PHASE"))
+        self.assertEqual([line.split("  ")[0] for line in lines[1:3]], ["total", "downloads"])
+        self.assertTrue(lines[3].startswith("  install "))
+        self.assertTrue(lines[3].endswith(f"build={BUILD}"))
+
+    def test_update_records_its_run(self):
+        stderr = io.StringIO()
+
+        with contextlib.redirect_stderr(stderr):
+            self.assertEqual(self.updater.main(["--quiet", "--timings"]), 0)
+
+        (run,) = self.history()
+        self.assertEqual(run["command"][1:], ["--quiet", "--timings"])
+        names = [span["name"] for span in run["spans"]]
+        for name in ["resolve version", "downloads", "download"]:
+            self.assertIn(name, names)
+        self.assertIn("resolve version", stderr.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
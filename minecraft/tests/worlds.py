@@ -0,0 +1,174 @@
+"""
+Builders for the NBT data, region files and world directories the world and backup tests work on.
+
+They are written independently of the parser in server.py, following the formats Minecraft uses.
+"""
+
+import gzip
+import os
+import struct
+import zlib
+
+SECTOR_SIZE = 4096
+
+
+def tag(tag_type, name, payload):
+    return bytes([tag_type]) + struct.pack(">H", len(name)) + name.encode() + payload
+
+
+def compound_payload(*tags):
+    return b"".join(tags) + b"\x00"
+
+
+def int_tag(name, value):
+    return tag(3, name, struct.pack(">i", value))
+
+
+def long_tag(name, value):
+    return tag(4, name, struct.pack(">q", value))
+
+
+def string_tag(name, value):
+    return tag(8, name, struct.pack(">H", len(value.encode())) + value.encode())
+
+
+def long_array_tag(name, values):
+    return tag(12, name, struct.pack(f">i{len(values)}q", len(values), *values))
+
+
+def compound_tag(name, *tags):
+    return tag(10, name, compound_payload(*tags))
+
+
+def compound_list_tag(name, compounds):
+    return tag(9, name, bytes([10]) + struct.pack(">i", len(compounds)) + b"".join(compounds))
+
+
+def chunk_nbt(x, z, inhabited_time, legacy=False, filler=0):
+    """
+    Build the NBT of a chunk, with sections and heightmaps in between the tags that are looked up.
+
+    Args:
+        x (int): The chunk's x coordinate.
+        z (int): The chunk's z coordinate.
+        inhabited_time (int): How long players spent in the chunk, in ticks.
+        legacy (bool): Put the chunk's tags under 'Level', as Minecraft did before 1.18.
+        filler (int): Extra longs of block data, to make the chunk larger.
+
+    Returns:
+        The uncompressed NBT data.
+    """
+
+    section = compound_payload(
+        compound_tag(
+            "block_states",
+            compound_list_tag("palette", [compound_payload(string_tag("Name", "minecraft:stone"))]),
+            long_array_tag("data", list(range(filler))),
+        ),
+        tag(1, "Y", struct.pack(">b", -4)),
+    )
+    tags = [
+        int_tag("xPos", x),
+        int_tag("zPos", z),
+        string_tag("Status", "minecraft:full"),
+        compound_list_tag("sections", [section, section]),
+        compound_tag("Heightmaps", long_array_tag("WORLD_SURFACE", [7] * 37)),
+        long_tag("InhabitedTime", inhabited_time),
+        tag(5, "LightLevel", struct.pack(">f", 1.5)),
+    ]
+    if legacy:
+        return compound_tag("", int_tag("DataVersion", 1343), compound_tag("Level", *tags))
+    return compound_tag("", int_tag("DataVersion", 3953), *tags)
+
+
+def chunk_record(data, compression=2):
+    """
+    Compress chunk NBT into a record as stored in a region file: a 4-byte length, the compression type and the data.
+    """
+
+    compressed = {1: gzip.compress, 2: zlib.compress, 3: bytes}[compression](data)
+    return struct.pack(">I", len(compressed) + 1) + bytes([compression]) + compressed
+
+
+def write_region_file(path, chunks, gap=0):
+    """
+    Write a region file.
+
+    Args:
+        path (str): The region file.
+        chunks (dict): (timestamp, record) tuples keyed by chunk index.
+        gap (int): Unused sectors to leave before every chunk, as in files where chunks have moved.
+    """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = bytearray(2 * SECTOR_SIZE)
+    body = b""
+    for index, (timestamp, record) in sorted(chunks.items()):
+        body += bytes(gap * SECTOR_SIZE)
+        sector = 2 + len(body) // SECTOR_SIZE
+        sector_count = -(-len(record) // SECTOR_SIZE)
+        body += record + bytes(sector_count * SECTOR_SIZE - len(record))
+        struct.pack_into(">I", header, index * 4, (sector << 8) | sector_count)
+        struct.pack_into(">I", header, SECTOR_SIZE + index * 4, timestamp)
+    with open(path, "wb") as f:
+        f.write(bytes(header) + body)
+
+
+def region_chunks(region_x, region_z, inhabited_times, timestamp=1700000000, filler=0):
+    """
+    Build the chunks of a region.
+
+    Args:
+        region_x (int): The region's x coordinate.
+        region_z (int): The region's z coordinate.
+        inhabited_times (dict): The InhabitedTime of every chunk, keyed by chunk index.
+        timestamp (int): The chunks' timestamps.
+        filler (int): Extra longs of block data per chunk.
+
+    Returns:
+        (timestamp, record) tuples keyed by chunk index.
+    """
+
+    return {
+        index: (
+            timestamp,
+            chunk_record(chunk_nbt(region_x * 32 + index % 32, region_z * 32 + index // 32, inhabited, filler=filler)),
+        )
+        for index, inhabited in inhabited_times.items()
+    }
+
+
+def write_level_dat(path, spawn_x, spawn_z):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = compound_tag(
+        "",
+        compound_tag("Data", string_tag("LevelName", "world"), int_tag("SpawnX", spawn_x), int_tag("SpawnZ", spawn_z)),
+    )
+    with gzip.open(path, "wb") as f:
+        f.write(data)
+
+
+def make_world(server_path, world_name="world"):
+    """
+    Create the three world saves of a server with a few region files and other files in them.
+
+    Args:
+        server_path (str): The server directory.
+        world_name (str): The name of the world.
+
+    Returns:
+        The world save directories relative to the server directory.
+    """
+
+    world_saves = [world_name, f"{world_name}_nether", f"{world_name}_the_end"]
+    write_level_dat(os.path.join(server_path, world_name, "level.dat"), 0, 0)
+    for x, z in [(0, 0), (-1, 0)]:
+        chunks = region_chunks(x, z, {index: index * 100 for index in range(0, 1024, 37)}, filler=300)
+        write_region_file(os.path.join(server_path, world_name, "region", f"r.{x}.{z}.mca"), chunks)
+    write_region_file(
+        os.path.join(server_path, f"{world_name}_nether", "DIM-1", "region", "r.0.0.mca"), region_chunks(0, 0, {5: 1})
+    )
+    os.makedirs(os.path.join(server_path, f"{world_name}_the_end", "DIM1", "region"))
+    with open(os.path.join(server_path, world_name, "stats.json"), "w") as f:
+        f.write('{"stats": {}}')
+    return world_saves